@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from upload_handling import Buffer
+
+logger = logging.getLogger(__name__)
+
+def content_digest(file_content: Buffer) -> str:
+    """Hash of the uploaded bytes, computed once per upload and shared by every cache"""
+    return hashlib.sha256(file_content).hexdigest()
+
+def content_key(digest: str, *parts: Any) -> str:
+    """Build a cache key from a content digest plus anything that changes the result"""
+    return ':'.join([digest] + [str(part) for part in parts])
+
+def _create_private_file(path: str) -> None:
+    """Create path and any missing parent directories accessible by the owner only"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    # SQLite gives its journal files the database file's permissions
+    os.chmod(path, 0o600)
+
+class ContentCache:
+    """Bounded in-memory LRU in front of an optional SQLite store.
+
+    Values must be JSON serializable. Memory evictions only drop the entry from the
+    LRU; it stays on disk and is promoted back on the next lookup. Entries can
+    hold document text, so a new database directory is created 0700 and the
+    file 0600.
+    """
+
+    def __init__(self, max_entries: int = 128, db_path: Optional[str] = None, max_disk_entries: int = 5000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.db_path = db_path
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'disk_evictions': 0
+        }
+
+        if db_path:
+            try:
+                _create_private_file(db_path)
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS cache_entries ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._db.commit()
+                logger.info(f"Content cache backed by SQLite at {db_path}")
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Failed to open cache database {db_path}: {e}. Using memory only.")
+                self._db = None
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a cached value from memory or disk, or None on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                self.counters['memory_hits'] += 1
+                return json.loads(self._entries[key])
+
+            serialized = self._disk_get(key)
+            if serialized is None:
+                self.counters['misses'] += 1
+                return None
+
+            self.counters['hits'] += 1
+            self.counters['disk_hits'] += 1
+            self._memory_put(key, serialized)
+            return json.loads(serialized)
+
+    def put(self, key: str, value: Any) -> None:
+        """Store a value in memory and, when configured, on disk"""
+        serialized = json.dumps(value)
+        with self._lock:
+            self._memory_put(key, serialized)
+            self._disk_put(key, serialized)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, miss and eviction counters"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+            stats['disk_enabled'] = self._db is not None
+            return stats
+
+    def _memory_put(self, key: str, serialized: str) -> None:
+        # Entries are kept serialized so callers can never mutate a cached value
+        self._entries[key] = serialized
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT value FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Cache database read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, serialized: str) -> None:
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, accessed_at) VALUES (?, ?, ?)",
+                (key, serialized, time.time())
+            )
+            count = self._db.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+            if count > self.max_disk_entries:
+                overflow = count - self.max_disk_entries
+                self._db.execute(
+                    "DELETE FROM cache_entries WHERE key IN "
+                    "(SELECT key FROM cache_entries ORDER BY accessed_at LIMIT ?)",
+                    (overflow,)
+                )
+                self.counters['disk_evictions'] += overflow
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache database write failed: {e}")
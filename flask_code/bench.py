@@ -0,0 +1,452 @@
+"""Micro-benchmarks for the document analysis pipeline.
+
+Run from the flask_code directory:
+
+    python bench.py risk_scanner pathological prefilter key_info pdf_pages upload_memory page_routing \
+        docx_extract dense_index chat_turn chat_stream chat_context
+"""
+import json
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from io import BytesIO
+from typing import Any, Callable, Dict, List
+
+import docx
+import vertexai
+from werkzeug.datastructures import FileStorage
+
+import chatbot
+from chat_models import prefix_digest
+import nego
+import pdf_extraction
+from docx_extraction import iter_docx_lines
+from document_processors import ShardedDocumentProcessor
+from retrieval import BM25Index, Chunk, DenseIndex, HashedNgramEmbedding
+from tests.fakes import FakeDocumentProcessor
+from tests.samples import (SAMPLE_CLAUSES, legacy_pdf_text, legacy_rule_hits, make_contract, make_large_docx, make_pdf,
+                           python_docx_text)
+
+
+def time_call(func: Callable[[], Any], repeat: int = 5) -> float:
+    """Return the best wall-clock time of several runs in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_risk_scanner() -> None:
+    print(f"{'chars':>9} {'legacy ms':>10} {'scanner ms':>11} {'speedup':>8}")
+    for size in (10_000, 50_000, 100_000, 400_000):
+        for risky in (True, False):
+            text = make_contract(size, risky=risky)
+            legacy = time_call(lambda: legacy_rule_hits(text, "", nego.COMPREHENSIVE_RISK_PATTERNS), repeat=3)
+            scanner = time_call(lambda: nego.analyze_risks_with_enhanced_rules(text, "", "general"), repeat=3)
+            label = f"{size:>9}" + ("" if risky else "*")
+            print(f"{label:>9} {legacy:>10.1f} {scanner:>11.1f} {legacy / scanner:>7.1f}x")
+    print("* contract with few risky clauses")
+
+
+PATHOLOGICAL_UNIT = "the provider may terminate the agreement without delay and shall continue "
+
+
+def bench_pathological() -> None:
+    """Single-line input with no clause terminators, the worst case for greedy wildcards"""
+    print(f"{'chars':>9} {'legacy ms':>10} {'scanner ms':>11} {'scanner us/kchar':>17}")
+    for size in (2_000, 4_000, 8_000, 64_000, 256_000, 1_024_000):
+        text = (PATHOLOGICAL_UNIT * (size // len(PATHOLOGICAL_UNIT) + 1))[:size]
+        # The old whole-document evaluation is super-linear; only run it on small inputs
+        legacy = time_call(lambda: legacy_rule_hits(text, "", nego.COMPREHENSIVE_RISK_PATTERNS), repeat=1) if size <= 8_000 else None
+        scanner = time_call(lambda: nego.get_risk_scanner("general").scan(text, time_budget=None), repeat=3)
+        legacy_label = f"{legacy:>10.1f}" if legacy is not None else f"{'-':>10}"
+        print(f"{size:>9} {legacy_label} {scanner:>11.1f} {scanner * 1000 / (size / 1000):>17.1f}")
+
+
+def bench_prefilter() -> None:
+    """Typical contract where only one or two risk types have any anchor present"""
+    scanner = nego.get_risk_scanner("general")
+    backend = "pyahocorasick" if nego.AHOCORASICK_AVAILABLE else "regex"
+    print(f"anchor backend: {backend}")
+    print(f"{'chars':>9} {'candidates':>11} {'all types ms':>13} {'prefilter ms':>13} {'speedup':>8}")
+    for size in (10_000, 50_000, 100_000, 400_000):
+        benign = make_contract(size, risky=False)
+        middle = len(benign) // 2
+        text = benign[:middle] + " " + SAMPLE_CLAUSES[5] + " " + benign[middle:]
+        candidates = scanner.anchor_index.candidate_types(nego.fold_case(text))
+        full = time_call(lambda: scanner.scan(text, time_budget=None, use_prefilter=False), repeat=3)
+        filtered = time_call(lambda: scanner.scan(text, time_budget=None), repeat=3)
+        print(f"{size:>9} {len(candidates):>11} {full:>13.1f} {filtered:>13.1f} {full / filtered:>7.1f}x")
+
+
+LEGACY_KEY_INFO_PATTERNS = [
+    r'between\s+([^,\(]+(?:\([^)]+\))?)\s+(?:and|&)',
+    r'(?:Client|Customer|Buyer|Tenant|Lessee|Contractor|Employee)[:\s]+([^,\.\n]+)',
+    r'(?:Company|Provider|Seller|Landlord|Lessor|Employer)[:\s]+([^,\.\n]+)',
+    r'(?:Corp\.|Corporation|LLC|Ltd\.?|Inc\.?)[,\s]*([^,\.\n]+)',
+    r'"([^"]+)"[,\s]+(?:a|an)\s+(?:corporation|company|LLC)',
+    r'(?:dated?|effective|starting|begins?|ends?|expires?|due|term.*(?:begins|ends))\s+([A-Za-z]+ \d{1,2},? \d{4})',
+    r'(?:on|by|before|after|until|from)\s+([A-Za-z]+ \d{1,2},? \d{4})',
+    r'\b(\d{1,2}[/-]\d{1,2}[/-]\d{4})\b',
+    r'(?:term.*of|period.*of|duration.*of)\s+(\d+\s+(?:years?|months?|days?))',
+    r'\$[\d,]+(?:\.\d{2})?',
+    r'(?:fee|cost|price|amount|payment|salary|wage|penalty|fine|deposit)\s+(?:of\s+)?\$?([\d,]+(?:\.\d{2})?)',
+    r'(?:dollars?|USD)\s+([\d,]+(?:\.\d{2})?)',
+    r'(?:total|sum|aggregate)\s+(?:of\s+)?\$?([\d,]+(?:\.\d{2})?)',
+]
+
+
+def legacy_key_info(text: str) -> List[List[str]]:
+    """The 13 separate findall passes the extractor used before the single tokenizing pass"""
+    return [re.findall(pattern, text, re.IGNORECASE) for pattern in LEGACY_KEY_INFO_PATTERNS]
+
+
+def bench_key_info() -> None:
+    print(f"{'chars':>9} {'legacy ms':>10} {'one-pass ms':>12} {'speedup':>8} {'entities':>9}")
+    for size in (10_000, 100_000, 400_000, 1_000_000):
+        text = make_contract(size)
+        legacy = time_call(lambda: legacy_key_info(text), repeat=3)
+        one_pass = time_call(lambda: nego.extract_key_information_enhanced(text), repeat=3)
+        entities = len(nego.extract_key_information_enhanced(text)["entities"])
+        print(f"{size:>9} {legacy:>10.1f} {one_pass:>12.1f} {legacy / one_pass:>7.1f}x {entities:>9}")
+
+
+def bench_pdf_pages() -> None:
+    """Whole-PDF extraction as the services run it: in a sandbox worker with its page pool"""
+    from document_extraction import create_document_extractor, extract_local_prefix
+
+    cores = os.cpu_count() or 1
+    process_counts = sorted({1, 2, 4, cores})
+    sandbox = create_document_extractor(1).sandbox
+
+    def sandboxed_text(pdf: bytes, processes: int) -> str:
+        return pdf_extraction.format_pdf_pages(sandbox.run(pdf_extraction.extract_pdf_pages, pdf, processes))
+
+    print(f"cores: {cores}")
+    header = "".join(f" {f'{count} proc ms':>11}" for count in process_counts)
+    print(f"{'pages':>6} {'legacy ms':>10}{header} {'default ms':>11} {'best speedup':>13}")
+    for page_count in (10, 50, 150, 300):
+        pdf = make_pdf(page_count)
+        assert sandboxed_text(pdf, 1) == legacy_pdf_text(pdf)
+        legacy = time_call(lambda: legacy_pdf_text(pdf), repeat=2)
+        timings = []
+        for count in process_counts:
+            sandboxed_text(pdf, count)  # start the worker's page pool outside the timing
+            timings.append(time_call(lambda: sandboxed_text(pdf, count), repeat=2))
+        # The unbudgeted call the analyzer makes, with the default process count
+        default = time_call(lambda: sandbox.run(extract_local_prefix, pdf, "application/pdf", None), repeat=2)
+        columns = "".join(f" {timing:>11.1f}" for timing in timings)
+        print(f"{page_count:>6} {legacy:>10.1f}{columns} {default:>11.1f} {legacy / min(timings):>12.1f}x")
+    sandbox.close()
+    print(f"documents under {pdf_extraction.PARALLEL_MIN_PAGES} pages are always parsed in one process")
+
+
+def make_docx_with_media(media_bytes: int) -> bytes:
+    """DOCX with contract text plus a large embedded binary part, like a scanned exhibit"""
+    document = docx.Document()
+    for index in range(200):
+        document.add_paragraph(SAMPLE_CLAUSES[index % len(SAMPLE_CLAUSES)])
+    buffer = BytesIO()
+    document.save(buffer)
+    with zipfile.ZipFile(buffer, "a", compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr("word/media/exhibit.bin", os.urandom(media_bytes))
+    return buffer.getvalue()
+
+
+def _spooled_file(path: str, filename: str) -> FileStorage:
+    """Upload as the routes receive it: the request body already spooled to a temp file"""
+    spool = tempfile.TemporaryFile("wb+")
+    with open(path, "rb") as source:
+        shutil.copyfileobj(source, spool)
+    spool.seek(0)
+    return FileStorage(stream=spool, filename=filename)
+
+
+def proc_status_kb(field: str) -> int:
+    """A memory field of /proc/self/status in KB, or 0 where it is unavailable"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_kb() -> int:
+    """High-water mark of resident memory in KB"""
+    return proc_status_kb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak_rss() -> int:
+    """Reset the high-water mark to the current RSS where Linux allows it and return it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+    return peak_rss_kb()
+
+
+def upload_memory_child(variant: str, path: str, filename: str) -> None:
+    """Handle one upload the old or the new way and print the peak and anonymous RSS it added, in KB"""
+    from analysis_cache import content_digest
+    from upload_handling import map_upload, read_head, upload_size
+
+    file = _spooled_file(path, filename)
+    baseline = reset_peak_rss()
+    anon_baseline = proc_status_kb("RssAnon")
+    if variant == "read":
+        file_content = file.read()
+        mime_type = nego.detect_mime_type(file_content, filename)
+    else:
+        upload_size(file)
+        mime_type = nego.detect_mime_type(read_head(file), filename)
+        file_content = map_upload(file)
+    nego.extract_text_fallback(file_content, mime_type, content_digest(file_content))
+    # Measured while the upload is still referenced, as it is for the rest of a request
+    print(peak_rss_kb() - baseline, proc_status_kb("RssAnon") - anon_baseline)
+
+
+def bench_upload_memory() -> None:
+    """Memory added by one upload, each measurement in a fresh process.
+
+    Peak RSS includes the file-backed pages of the map that hashing and parsing
+    touch; those are page cache the kernel can reclaim. Anonymous RSS is the
+    private memory the request holds on to.
+    """
+    samples = {
+        "contract.pdf": make_pdf(1500),
+        "exhibits.docx": make_docx_with_media(15 * 1024 * 1024),
+    }
+    print(f"{'file':>14} {'MB':>6} {'read() peak':>12} {'mmap peak':>10} {'read() anon':>12} {'mmap anon':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for filename, content in samples.items():
+            path = os.path.join(directory, filename)
+            with open(path, "wb") as handle:
+                handle.write(content)
+            measured = {}
+            for variant in ("read", "mmap"):
+                result = subprocess.run([sys.executable, __file__, "--upload-child", variant, path, filename],
+                                        capture_output=True, text=True, check=True)
+                peak, anon = result.stdout.strip().splitlines()[-1].split()
+                measured[variant] = (int(peak) / 1024, int(anon) / 1024)
+            print(f"{filename:>14} {len(content) / 1024 / 1024:>6.1f} {measured['read'][0]:>12.1f} "
+                  f"{measured['mmap'][0]:>10.1f} {measured['read'][1]:>12.1f} {measured['mmap'][1]:>10.1f}")
+    print("values in MB")
+
+
+def bench_page_routing() -> None:
+    """Whole-document sharding against per-page routing, with a fake processor at 300 ms per call"""
+    print(f"{'pages':>6} {'scanned':>8} {'all pages calls':>16} {'ms':>7} {'routed calls':>13} {'ms':>7}")
+    for page_count, scanned in ((30, []), (60, [0, 59]), (120, list(range(10)) + [119])):
+        pdf = make_pdf(page_count, scanned_pages=scanned)
+        results = []
+        for routed in (False, True):
+            processor = FakeDocumentProcessor(latency=0.3)
+            sharded = ShardedDocumentProcessor(processor, max_in_flight=4)
+            start = time.perf_counter()
+            if routed:
+                sharded.process_scanned_pages(pdf, pdf_extraction.extract_pdf_pages(pdf))
+            else:
+                sharded.process(pdf, "application/pdf")
+            results.append((processor.calls, (time.perf_counter() - start) * 1000))
+        print(f"{page_count:>6} {len(scanned):>8} {results[0][0]:>16} {results[0][1]:>7.0f} "
+              f"{results[1][0]:>13} {results[1][1]:>7.0f}")
+
+
+def streaming_docx_text(file_content: bytes) -> str:
+    return "".join(line + "\n" for line in iter_docx_lines(file_content))
+
+
+def docx_memory_child(variant: str, path: str) -> None:
+    """Extract one DOCX and print the peak RSS it added, in KB"""
+    with open(path, "rb") as handle:
+        file_content = handle.read()
+    baseline = reset_peak_rss()
+    (python_docx_text if variant == "python-docx" else streaming_docx_text)(file_content)
+    print(peak_rss_kb() - baseline)
+
+
+def bench_docx_extract() -> None:
+    print(f"{'paragraphs':>10} {'KB':>5} {'python-docx ms':>15} {'streaming ms':>13} {'speedup':>8} "
+          f"{'python-docx peak MB':>20} {'streaming peak MB':>18}")
+    with tempfile.TemporaryDirectory() as directory:
+        for paragraphs in (1_000, 10_000, 50_000):
+            content = make_large_docx(paragraphs)
+            path = os.path.join(directory, f"{paragraphs}.docx")
+            with open(path, "wb") as handle:
+                handle.write(content)
+            legacy = time_call(lambda: python_docx_text(content), repeat=3)
+            streaming = time_call(lambda: streaming_docx_text(content), repeat=3)
+            peaks = []
+            for variant in ("python-docx", "streaming"):
+                result = subprocess.run([sys.executable, __file__, "--docx-child", variant, path],
+                                        capture_output=True, text=True, check=True)
+                peaks.append(int(result.stdout.strip().splitlines()[-1]) / 1024)
+            print(f"{paragraphs:>10} {len(content) // 1024:>5} {legacy:>15.1f} {streaming:>13.1f} "
+                  f"{legacy / streaming:>7.1f}x {peaks[0]:>20.1f} {peaks[1]:>18.1f}")
+
+
+DENSE_QUERIES = ["can they drop me?", "how much do I owe each month", "where do disputes go", "is my deposit refunded"]
+
+
+def bench_dense_index() -> None:
+    import numpy as np
+
+    backend = HashedNgramEmbedding()
+    # Distinct chunk texts are embedded once and their vectors tiled up to each chunk count
+    base_texts = [" ".join(SAMPLE_CLAUSES[(index + offset) % len(SAMPLE_CLAUSES)] for offset in range(4)) + f" Ref {index}."
+                  for index in range(1_000)]
+    base_vectors = backend.embed(base_texts)
+    print(f"{'chunks':>8} {'matrix MB':>10} {'mmap':>5} {'dense ms/query':>15} {'bm25 ms/query':>14}")
+    for count in (100, 1_000, 10_000, 100_000):
+        chunks = [Chunk(index * 1_000, base_texts[index % len(base_texts)]) for index in range(count)]
+        vectors = np.resize(base_vectors, (count, backend.dimensions))
+        dense = DenseIndex(chunks, backend, vectors)
+        keyword = BM25Index(chunks)
+        dense_ms = time_call(lambda: [dense.search(query, 4) for query in DENSE_QUERIES]) / len(DENSE_QUERIES)
+        keyword_ms = time_call(lambda: [keyword.search(query, 4) for query in DENSE_QUERIES]) / len(DENSE_QUERIES)
+        print(f"{count:>8} {dense.matrix.nbytes / 2**20:>10.1f} {'yes' if dense.memory_mapped else 'no':>5} "
+              f"{dense_ms:>15.3f} {keyword_ms:>14.3f}")
+
+
+CHAT_QUESTIONS = ["What does this document say about termination?", "What is arbitration?", "Can they raise the fee?"]
+
+
+def bench_chat_turn() -> None:
+    """Python work per chat turn before the model call, with and without the session chatbot cache"""
+    # A project is enough to build model clients offline; nothing here calls the model
+    vertexai.init(project=chatbot.PROJECT_ID or "bench-project", location=chatbot.LOCATION)
+    text = make_contract(50_000)
+    document = {"text": text, "filename": "contract.pdf", "retriever": chatbot.DocumentRetriever(text),
+                "contract_type": chatbot.detect_contract_type(text), "context": None}
+    session = chatbot.ChatSession("bench-session", "bench-document", "contract.pdf")
+    history = [{"role": "user", "content": question} for question in CHAT_QUESTIONS]
+
+    def rebuilt_chatbot() -> chatbot.EnhancedLegalChatbot:
+        # What every turn did before: a fresh model client, settings and prompt text
+        chatbot.get_chat_model.cache_clear()
+        return chatbot.EnhancedLegalChatbot(document["text"], document["filename"], document["retriever"])
+
+    def cached_chatbot() -> chatbot.EnhancedLegalChatbot:
+        return chatbot.get_session_chatbot(session, document)
+
+    turns = CHAT_QUESTIONS * 100
+    print(f"{'variant':>18} {'chatbot us':>11} {'full turn us':>13}")
+    for name, get_bot in (("new chatbot/turn", rebuilt_chatbot), ("cached chatbot", cached_chatbot)):
+        setup_ms = time_call(lambda: [get_bot() for _ in turns], repeat=3)
+        # The full turn adds retrieval and prompt assembly, which both variants share
+        full_ms = time_call(lambda: [get_bot().build_prompt(question, history) for question in turns], repeat=3)
+        print(f"{name:>18} {setup_ms * 1000 / len(turns):>11.2f} {full_ms * 1000 / len(turns):>13.1f}")
+
+
+def bench_chat_stream() -> None:
+    """Time until the client sees reply text: /chat versus /chat/stream against a fake model"""
+    answer = " ".join(SAMPLE_CLAUSES * 6)
+    chatbot.get_chat_model.cache_clear()
+    original_model, chatbot.CHAT_MODEL = chatbot.CHAT_MODEL, "fake"
+    try:
+        model = chatbot.get_chat_model()
+        model.answer, model.first_token_latency, model.token_latency = answer, 0.3, 0.002
+        client = chatbot.app.test_client()
+        upload = client.post("/upload-document", data={
+            "document": (BytesIO(make_contract(50_000).encode()), "contract.txt")
+        }).get_json()
+        body = {"session_id": upload["session_id"], "message": "Can the provider terminate early?"}
+
+        start = time.perf_counter()
+        client.post("/chat", json=body)
+        blocking_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        first_text_ms = None
+        response = client.post("/chat/stream", json=body, buffered=False)
+        for line in response.response:
+            event = json.loads(line)
+            if event["event"] == "delta" and first_text_ms is None:
+                first_text_ms = (time.perf_counter() - start) * 1000
+            if event["event"] == "complete":
+                timing = event["data"]["timing"]
+        stream_ms = (time.perf_counter() - start) * 1000
+    finally:
+        chatbot.CHAT_MODEL = original_model
+        chatbot.get_chat_model.cache_clear()
+    print(f"reply of {len(answer.split())} tokens, model first token after 300 ms, 2 ms per token after that")
+    print(f"{'endpoint':>13} {'first text ms':>14} {'total ms':>9}")
+    print(f"{'/chat':>13} {blocking_ms:>14.0f} {blocking_ms:>9.0f}")
+    print(f"{'/chat/stream':>13} {first_text_ms:>14.0f} {stream_ms:>9.0f}")
+    print(f"reported timing: {timing}")
+
+
+def bench_chat_context() -> None:
+    """Prompt characters sent per chat turn with the document inline, as excerpts, and as a cached context"""
+    chatbot.get_chat_model.cache_clear()
+    original_model, chatbot.CHAT_MODEL = chatbot.CHAT_MODEL, "fake"
+    try:
+        model = chatbot.get_chat_model()
+        print(f"{'doc chars':>10} {'full text/turn':>15} {'excerpts/turn':>14} {'cached/turn':>12} {'cached once':>12}")
+        for size in (10_000, 50_000):
+            text = make_contract(size)
+            document = {"text": text, "filename": "contract.pdf", "retriever": chatbot.DocumentRetriever(text),
+                        "contract_type": chatbot.detect_contract_type(text)}
+            document["context"] = chatbot.create_document_context(document)
+            history: List[Dict[str, str]] = []
+            sent = {"full": 0, "excerpts": 0, "cached": 0}
+            bots = [chatbot.EnhancedLegalChatbot(text, "contract.pdf", document["retriever"], document["contract_type"],
+                                                 context) for context in (None, document["context"])]
+            for question in CHAT_QUESTIONS * 2:
+                full_prefix = chatbot.render_document_prefix("contract.pdf", document["contract_type"], text)
+                sent["full"] += len(full_prefix) + len(bots[0].build_turn_prompt(question, history)) + 2
+                sent["excerpts"] += len(bots[0].prepare_request(question, history)[0])
+                prompt, context = bots[1].prepare_request(question, history)
+                assert context is document["context"]
+                sent["cached"] += len(prompt)
+                history += [{"role": "user", "content": question}, {"role": "assistant", "content": "Noted."}]
+            # Later uploads of the same document render a byte-identical prefix
+            assert prefix_digest(model.context_prefixes[document["context"].name]) == prefix_digest(
+                chatbot.render_document_prefix("contract.pdf", document["contract_type"], text))
+            turns = len(CHAT_QUESTIONS) * 2
+            print(f"{len(text):>10,} {sent['full'] // turns:>15,} {sent['excerpts'] // turns:>14,} "
+                  f"{sent['cached'] // turns:>12,} {document['context'].chars:>12,}")
+    finally:
+        chatbot.CHAT_MODEL = original_model
+        chatbot.get_chat_model.cache_clear()
+
+
+BENCHMARKS = {
+    "risk_scanner": bench_risk_scanner,
+    "pathological": bench_pathological,
+    "prefilter": bench_prefilter,
+    "key_info": bench_key_info,
+    "pdf_pages": bench_pdf_pages,
+    "upload_memory": bench_upload_memory,
+    "page_routing": bench_page_routing,
+    "docx_extract": bench_docx_extract,
+    "dense_index": bench_dense_index,
+    "chat_turn": bench_chat_turn,
+    "chat_stream": bench_chat_stream,
+    "chat_context": bench_chat_context,
+}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--upload-child"]:
+        upload_memory_child(*sys.argv[2:5])
+        sys.exit(0)
+    if sys.argv[1:2] == ["--docx-child"]:
+        docx_memory_child(*sys.argv[2:4])
+        sys.exit(0)
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
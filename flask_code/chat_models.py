@@ -0,0 +1,171 @@
+import datetime
+import hashlib
+import logging
+import re
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from vertexai.generative_models import Content, GenerativeModel, Part
+from vertexai.preview import caching
+
+logger = logging.getLogger(__name__)
+
+# Words with their trailing whitespace, the unit the fake model streams in
+STREAM_TOKEN_PATTERN = re.compile(r'\S+\s*')
+
+class CachedContext(NamedTuple):
+    """Handle to a prompt prefix held by the model service, referenced instead of resent"""
+    name: str
+    digest: str
+    chars: int
+    expires_at: float
+
+    def expired(self, margin: float = 60.0) -> bool:
+        """True once the context is gone, or about to be, on the service"""
+        return time.time() + margin >= self.expires_at
+
+def prefix_digest(prefix: str) -> str:
+    """SHA-256 of a prompt prefix; equal digests mean a byte-identical prefix"""
+    return hashlib.sha256(prefix.encode('utf-8')).hexdigest()
+
+class ChatModel(ABC):
+    """A generative model that answers one prompt, whole or as a stream of text chunks.
+
+    Models that support context caching can hold a long, stable prompt prefix
+    on the service; the prompt of each call is then only the part after it.
+    """
+
+    name = 'chat_model'
+
+    def generate(self, prompt: str, context: Optional[CachedContext] = None) -> str:
+        return ''.join(self.stream(prompt, context))
+
+    @abstractmethod
+    def stream(self, prompt: str, context: Optional[CachedContext] = None) -> Iterator[str]:
+        """Yield the answer to prompt in chunks as they are generated"""
+
+    def create_cached_context(self, prefix: str, ttl_seconds: float) -> Optional[CachedContext]:
+        """Store prefix on the service; None when the model cannot cache it"""
+        return None
+
+    def delete_cached_context(self, context: CachedContext) -> None:
+        """Remove a cached prefix from the service before it expires, ending its storage charge"""
+
+class VertexChatModel(ChatModel):
+    """Gemini on Vertex AI, sharing one model client, config and safety settings across calls"""
+
+    name = 'vertex_ai'
+
+    def __init__(self, model_name: str, generation_config: Dict[str, Any], safety_settings: List[Any]):
+        self.model_name = model_name
+        self.model = GenerativeModel(model_name)
+        self.generation_config = generation_config
+        self.safety_settings = safety_settings
+        # Model clients bound to a cached context, with the context's expiry
+        self._context_models: Dict[str, Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str, context: Optional[CachedContext] = None) -> str:
+        response = self._model_for(context).generate_content(
+            prompt,
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings
+        )
+        return response.text if response else ''
+
+    def stream(self, prompt: str, context: Optional[CachedContext] = None) -> Iterator[str]:
+        responses = self._model_for(context).generate_content(
+            prompt,
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings,
+            stream=True
+        )
+        for chunk in responses:
+            # The last chunk may carry only the finish reason and no text
+            if chunk.candidates and chunk.candidates[0].content.parts:
+                yield chunk.text
+
+    def create_cached_context(self, prefix: str, ttl_seconds: float) -> Optional[CachedContext]:
+        ttl = datetime.timedelta(seconds=ttl_seconds)
+        try:
+            cached_content = caching.CachedContent.create(
+                model_name=self.model_name,
+                contents=[Content(role='user', parts=[Part.from_text(prefix)])],
+                ttl=ttl
+            )
+        except Exception as e:
+            # Prefixes below the service's minimum token count are rejected; those are sent inline
+            logger.warning(f"Context caching failed, prompts will carry the document: {e}")
+            return None
+        return CachedContext(cached_content.resource_name, prefix_digest(prefix), len(prefix),
+                             time.time() + ttl_seconds)
+
+    def delete_cached_context(self, context: CachedContext) -> None:
+        with self._lock:
+            self._context_models.pop(context.name, None)
+        try:
+            caching.CachedContent(cached_content_name=context.name).delete()
+        except Exception as e:
+            # The context still expires on its own at the end of its TTL
+            logger.warning(f"Could not delete cached context {context.name}: {e}")
+
+    def _model_for(self, context: Optional[CachedContext]) -> Any:
+        if context is None:
+            return self.model
+        with self._lock:
+            entry = self._context_models.get(context.name)
+            if entry is None:
+                now = time.time()
+                for name in [name for name, (_, expires_at) in self._context_models.items() if expires_at <= now]:
+                    del self._context_models[name]
+                entry = (GenerativeModel.from_cached_content(cached_content=context.name), context.expires_at)
+                self._context_models[context.name] = entry
+            return entry[0]
+
+class FakeChatModel(ChatModel):
+    """Local stand-in that streams a canned answer word by word with simulated latency.
+
+    Prompts are recorded, so what each turn sends can be checked without a
+    Google Cloud project. Cached contexts are kept in memory and expire like
+    the service's; a call naming an unknown or expired context fails.
+    """
+
+    name = 'fake'
+
+    def __init__(self, answer: Optional[str] = None, first_token_latency: float = 0.0,
+                 token_latency: float = 0.0):
+        self.answer = answer or "This is a local test answer based on the excerpts in the prompt."
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.prompts: List[str] = []
+        self.contexts: Dict[str, CachedContext] = {}
+        self.context_prefixes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def stream(self, prompt: str, context: Optional[CachedContext] = None) -> Iterator[str]:
+        with self._lock:
+            if context is not None and (context.name not in self.contexts or context.expired(margin=0)):
+                raise ValueError(f"Cached context {context.name} not found or expired")
+            self.prompts.append(prompt)
+        if self.first_token_latency:
+            time.sleep(self.first_token_latency)
+        for index, token in enumerate(STREAM_TOKEN_PATTERN.findall(self.answer)):
+            if index and self.token_latency:
+                time.sleep(self.token_latency)
+            yield token
+
+    def create_cached_context(self, prefix: str, ttl_seconds: float) -> Optional[CachedContext]:
+        context = CachedContext(f"local/cachedContents/{uuid.uuid4().hex}", prefix_digest(prefix), len(prefix),
+                                time.time() + ttl_seconds)
+        with self._lock:
+            self.contexts[context.name] = context
+            self.context_prefixes[context.name] = prefix
+        return context
+
+    def delete_cached_context(self, context: CachedContext) -> None:
+        with self._lock:
+            self.contexts.pop(context.name, None)
+            self.context_prefixes.pop(context.name, None)
@@ -5,18 +5,18 @@ import logging
 import json
 import uuid
 import time
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import traceback
-import PyPDF2
-import docx
-from io import BytesIO
 import re
 from collections import Counter
 import string
 import difflib
 import random
+from functools import lru_cache
 
 # Google Cloud imports
 from google.cloud import aiplatform
@@ -26,6 +26,17 @@ from vertexai.generative_models import GenerativeModel, Part, SafetySetting
 from vertexai.language_models import TextGenerationModel
 import google.auth
 
+from contract_types import detect_contract_type
+from analysis_cache import content_digest
+from chat_models import CachedContext, ChatModel, FakeChatModel, VertexChatModel, prefix_digest
+from document_extraction import create_document_extractor, detect_mime_type
+from extraction_sandbox import ExtractionError
+from event_stream import STREAM_FORMATS, event_stream_response, format_stream_event, requested_stream_format
+from page_index import PageIndex, find_quote_pages
+from retrieval import NUMPY_AVAILABLE, DocumentRetriever
+from text_normalization import normalize_text
+from upload_handling import Buffer, SpooledRequest, map_upload, read_head, upload_size
+
 # Load environment variables
 load_dotenv()
 
@@ -37,6 +48,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Uploads are spooled to disk and memory-mapped rather than read into memory
+app.request_class = SpooledRequest
 
 # CORS Configuration
 CORS(app, 
@@ -47,9 +60,13 @@ CORS(app,
 
 # File processing limits
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
-MAX_DOC_CHARS = 50000
+MAX_DOC_CHARS = 50000  # Prompt budget; retrieval indexes the whole document
 MAX_TEXT_LENGTH = 100000
 MIN_TEXT_LENGTH = 10
+# Document chunks quoted in each prompt, chosen for the question by BM25 plus, with NumPy, a dense index
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '4'))
+# Documents longer than the prompt budget are indexed in full in the background
+FULL_TEXT_INDEX_WORKERS = int(os.getenv('FULL_TEXT_INDEX_WORKERS', '2'))
 
 # Supported file types
 SUPPORTED_MIME_TYPES = {
@@ -59,21 +76,135 @@ SUPPORTED_MIME_TYPES = {
     'text/plain': 'txt'
 }
 
-EXTENSION_TO_MIME = {
-    '.pdf': 'application/pdf',
-    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-    '.doc': 'application/msword',
-    '.txt': 'text/plain'
-}
-
 # Google Cloud Configuration
 PROJECT_ID = os.getenv('PROJECT_ID')
 LOCATION = os.getenv('VERTEX_LOCATION', 'us-central1')
 MODEL_NAME = os.getenv('MODEL_NAME', 'gemini-2.5-flash-lite')
+# 'vertex_ai' answers with Gemini, 'fake' with a local stand-in that streams a canned answer
+CHAT_MODEL = os.getenv('CHAT_MODEL', 'vertex_ai')
+# Each document's prompt prefix is cached with the model service at upload. Shorter documents
+# fall below the service's minimum cacheable size and are sent inline
+CONTEXT_CACHING = os.getenv('CONTEXT_CACHING', 'true').lower() == 'true'
+CONTEXT_CACHE_MIN_CHARS = int(os.getenv('CONTEXT_CACHE_MIN_CHARS', '8000'))
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv('CONTEXT_CACHE_TTL_SECONDS', '3600'))
 
 # In-memory storage for chat sessions
 chat_sessions = {}
 document_store = {}
+# Chatbot of each session, built on its first turn and dropped with the session
+session_chatbots: Dict[str, 'EnhancedLegalChatbot'] = {}
+# Live cached contexts by prefix digest, shared by every upload of the same document
+document_contexts: Dict[str, CachedContext] = {}
+document_contexts_lock = threading.Lock()
+# Time to first token and total time of streamed replies, summed for /health
+stream_metrics = {'responses': 0, 'time_to_first_token_ms': 0.0, 'total_ms': 0.0}
+stream_metrics_lock = threading.Lock()
+
+FALLBACK_RESPONSE = "I'm having trouble generating a response right now. Could you please rephrase your question?"
+ERROR_RESPONSE = "I encountered an issue processing your question. Please try rephrasing it or ask something else."
+
+# Shared by every chatbot instead of being rebuilt for each one
+SAFETY_SETTINGS = [
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
+    ),
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
+    ),
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
+    ),
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_HARASSMENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
+    )
+]
+
+# Generation config for better responses
+GENERATION_CONFIG = {
+    "max_output_tokens": 2048,
+    "temperature": 0.3,
+    "top_p": 0.8,
+}
+
+# Every prompt is a stable document prefix followed by a per-turn suffix. The prefix depends
+# only on the document and is byte-identical on every turn: with context caching it holds the
+# document text, is stored once at upload and referenced by each turn; without it, the prefix
+# is this header alone and the suffix quotes the excerpts retrieved for the question
+DOCUMENT_PREFIX_PROMPT = """You are an expert legal consultant and document analyst. You help users understand their legal documents and the legal principles, terms, and concepts behind them.
+
+DOCUMENT INFORMATION:
+Title: {title}
+Contract type: {contract_type}"""
+
+DOCUMENT_TEXT_PROMPT = """
+
+DOCUMENT TEXT:
+{document_text}"""
+
+EXCERPTS_PROMPT = """RELEVANT EXCERPTS:
+{excerpts}
+
+"""
+
+# Used with a cached context for parts of the document past the cached text
+LATER_EXCERPTS_PROMPT = """RELEVANT EXCERPTS FROM LATER IN THE DOCUMENT:
+{excerpts}
+
+"""
+
+DOCUMENT_SPECIFIC_INSTRUCTIONS = """INSTRUCTIONS FOR DOCUMENT-SPECIFIC QUESTIONS:
+1. Answer based ONLY on the information contained in this specific document
+2. Quote relevant sections when possible
+3. If the document doesn't contain the requested information, clearly state this
+4. Be precise and accurate in your analysis
+5. Reference specific clauses, sections, or terms mentioned in the document
+6. Explain legal terms as they appear in the context of this document"""
+
+GENERAL_LEGAL_INSTRUCTIONS = """INSTRUCTIONS FOR GENERAL LEGAL QUESTIONS:
+1. Provide comprehensive explanations of legal concepts and terms
+2. Give general legal knowledge and principles
+3. Explain how legal concepts typically work in practice
+4. Provide context and background information
+5. When relevant, mention how the concept might relate to the type of document the user has
+6. Include important disclaimers about seeking professional legal advice when appropriate
+7. Be educational and informative
+
+IMPORTANT: Always clarify whether you're providing general legal information vs. document-specific analysis."""
+
+HYBRID_INSTRUCTIONS = """INSTRUCTIONS:
+1. First, check if the question can be answered using the specific document content
+2. If yes, provide document-specific information with quotes and references
+3. Additionally, provide relevant general legal context and explanation
+4. If the document doesn't contain specific information, provide general legal knowledge
+5. Always clarify whether information comes from the document or general legal principles
+6. Combine both approaches for comprehensive answers
+7. Be educational while remaining accurate to the document content"""
+
+# Question type: (instructions, whether the turn quotes excerpts, approach note)
+TURN_PROMPTS = {
+    'document_specific': (DOCUMENT_SPECIFIC_INSTRUCTIONS, True,
+                          "[APPROACH: Analyzing document content specifically]"),
+    'general_legal': (GENERAL_LEGAL_INSTRUCTIONS, False,
+                      "[APPROACH: Providing general legal information]"),
+    'hybrid': (HYBRID_INSTRUCTIONS, True,
+               "[APPROACH: Combining document analysis with general legal knowledge]")
+}
+
+TURN_PROMPT = """{excerpts}{instructions}
+{context}
+USER QUESTION: {user_question}
+
+Please provide a comprehensive and helpful answer. If this is about the document, be specific and quote relevant parts. If this is a general legal question, provide educational information. For ambiguous questions, provide both document-specific information (if available) and general legal context.
+
+{approach_note}"""
+
+# Shares its text cache with the analyzer, so documents it already parsed are not parsed again
+document_extractor = create_document_extractor()
+full_text_index_executor = ThreadPoolExecutor(max_workers=FULL_TEXT_INDEX_WORKERS, thread_name_prefix='full-text-index')
 
 # Initialize Vertex AI
 def initialize_vertex_ai():
@@ -98,60 +229,88 @@ def initialize_vertex_ai():
         logger.error(f"✗ Failed to initialize Vertex AI: {str(e)}")
         return False
 
-def detect_mime_type(file_content: bytes, filename: str) -> str:
-    """Detect MIME type using file signatures and extensions"""
-    if file_content.startswith(b'%PDF'):
-        return 'application/pdf'
-    elif file_content.startswith(b'PK\x03\x04') or file_content.startswith(b'PK\x05\x06') or file_content.startswith(b'PK\x07\x08'):
-        if filename and filename.lower().endswith('.docx'):
-            return 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    elif file_content.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
-        if filename and filename.lower().endswith('.doc'):
-            return 'application/msword'
-    
-    if filename:
-        _, ext = os.path.splitext(filename.lower())
-        if ext in EXTENSION_TO_MIME:
-            return EXTENSION_TO_MIME[ext]
-    
-    raise ValueError(f"Could not determine MIME type for file: {filename}")
+@lru_cache(maxsize=None)
+def get_chat_model() -> ChatModel:
+    """Model client shared by all chatbots, created on first use after Vertex AI is initialized"""
+    if CHAT_MODEL == 'fake':
+        logger.info("Using the local fake chat model")
+        return FakeChatModel()
+    return VertexChatModel(MODEL_NAME, GENERATION_CONFIG, SAFETY_SETTINGS)
 
-def extract_text_fallback(file_content: bytes, mime_type: str) -> str:
-    """Extract text using local libraries"""
-    text = ""
+def render_document_prefix(document_title: str, contract_type: str, document_text: Optional[str] = None) -> str:
+    """Stable start of every prompt for a document; with its text, the prefix that is cached"""
+    prefix = DOCUMENT_PREFIX_PROMPT.format(title=document_title, contract_type=contract_type.title())
+    if document_text is not None:
+        prefix += DOCUMENT_TEXT_PROMPT.format(document_text=document_text)
+    return prefix
+
+def create_document_context(document: Dict[str, Any]) -> Optional[CachedContext]:
+    """Cache the document's prompt prefix with the model service; None when it is sent inline.
     
-    try:
-        if mime_type == 'application/pdf':
-            pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-            for page_num, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
-                except Exception as e:
-                    logger.warning(f"Failed to extract text from page {page_num + 1}: {e}")
-                    text += f"\n--- Page {page_num + 1} (extraction failed) ---\n"
-                
-        elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            doc = docx.Document(BytesIO(file_content))
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-        
-        elif mime_type == 'text/plain':
-            try:
-                text = file_content.decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    text = file_content.decode('latin-1')
-                except Exception as e:
-                    raise Exception(f"Failed to decode text file: {e}")
-        
-        if not text.strip():
-            raise Exception("No text could be extracted from the document")
-        
-        return text.strip()
+    A live context of a byte-identical prefix, from an earlier upload of the same
+    document, is reused instead of storing and paying for a second copy.
+    """
+    if not CONTEXT_CACHING or len(document['text']) < CONTEXT_CACHE_MIN_CHARS:
+        return None
+    prefix = render_document_prefix(document['filename'], document['contract_type'], document['text'])
+    digest = prefix_digest(prefix)
+    with document_contexts_lock:
+        context = document_contexts.get(digest)
+    if context is not None and not context.expired():
+        logger.info(f"Reusing cached context {context.name} for {document['filename']}")
+        return context
     
+    try:
+        context = get_chat_model().create_cached_context(prefix, CONTEXT_CACHE_TTL_SECONDS)
     except Exception as e:
-        raise Exception(f"Text extraction failed: {e}")
+        logger.warning(f"Could not cache context for {document['filename']}: {str(e)}")
+        return None
+    if context is None:
+        return None
+    with document_contexts_lock:
+        existing = document_contexts.get(digest)
+        if existing is None or existing.expired():
+            document_contexts[digest] = context
+            existing = None
+    if existing is not None:
+        # Another upload of the document cached it first
+        get_chat_model().delete_cached_context(context)
+        return existing
+    logger.info(f"Cached {context.chars:,}-character prompt prefix for {document['filename']} as {context.name}")
+    return context
+
+def refresh_document_context(document: Dict[str, Any]) -> Optional[CachedContext]:
+    """The document's cached context, cached again once it expired or the service rejected it"""
+    context = document['context']
+    if context is None:
+        return None
+    with document_contexts_lock:
+        live = document_contexts.get(context.digest) == context
+    if live and not context.expired():
+        return context
+    document['context'] = create_document_context(document)
+    return document['context']
+
+def discard_document_context(context: CachedContext) -> None:
+    """Forget a context the service rejected, so the next turn caches the prefix again"""
+    with document_contexts_lock:
+        if document_contexts.get(context.digest) == context:
+            del document_contexts[context.digest]
+
+def release_document(document_id: str) -> None:
+    """Drop a document no session uses any more, deleting its cached context unless another upload shares it"""
+    document = document_store.pop(document_id, None)
+    context = document['context'] if document is not None else None
+    if context is None:
+        return
+    if any(other['context'] == context for other in list(document_store.values())):
+        return
+    with document_contexts_lock:
+        if document_contexts.get(context.digest) == context:
+            del document_contexts[context.digest]
+    if not context.expired(margin=0):
+        get_chat_model().delete_cached_context(context)
+        logger.info(f"Deleted cached context {context.name} of {document['filename']}")
 
 class ChatSession:
     def __init__(self, session_id: str, document_id: str, document_title: str):
@@ -191,37 +350,18 @@ class ChatSession:
 class EnhancedLegalChatbot:
     """Enhanced AI-powered legal document chatbot that can handle both document-specific and general legal questions"""
     
-    def __init__(self, document_text: str, document_title: str):
+    def __init__(self, document_text: str, document_title: str, retriever: Optional[DocumentRetriever] = None,
+                 contract_type: Optional[str] = None, context: Optional[CachedContext] = None):
         self.document_text = document_text
         self.document_title = document_title
-        self.model = GenerativeModel(MODEL_NAME)
-        
-        # Safety settings
-        self.safety_settings = [
-            SafetySetting(
-                category=SafetySetting.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-            ),
-            SafetySetting(
-                category=SafetySetting.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-            ),
-            SafetySetting(
-                category=SafetySetting.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-            ),
-            SafetySetting(
-                category=SafetySetting.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                threshold=SafetySetting.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE
-            )
-        ]
-        
-        # Generation config for better responses
-        self.generation_config = {
-            "max_output_tokens": 2048,
-            "temperature": 0.3,
-            "top_p": 0.8,
-        }
+        self.retriever = retriever or DocumentRetriever(document_text)
+        self.contract_type = contract_type or detect_contract_type(document_text)
+        self.model = get_chat_model()
+        # Cached document prefix, created at upload; turns reference it instead of resending the text
+        self.context = context
+        
+        # Rendered once; inline prompts start with exactly these bytes on every turn
+        self.document_prefix = render_document_prefix(document_title, self.contract_type)
     
     def classify_question_type(self, user_question: str) -> str:
         """Classify if the question is document-specific or general legal"""
@@ -250,108 +390,112 @@ class EnhancedLegalChatbot:
         # Default to hybrid approach for ambiguous questions
         return "hybrid"
     
-    def create_document_specific_prompt(self) -> str:
-        """Create a prompt for document-specific questions"""
-        return f"""You are an expert legal document analyst. Your role is to help users understand and extract information from their legal documents.
-
-DOCUMENT INFORMATION:
-Title: {self.document_title}
-Content: {self.document_text[:12000]}...
-
-INSTRUCTIONS FOR DOCUMENT-SPECIFIC QUESTIONS:
-1. Answer based ONLY on the information contained in this specific document
-2. Quote relevant sections when possible
-3. If the document doesn't contain the requested information, clearly state this
-4. Be precise and accurate in your analysis
-5. Reference specific clauses, sections, or terms mentioned in the document
-6. Explain legal terms as they appear in the context of this document"""
-
-    def create_general_legal_prompt(self) -> str:
-        """Create a prompt for general legal questions"""
-        return f"""You are an expert legal consultant with comprehensive knowledge of legal principles, terms, and concepts.
-
-DOCUMENT CONTEXT (for reference):
-The user has uploaded a document titled: {self.document_title}
-Document type: Legal agreement/contract
-
-INSTRUCTIONS FOR GENERAL LEGAL QUESTIONS:
-1. Provide comprehensive explanations of legal concepts and terms
-2. Give general legal knowledge and principles
-3. Explain how legal concepts typically work in practice
-4. Provide context and background information
-5. When relevant, mention how the concept might relate to the type of document the user has
-6. Include important disclaimers about seeking professional legal advice when appropriate
-7. Be educational and informative
-
-IMPORTANT: Always clarify whether you're providing general legal information vs. document-specific analysis."""
-
-    def create_hybrid_prompt(self) -> str:
-        """Create a prompt that can handle both document-specific and general questions"""
-        return f"""You are an expert legal consultant and document analyst. You can provide both document-specific analysis and general legal knowledge.
-
-DOCUMENT INFORMATION:
-Title: {self.document_title}
-Content: {self.document_text[:10000]}...
-
-INSTRUCTIONS:
-1. First, check if the question can be answered using the specific document content
-2. If yes, provide document-specific information with quotes and references
-3. Additionally, provide relevant general legal context and explanation
-4. If the document doesn't contain specific information, provide general legal knowledge
-5. Always clarify whether information comes from the document or general legal principles
-6. Combine both approaches for comprehensive answers
-7. Be educational while remaining accurate to the document content"""
-
+    def document_context(self, user_question: str) -> str:
+        """The parts of the document most relevant to the question"""
+        return self.retriever.context(user_question, RETRIEVAL_TOP_K)
+    
+    def later_document_context(self, user_question: str) -> str:
+        """Relevant parts of the document past the cached text, indexed after upload; empty when none"""
+        cached_chars = len(self.document_text)
+        chunks = self.retriever.chunks
+        if not chunks or chunks[-1].start + len(chunks[-1].text) <= cached_chars:
+            return ""
+        later = [chunk for chunk in self.retriever.search(user_question, RETRIEVAL_TOP_K)
+                 if chunk.start + len(chunk.text) > cached_chars]
+        return "\n[...]\n".join(chunk.text for chunk in sorted(later))
+    
+    def cached_context(self) -> Optional[CachedContext]:
+        """The document's cached context while it is still live on the service"""
+        if self.context is not None and self.context.expired():
+            logger.info(f"Cached context {self.context.name} expired; sending excerpts inline")
+            self.context = None
+        return self.context
+    
+    def drop_context(self, error: Exception) -> None:
+        """Stop using a cached context the model rejected and fall back to inline prompts"""
+        logger.warning(f"Cached context {self.context.name} failed ({error}); sending excerpts inline")
+        discard_document_context(self.context)
+        self.context = None
+    
+    def build_turn_prompt(self, user_question: str, conversation_history: List[Dict] = None,
+                          cached: bool = False) -> str:
+        """Variable part of the prompt for one turn, chosen by question type"""
+        # Classify the question type
+        question_type = self.classify_question_type(user_question)
+        instructions, quotes_excerpts, approach_note = TURN_PROMPTS[question_type]
+        
+        # Create context from conversation history
+        context = ""
+        if conversation_history and len(conversation_history) > 0:
+            context = "\nRECENT CONVERSATION:\n"
+            for msg in conversation_history[-6:]:  # Last 3 exchanges
+                context += f"{msg['role'].upper()}: {msg['content']}\n"
+        
+        excerpts = ""
+        if quotes_excerpts and not cached:
+            excerpts = EXCERPTS_PROMPT.format(excerpts=self.document_context(user_question))
+        elif quotes_excerpts:
+            # The cached context holds the upload's text; pages indexed after it are quoted here
+            later_excerpts = self.later_document_context(user_question)
+            if later_excerpts:
+                excerpts = LATER_EXCERPTS_PROMPT.format(excerpts=later_excerpts)
+        
+        return TURN_PROMPT.format(excerpts=excerpts, instructions=instructions, context=context,
+                                  user_question=user_question, approach_note=approach_note)
+    
+    def build_prompt(self, user_question: str, conversation_history: List[Dict] = None) -> str:
+        """Complete inline prompt: the document prefix, then the turn with its excerpts"""
+        return f"{self.document_prefix}\n\n{self.build_turn_prompt(user_question, conversation_history)}"
+    
+    def prepare_request(self, user_question: str,
+                        conversation_history: List[Dict] = None) -> Tuple[str, Optional[CachedContext]]:
+        """Prompt and cached context for one turn; only the turn suffix when the document is cached"""
+        context = self.cached_context()
+        if context is None:
+            return self.build_prompt(user_question, conversation_history), None
+        return self.build_turn_prompt(user_question, conversation_history, cached=True), context
+    
     def generate_response(self, user_question: str, conversation_history: List[Dict] = None) -> str:
         """Generate AI response based on question type"""
         try:
-            # Classify the question type
-            question_type = self.classify_question_type(user_question)
+            prompt, context = self.prepare_request(user_question, conversation_history)
             
-            # Create context from conversation history
-            context = ""
-            if conversation_history and len(conversation_history) > 0:
-                context = "\nRECENT CONVERSATION:\n"
-                for msg in conversation_history[-6:]:  # Last 3 exchanges
-                    context += f"{msg['role'].upper()}: {msg['content']}\n"
-            
-            # Choose appropriate prompt based on question type
-            if question_type == "document_specific":
-                system_prompt = self.create_document_specific_prompt()
-                approach_note = "\n[APPROACH: Analyzing document content specifically]"
-            elif question_type == "general_legal":
-                system_prompt = self.create_general_legal_prompt()
-                approach_note = "\n[APPROACH: Providing general legal information]"
-            else:  # hybrid
-                system_prompt = self.create_hybrid_prompt()
-                approach_note = "\n[APPROACH: Combining document analysis with general legal knowledge]"
-            
-            # Create the complete prompt
-            full_prompt = f"""{system_prompt}
-
-{context}
-
-USER QUESTION: {user_question}
-
-Please provide a comprehensive and helpful answer. If this is about the document, be specific and quote relevant parts. If this is a general legal question, provide educational information. For ambiguous questions, provide both document-specific information (if available) and general legal context.
-
-{approach_note}"""
-
             # Generate response using Vertex AI
-            response = self.model.generate_content(
-                full_prompt,
-                generation_config=self.generation_config,
-                safety_settings=self.safety_settings
-            )
+            try:
+                response_text = self.model.generate(prompt, context)
+            except Exception as e:
+                if context is None:
+                    raise
+                self.drop_context(e)
+                response_text = self.model.generate(self.build_prompt(user_question, conversation_history))
             
-            if response and response.text:
-                return response.text.strip()
+            if response_text:
+                return response_text.strip()
             else:
-                return "I'm having trouble generating a response right now. Could you please rephrase your question?"
+                return FALLBACK_RESPONSE
                 
         except Exception as e:
             logger.error(f"AI response generation failed: {str(e)}")
-            return f"I encountered an issue processing your question. Please try rephrasing it or ask something else."
+            return ERROR_RESPONSE
+    
+    def stream_response(self, user_question: str, conversation_history: List[Dict] = None) -> Iterator[str]:
+        """Yield the AI response in chunks as the model produces them"""
+        prompt, context = self.prepare_request(user_question, conversation_history)
+        if context is None:
+            yield from self.model.stream(prompt)
+            return
+        
+        streamed = False
+        try:
+            for text in self.model.stream(prompt, context):
+                streamed = True
+                yield text
+        except Exception as e:
+            # Once text has reached the client the turn cannot be retried
+            if streamed:
+                raise
+            self.drop_context(e)
+            yield from self.model.stream(self.build_prompt(user_question, conversation_history))
     
     def handle_greeting(self, message: str) -> Optional[str]:
         """Handle casual greetings"""
@@ -380,12 +524,47 @@ What would you like to know?"""
         
         return None
 
-def generate_intelligent_response(user_message: str, document_text: str, chat_history: List[Dict], document_title: str) -> str:
+def get_session_chatbot(chat_session: ChatSession, document: Dict[str, Any]) -> EnhancedLegalChatbot:
+    """The session's chatbot, built from the stored document on its first turn"""
+    chatbot = session_chatbots.get(chat_session.session_id)
+    if chatbot is None:
+        chatbot = session_chatbots.setdefault(chat_session.session_id, EnhancedLegalChatbot(
+            document['text'], document['filename'], document['retriever'], document['contract_type'],
+            document['context']
+        ))
+    # Picks up the full-text index once its background build has replaced the upload's
+    chatbot.retriever = document['retriever']
+    chatbot.context = refresh_document_context(document)
+    return chatbot
+
+def index_full_text(document_id: str, file_content: Buffer, mime_type: str, digest: str) -> None:
+    """Extract the whole document and replace the prefix index built at upload.
+    
+    The prompt keeps the budgeted text; retrieval, quote pages and the dense
+    index cover every page. On failure the prefix index stays in place.
+    """
+    try:
+        full_text, _ = document_extractor.extract(file_content, mime_type, None, digest)
+        normalized = normalize_text(full_text)
+        full_index = {
+            'normalized': normalized,
+            'page_index': PageIndex.from_text(full_text),
+            'retriever': DocumentRetriever(normalized.text),
+            'indexed_length': len(full_text),
+            'index_complete': True
+        }
+    except Exception as e:
+        logger.warning(f"Full-text indexing of document {document_id} failed, keeping the prefix index: {str(e)}")
+        return
+    
+    document = document_store.get(document_id)
+    if document is not None:
+        document.update(full_index)
+        logger.info(f"Indexed all {len(full_text):,} characters of {document['filename']}")
+
+def generate_intelligent_response(user_message: str, chatbot: EnhancedLegalChatbot, chat_history: List[Dict]) -> str:
     """Main response generation using enhanced legal chatbot"""
     try:
-        # Initialize the enhanced legal chatbot
-        chatbot = EnhancedLegalChatbot(document_text, document_title)
-        
         # Handle casual responses first
         greeting_response = chatbot.handle_greeting(user_message)
         if greeting_response:
@@ -410,6 +589,129 @@ def generate_intelligent_response(user_message: str, document_text: str, chat_hi
         logger.error(traceback.format_exc())
         return "I'm having some technical difficulties right now. Could you please try asking your question again?"
 
+def stream_intelligent_response(user_message: str, chatbot: EnhancedLegalChatbot, chat_history: List[Dict]) -> Iterator[str]:
+    """Streaming counterpart of generate_intelligent_response; model errors are raised to the caller"""
+    # Handle casual responses first
+    casual_response = chatbot.handle_greeting(user_message) or chatbot.handle_thanks(user_message)
+    if casual_response:
+        yield casual_response
+        return
+    
+    conversation_history = [
+        msg for msg in chat_history 
+        if msg.get('role') in ['user', 'assistant']
+    ]
+    yield from chatbot.stream_response(user_message, conversation_history)
+
+def record_stream_metrics(timing: Dict[str, Any]) -> None:
+    """Add one streamed reply to the totals reported by /health"""
+    with stream_metrics_lock:
+        stream_metrics['responses'] += 1
+        stream_metrics['time_to_first_token_ms'] += timing['time_to_first_token_ms'] or 0.0
+        stream_metrics['total_ms'] += timing['total_ms']
+
+def stream_metrics_summary() -> Dict[str, Any]:
+    """Average time to first token and total time of streamed replies"""
+    with stream_metrics_lock:
+        responses = stream_metrics['responses']
+        return {
+            'responses': responses,
+            'avg_time_to_first_token_ms': round(stream_metrics['time_to_first_token_ms'] / responses, 1) if responses else None,
+            'avg_total_ms': round(stream_metrics['total_ms'] / responses, 1) if responses else None
+        }
+
+def generate_chat_events(chat_session: ChatSession, document: Dict[str, Any], message: str,
+                         stream_format: str) -> Iterator[str]:
+    """Stream the assistant's reply as it is generated, then store it in the session.
+    
+    Events: started with the stored user message, delta for each piece of reply
+    text, and complete with the stored assistant message and its timing. A model
+    failure stores what arrived so far, or an apology, and ends the stream with error.
+    """
+    def event(name: str, data: Dict[str, Any]) -> str:
+        return format_stream_event(name, data, stream_format)
+    
+    chatbot = get_session_chatbot(chat_session, document)
+    user_msg = chat_session.add_message('user', message)
+    yield event('started', {'user_message': user_msg})
+    
+    started = time.perf_counter()
+    first_token_ms = None
+    parts = []
+    error = None
+    try:
+        for text in stream_intelligent_response(message, chatbot, chat_session.messages):
+            if not text:
+                continue
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+            parts.append(text)
+            yield event('delta', {'text': text})
+    except Exception as e:
+        logger.error(f"Streaming response failed for session {chat_session.session_id}: {str(e)}")
+        error = str(e)
+    
+    timing = {
+        'time_to_first_token_ms': first_token_ms,
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        'chunks': len(parts)
+    }
+    record_stream_metrics(timing)
+    
+    # The whole reply is stored once, so history and quote pages see the same text as /chat
+    ai_response = ''.join(parts).strip() or (ERROR_RESPONSE if error else FALLBACK_RESPONSE)
+    quote_pages = find_quote_pages(ai_response, document['normalized'], document['page_index'])
+    metadata = {'quote_pages': quote_pages, 'timing': timing}
+    if error:
+        metadata['incomplete'] = True
+    ai_msg = chat_session.add_message('assistant', ai_response, metadata)
+    logger.info(f"Streamed chat response for session {chat_session.session_id}: "
+                f"first token {first_token_ms} ms, total {timing['total_ms']} ms")
+    
+    if error:
+        yield event('error', {'error': 'Chat failed', 'message': error, 'ai_response': ai_msg})
+        return
+    yield event('complete', {
+        'ai_response': ai_msg,
+        'timing': timing,
+        'session_info': {
+            'session_id': chat_session.session_id,
+            'document_title': chat_session.document_title,
+            'message_count': len(chat_session.messages)
+        }
+    })
+
+def read_chat_request() -> Tuple[Optional[Dict[str, Any]], Optional[Any]]:
+    """Validate a chat request body; returns (chat_request, None) or (None, error_response)"""
+    data = request.get_json(force=True)
+    
+    if not data:
+        return None, (jsonify({'error': 'No data provided'}), 400)
+    
+    session_id = data.get('session_id')
+    message = data.get('message', '').strip()
+    
+    if not session_id:
+        return None, (jsonify({'error': 'No session ID provided'}), 400)
+    
+    if not message:
+        return None, (jsonify({'error': 'No message provided'}), 400)
+    
+    if session_id not in chat_sessions:
+        return None, (jsonify({'error': 'Session not found'}), 404)
+    
+    chat_session = chat_sessions[session_id]
+    
+    if chat_session.document_id not in document_store:
+        return None, (jsonify({'error': 'Document not found'}), 404)
+    
+    return {
+        'session': chat_session,
+        'document': document_store[chat_session.document_id],
+        'message': message,
+        'format': data.get('format')
+    }, None
+
 # API Routes
 @app.route('/upload-document', methods=['POST', 'OPTIONS'])
 def upload_document():
@@ -426,38 +728,60 @@ def upload_document():
         if not file or file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        file_content = file.read()
+        # Size and type are checked from the spool before the body is mapped
+        file_size = upload_size(file)
         
-        if not file_content:
+        if not file_size:
             return jsonify({'error': 'Empty file'}), 400
         
-        file_size = len(file_content)
         if file_size > MAX_FILE_SIZE:
             return jsonify({'error': 'File too large', 'message': f'File size exceeds {MAX_FILE_SIZE:,} bytes'}), 413
         
         logger.info(f"Processing file: {file.filename}, size: {file_size:,} bytes")
         
         try:
-            mime_type = detect_mime_type(file_content, file.filename)
+            mime_type = detect_mime_type(read_head(file), file.filename, SUPPORTED_MIME_TYPES)
             logger.info(f"Detected MIME type: {mime_type}")
         except ValueError as e:
             return jsonify({'error': 'Unsupported file type', 'message': str(e)}), 400
         
-        extracted_text = extract_text_fallback(file_content, mime_type)
+        file_content = map_upload(file)
+        digest = content_digest(file_content)
+        try:
+            extracted_text, text_complete = document_extractor.extract(file_content, mime_type, MAX_DOC_CHARS,
+                                                                       digest)
+        except ExtractionError as e:
+            logger.warning(f"Extraction failed for {file.filename}: {e}")
+            return jsonify({'error': 'Text extraction failed', 'message': str(e)}), 422
         
         if len(extracted_text.strip()) < MIN_TEXT_LENGTH:
             return jsonify({'error': 'Extracted text too short', 'message': f'Text must be at least {MIN_TEXT_LENGTH} characters'}), 400
         
+        # Prompts and quote lookups use the normalized text; page numbers come from the original markers
+        normalized = normalize_text(extracted_text)
+        
         document_id = str(uuid.uuid4())
         document_store[document_id] = {
             'id': document_id,
             'filename': file.filename,
-            'text': extracted_text,
+            'text': normalized.text,
+            'normalized': normalized,
+            'page_index': PageIndex.from_text(extracted_text),
+            # Built once here; every turn retrieves from it instead of quoting the opening pages
+            'retriever': DocumentRetriever(normalized.text),
             'mime_type': mime_type,
             'file_size': file_size,
             'uploaded_at': datetime.now().isoformat(),
-            'text_length': len(extracted_text)
+            'text_length': len(extracted_text),
+            'text_complete': text_complete,
+            'indexed_length': len(extracted_text),
+            'index_complete': text_complete,
+            'contract_type': detect_contract_type(normalized.text)
         }
+        if not text_complete:
+            full_text_index_executor.submit(index_full_text, document_id, file_content, mime_type, digest)
+        # The stable prompt prefix is cached once here; every turn references it by handle
+        document_store[document_id]['context'] = create_document_context(document_store[document_id])
         
         session_id = str(uuid.uuid4())
         chat_session = ChatSession(session_id, document_id, file.filename)
@@ -489,7 +813,11 @@ What would you like to explore first?"""
                 'filename': file.filename,
                 'file_size': file_size,
                 'mime_type': mime_type,
-                'text_length': len(extracted_text)
+                'text_length': len(extracted_text),
+                'text_complete': text_complete,
+                'full_text_indexing': not text_complete,
+                'contract_type': document_store[document_id]['contract_type'],
+                'context_cached': document_store[document_id]['context'] is not None
             },
             'welcome_message': welcome_message,
             'message': 'Document uploaded and analyzed successfully with Enhanced Legal AI!'
@@ -508,43 +836,26 @@ def chat():
         return jsonify({'status': 'ok'})
     
     try:
-        data = request.get_json(force=True)
-        
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
-        
-        session_id = data.get('session_id')
-        message = data.get('message', '').strip()
-        
-        if not session_id:
-            return jsonify({'error': 'No session ID provided'}), 400
-        
-        if not message:
-            return jsonify({'error': 'No message provided'}), 400
-        
-        if session_id not in chat_sessions:
-            return jsonify({'error': 'Session not found'}), 404
-        
-        chat_session = chat_sessions[session_id]
-        
-        if chat_session.document_id not in document_store:
-            return jsonify({'error': 'Document not found'}), 404
+        chat_request, error_response = read_chat_request()
+        if error_response:
+            return error_response
         
-        document = document_store[chat_session.document_id]
+        chat_session, document, message = chat_request['session'], chat_request['document'], chat_request['message']
+        session_id = chat_session.session_id
         
         # Add user message
         user_msg = chat_session.add_message('user', message)
         
         # Generate AI response
         ai_response = generate_intelligent_response(
-            message, 
-            document['text'], 
-            chat_session.messages,
-            document['filename']
+            message,
+            get_session_chatbot(chat_session, document),
+            chat_session.messages
         )
         
-        # Add AI message
-        ai_msg = chat_session.add_message('assistant', ai_response)
+        # Add AI message, with the pages of any passages it quotes
+        quote_pages = find_quote_pages(ai_response, document['normalized'], document['page_index'])
+        ai_msg = chat_session.add_message('assistant', ai_response, {'quote_pages': quote_pages})
         
         logger.info(f"Enhanced chat response generated for session {session_id}")
         
@@ -566,6 +877,34 @@ def chat():
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Chat failed', 'message': str(e)}), 500
 
+@app.route('/chat/stream', methods=['POST', 'OPTIONS'])
+def chat_stream():
+    """Chat turn whose reply streams as NDJSON or SSE while the model writes it"""
+    if request.method == 'OPTIONS':
+        return jsonify({'status': 'ok'})
+    
+    try:
+        chat_request, error_response = read_chat_request()
+        if error_response:
+            return error_response
+        
+        stream_format = requested_stream_format(request.args.get('format') or chat_request['format'],
+                                                request.headers.get('Accept', ''))
+        if stream_format not in STREAM_FORMATS:
+            return jsonify({
+                'error': 'Invalid stream format',
+                'message': f"Format must be one of: {', '.join(STREAM_FORMATS)}"
+            }), 400
+        
+        events = generate_chat_events(chat_request['session'], chat_request['document'], chat_request['message'],
+                                      stream_format)
+        return event_stream_response(events, stream_format)
+        
+    except Exception as e:
+        logger.error(f"Chat stream failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': 'Chat failed', 'message': str(e)}), 500
+
 @app.route('/chat-history/<session_id>', methods=['GET', 'OPTIONS'])
 def get_chat_history(session_id):
     if request.method == 'OPTIONS':
@@ -629,7 +968,11 @@ def delete_session(session_id):
         if session_id not in chat_sessions:
             return jsonify({'error': 'Session not found'}), 404
         
-        del chat_sessions[session_id]
+        document_id = chat_sessions.pop(session_id).document_id
+        session_chatbots.pop(session_id, None)
+        # Documents are only reachable through their sessions
+        if not any(other.document_id == document_id for other in list(chat_sessions.values())):
+            release_document(document_id)
         
         return jsonify({
             'status': 'success',
@@ -647,7 +990,10 @@ def health_check():
     
     try:
         # Check Vertex AI status
-        vertex_status = "connected" if initialize_vertex_ai() else "disconnected"
+        if CHAT_MODEL == 'fake':
+            vertex_status = "not used"
+        else:
+            vertex_status = "connected" if initialize_vertex_ai() else "disconnected"
         
         return jsonify({
             'status': 'healthy',
@@ -655,6 +1001,7 @@ def health_check():
             'version': '5.0.0',
             'ai_provider': 'Google Vertex AI',
             'model': MODEL_NAME,
+            'chat_model': CHAT_MODEL,
             'vertex_ai_status': vertex_status,
             'capabilities': [
                 'Document-specific analysis',
@@ -665,8 +1012,24 @@ def health_check():
             ],
             'statistics': {
                 'active_sessions': len(chat_sessions),
-                'documents_stored': len(document_store)
+                'documents_stored': len(document_store),
+                'cached_chatbots': len(session_chatbots)
+            },
+            'retrieval': {
+                'top_k': RETRIEVAL_TOP_K,
+                'dense_index_available': NUMPY_AVAILABLE
+            },
+            'streaming': stream_metrics_summary(),
+            'context_caching': {
+                'enabled': CONTEXT_CACHING,
+                'min_chars': CONTEXT_CACHE_MIN_CHARS,
+                'ttl_seconds': CONTEXT_CACHE_TTL_SECONDS,
+                'cached_documents': sum(
+                    1 for document in document_store.values()
+                    if document['context'] is not None and not document['context'].expired()
+                )
             },
+            'extraction': document_extractor.stats(),
             'features': [
                 'Enhanced Legal Intelligence',
                 'Dual-mode Question Handling',
@@ -707,7 +1070,9 @@ if __name__ == '__main__':
         logger.info("=== STARTING ENHANCED LEGAL DOCUMENT CHATBOT ===")
         
         # Initialize Vertex AI
-        if initialize_vertex_ai():
+        if CHAT_MODEL == 'fake':
+            logger.info("🤖 Chat model: local fake (CHAT_MODEL=fake)")
+        elif initialize_vertex_ai():
             logger.info("🤖 Google Vertex AI: ✓ Connected")
             logger.info(f"🧠 Model: {MODEL_NAME}")
             logger.info("⚖️ Legal Intelligence: ✓ Enhanced Mode")
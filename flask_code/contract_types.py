@@ -0,0 +1,71 @@
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List
+
+# Weighted keywords per contract type. Tokens are matched whole, so plural and
+# inflected forms are listed explicitly.
+CONTRACT_TYPE_KEYWORDS = {
+    'employment': {
+        'employee': 2.0, 'employees': 2.0, 'employment': 3.0, 'employer': 2.0,
+        'job': 1.0, 'position': 1.0, 'salary': 2.0, 'wages': 2.0, 'wage': 1.5,
+        'overtime': 1.5, 'severance': 2.0, 'probation': 1.5
+    },
+    'software': {
+        'software': 3.0, 'application': 1.0, 'applications': 1.0, 'development': 1.0,
+        'coding': 1.5, 'programming': 1.5, 'saas': 3.0, 'license': 1.5, 'licensee': 2.0,
+        'licensor': 2.0, 'source': 1.0, 'uptime': 2.0, 'api': 2.0
+    },
+    'rental': {
+        'lease': 3.0, 'rent': 2.5, 'rental': 2.5, 'tenant': 3.0, 'tenants': 3.0,
+        'landlord': 3.0, 'property': 1.0, 'premises': 2.0, 'lessee': 2.5, 'lessor': 2.5
+    },
+    'service': {
+        'service': 1.0, 'services': 1.0, 'consulting': 2.0, 'consultant': 2.0,
+        'professional': 1.0, 'deliverables': 1.5, 'statement': 0.5, 'work': 0.5
+    },
+    'sales': {
+        'purchase': 2.0, 'sale': 2.0, 'buy': 1.5, 'buyer': 2.0, 'sell': 1.5, 'seller': 2.0,
+        'goods': 2.5, 'delivery': 1.0, 'shipment': 1.5, 'merchandise': 2.0
+    }
+}
+
+# Secondary types whose score is at least this fraction of the best one are also applied
+CLOSE_SCORE_RATIO = 0.8
+
+TOKEN_PATTERN = re.compile(r'[a-z]+')
+
+@lru_cache(maxsize=32)
+def token_counts(text: str) -> Counter:
+    """Tokenize a document once and cache the lowercase word counts"""
+    return Counter(TOKEN_PATTERN.findall(text.lower()))
+
+def score_contract_types(text: str) -> Dict[str, float]:
+    """Score every contract type from a single tokenization of the text.
+
+    Repeated keywords are damped logarithmically so one word used throughout a
+    document cannot outweigh several distinct signals for another type.
+    """
+    counts = token_counts(text)
+    scores = {}
+    for contract_type, keywords in CONTRACT_TYPE_KEYWORDS.items():
+        score = 0.0
+        for keyword, weight in keywords.items():
+            count = counts.get(keyword, 0)
+            if count:
+                score += weight * (1 + math.log(count))
+        scores[contract_type] = round(score, 2)
+    return scores
+
+def ranked_contract_types(scores: Dict[str, float], ratio: float = CLOSE_SCORE_RATIO) -> List[str]:
+    """Return the best type followed by any whose score is close to it, or ['general']"""
+    best = max(scores.values(), default=0)
+    if best <= 0:
+        return ['general']
+    close = [contract_type for contract_type, score in scores.items() if score >= best * ratio]
+    return sorted(close, key=lambda contract_type: scores[contract_type], reverse=True)
+
+def detect_contract_type(text: str) -> str:
+    """Return the highest scoring contract type"""
+    return ranked_contract_types(score_contract_types(text))[0]
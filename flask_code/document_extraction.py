@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+from typing import Any, Container, Dict, Optional, Tuple
+
+from analysis_cache import ContentCache, content_key
+from extraction_sandbox import ExtractionSandbox
+from lazy_extraction import LazyDocumentText
+from pdf_extraction import extract_pdf_pages, format_pdf_pages
+from upload_handling import Buffer
+
+logger = logging.getLogger(__name__)
+
+# Try to import python-magic with graceful fallback
+try:
+    import magic
+    MAGIC_AVAILABLE = True
+    logger.info("python-magic library loaded successfully")
+except ImportError:
+    MAGIC_AVAILABLE = False
+    logger.warning("python-magic not available. Using fallback MIME detection.")
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+EXTENSION_TO_MIME = {
+    '.pdf': 'application/pdf',
+    '.docx': DOCX_MIME_TYPE,
+    '.doc': 'application/msword',
+    '.txt': 'text/plain'
+}
+
+# Extracted text shared by the analyzer and the chatbot. Set TEXT_CACHE_DB to a path both
+# processes can open and a document parsed by one is not parsed again by the other. The file
+# holds the plain text of every uploaded contract until it is evicted by count, so the store
+# is off by default; when enabled, its directory and file are created readable by the owner only
+TEXT_CACHE_DB = os.getenv('TEXT_CACHE_DB', '')
+TEXT_CACHE_SIZE = int(os.getenv('TEXT_CACHE_SIZE', '64'))
+# Sandboxed parser processes per service (timeout and memory limits in extraction_sandbox)
+EXTRACTION_PROCESSES = int(os.getenv('EXTRACTION_PROCESSES', str(os.cpu_count() or 2)))
+# Bump whenever the local parsers change their output
+EXTRACTOR_VERSION = '1'
+LOCAL_METHOD = 'local'
+
+def detect_mime_type(file_content: bytes, filename: str, supported_types: Container[str]) -> str:
+    """Detect MIME type using multiple methods; the first few KB of the file are enough"""
+    # Method 1: Try python-magic if available
+    if MAGIC_AVAILABLE:
+        try:
+            mime_type = magic.from_buffer(file_content, mime=True)
+            if mime_type in supported_types:
+                return mime_type
+        except Exception as e:
+            logger.warning(f"python-magic detection failed: {e}")
+
+    # Method 2: Check file signature (magic bytes)
+    if file_content.startswith(b'%PDF'):
+        return 'application/pdf'
+    elif file_content.startswith(b'PK\x03\x04') or file_content.startswith(b'PK\x05\x06') or file_content.startswith(b'PK\x07\x08'):
+        if filename and filename.lower().endswith('.docx'):
+            return DOCX_MIME_TYPE
+    elif file_content.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        if filename and filename.lower().endswith('.doc'):
+            return 'application/msword'
+
+    # Method 3: Extension-based fallback
+    if filename:
+        _, ext = os.path.splitext(filename.lower())
+        if EXTENSION_TO_MIME.get(ext) in supported_types:
+            return EXTENSION_TO_MIME[ext]
+
+    raise ValueError(f"Could not determine MIME type for file: {filename}")
+
+def extract_local_prefix(file_content: Buffer, mime_type: str, budget: Optional[int]) -> Tuple[str, bool]:
+    """First budget characters of a document, and whether that is the whole document.
+
+    Without a budget the whole document is extracted, large PDFs page-parallel.
+    """
+    if budget is None:
+        if mime_type == 'application/pdf':
+            return format_pdf_pages(extract_pdf_pages(file_content)).strip(), True
+        return LazyDocumentText(file_content, mime_type).full(), True
+    document_text = LazyDocumentText(file_content, mime_type)
+    return document_text.prefix(budget), document_text.complete
+
+class DocumentExtractor:
+    """Local extraction shared by both services: sandboxed parsers behind a text cache.
+
+    Entries are keyed by content hash and MIME type and hold the longest prefix
+    extracted so far, so a shorter request is served from a longer one. Text from
+    a document processor such as Document AI replaces local text, never the reverse.
+    """
+
+    def __init__(self, sandbox: ExtractionSandbox, cache: ContentCache):
+        self.sandbox = sandbox
+        self.cache = cache
+        self._lock = threading.Lock()
+
+    def cached_text(self, digest: str, mime_type: str, budget: Optional[int],
+                    allow_local: bool = True) -> Optional[Tuple[str, bool]]:
+        """Cached (text, complete) covering budget characters, or the whole document without a budget"""
+        entry = self.cache.get(self._key(digest, mime_type))
+        if entry is None or (entry['method'] == LOCAL_METHOD and not allow_local):
+            return None
+        if budget is None:
+            return (entry['text'], True) if entry['complete'] else None
+        if not entry['complete'] and len(entry['text']) < budget:
+            return None
+        return entry['text'][:budget], entry['complete'] and len(entry['text']) <= budget
+
+    def extract(self, file_content: Buffer, mime_type: str, budget: Optional[int], digest: str) -> Tuple[str, bool]:
+        """(text, complete) for the first budget characters, or the whole document when budget
+        is None, parsing only on a cache miss.
+
+        Raises ExtractionError when the sandboxed parsers fail.
+        """
+        cached = self.cached_text(digest, mime_type, budget)
+        if cached is not None:
+            logger.info(f"Text cache hit for {digest[:12]}")
+            return cached
+        text, complete = self.sandbox.run(extract_local_prefix, file_content, mime_type, budget)
+        self.store(digest, mime_type, text, complete, LOCAL_METHOD)
+        return text, complete
+
+    def store(self, digest: str, mime_type: str, text: str, complete: bool, method: str) -> None:
+        """Cache extracted text unless a better or longer entry is already there"""
+        key = self._key(digest, mime_type)
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None and not self._replaces(entry, text, complete, method):
+                return
+            self.cache.put(key, {'text': text, 'complete': complete, 'method': method})
+
+    def stats(self) -> Dict[str, Any]:
+        """Return text cache and sandbox counters"""
+        return {'text_cache': self.cache.stats(), 'sandbox': self.sandbox.stats()}
+
+    @staticmethod
+    def _replaces(entry: Dict[str, Any], text: str, complete: bool, method: str) -> bool:
+        if (entry['method'] == LOCAL_METHOD) != (method == LOCAL_METHOD):
+            return entry['method'] == LOCAL_METHOD
+        return not entry['complete'] and (complete or len(text) > len(entry['text']))
+
+    @staticmethod
+    def _key(digest: str, mime_type: str) -> str:
+        return content_key(digest, mime_type, EXTRACTOR_VERSION)
+
+def create_document_extractor(workers: Optional[int] = None) -> DocumentExtractor:
+    """Extractor with its own sandbox workers, EXTRACTION_PROCESSES by default, and the shared text cache"""
+    cache = ContentCache(max_entries=TEXT_CACHE_SIZE, db_path=TEXT_CACHE_DB or None)
+    sandbox = ExtractionSandbox(workers=workers or EXTRACTION_PROCESSES,
+                                preload=('document_extraction', 'pdf_extraction'))
+    return DocumentExtractor(sandbox, cache)
@@ -0,0 +1,187 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.cloud import documentai
+
+from pdf_extraction import format_pdf_pages, pdf_page_count, split_pdf
+from upload_handling import Buffer
+
+logger = logging.getLogger(__name__)
+
+# Synchronous Document AI requests are limited to 15 pages for OCR processors
+DOCUMENT_AI_PAGE_LIMIT = 15
+# Pages whose local text layer has fewer non-whitespace characters are treated as scanned
+MIN_PAGE_TEXT_CHARS = 100
+
+class DocumentProcessor(ABC):
+    """A remote service that turns one document into plain text"""
+
+    name = 'processor'
+
+    @abstractmethod
+    def process(self, file_content: bytes, mime_type: str) -> List[str]:
+        """Return the text of each page; a single entry when the service reports no pages"""
+
+class DocumentAIProcessor(DocumentProcessor):
+    """Google Document AI processor called with process_document"""
+
+    name = 'document_ai'
+
+    def __init__(self, client: documentai.DocumentProcessorServiceClient, processor_name: str):
+        self.client = client
+        self.processor_name = processor_name
+
+    def process(self, file_content: bytes, mime_type: str) -> List[str]:
+        request_obj = documentai.ProcessRequest(
+            name=self.processor_name,
+            raw_document=documentai.RawDocument(
+                content=file_content,
+                mime_type=mime_type
+            )
+        )
+        result = self.client.process_document(request=request_obj)
+        text = result.document.text or ""
+        if not result.document.pages:
+            return [text]
+        # Each page's layout points at its spans of the document text
+        return ["".join(text[int(segment.start_index):int(segment.end_index)]
+                        for segment in page.layout.text_anchor.text_segments)
+                for page in result.document.pages]
+
+def page_needs_ocr(page_text: Optional[str], min_chars: int = MIN_PAGE_TEXT_CHARS) -> bool:
+    """True for pages with little or no text layer, such as scans and images"""
+    if page_text is None:
+        return True
+    return len("".join(page_text.split())) < min_chars
+
+def page_runs(page_numbers: List[int], max_pages: int) -> List[Tuple[int, int]]:
+    """Group sorted page numbers into contiguous [start, end) runs of at most max_pages"""
+    runs: List[Tuple[int, int]] = []
+    for page_num in page_numbers:
+        if runs and runs[-1][1] == page_num and page_num - runs[-1][0] < max_pages:
+            runs[-1] = (runs[-1][0], page_num + 1)
+        else:
+            runs.append((page_num, page_num + 1))
+    return runs
+
+def _run_inline(func: Callable[..., Any], *args: Any) -> Any:
+    return func(*args)
+
+class ShardedDocumentProcessor:
+    """Sends large PDFs to a processor as page-range shards, a bounded number at a time.
+
+    The in-flight limit is shared by every request using this instance. Shard
+    pages are merged in page order under the page markers of local extraction,
+    so page numbers survive processing. Page counting and splitting parse the
+    upload, so they go through run(func, *args), such as an extraction
+    sandbox's run; by default they are called in-process.
+    """
+
+    def __init__(self, processor: DocumentProcessor, pages_per_shard: int = DOCUMENT_AI_PAGE_LIMIT,
+                 max_in_flight: int = 4, run: Optional[Callable[..., Any]] = None):
+        self.processor = processor
+        self.run = run or _run_inline
+        self.pages_per_shard = pages_per_shard
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='doc-shard')
+        self._lock = threading.Lock()
+        self.counters = {
+            'documents': 0,
+            'processor_calls': 0,
+            'pages_sent': 0,
+            'pages_kept_local': 0
+        }
+
+    @property
+    def name(self) -> str:
+        return self.processor.name
+
+    def process(self, file_content: bytes, mime_type: str,
+                on_shard_error: Optional[Callable[[int, int], List[Optional[str]]]] = None) -> str:
+        """Extract a document, sharding PDFs longer than pages_per_shard.
+
+        on_shard_error(start, end) supplies the page texts of a range whose
+        shard failed; without it the first failure is raised.
+        """
+        if mime_type != 'application/pdf':
+            self._count(documents=1, processor_calls=1)
+            pages = self.processor.process(file_content, mime_type)
+            return format_pdf_pages(pages) if len(pages) > 1 else "".join(pages)
+
+        page_count = self.run(pdf_page_count, file_content)
+        if page_count <= self.pages_per_shard:
+            self._count(documents=1, processor_calls=1, pages_sent=page_count)
+            return format_pdf_pages(self._page_texts(self.processor.process(file_content, mime_type), 0, page_count))
+
+        self._count(documents=1, pages_sent=page_count)
+
+        ranges = page_runs(list(range(page_count)), self.pages_per_shard)
+        logger.info(f"Processing {page_count} pages as {len(ranges)} shards, "
+                    f"up to {self.max_in_flight} in flight")
+        return format_pdf_pages([page_text for texts in self._process_ranges(file_content, ranges, on_shard_error)
+                                 for page_text in texts])
+
+    def process_scanned_pages(self, file_content: Buffer, local_pages: List[Optional[str]],
+                              min_chars: int = MIN_PAGE_TEXT_CHARS) -> str:
+        """Merge local page texts with processor text for the pages that look scanned.
+
+        Only low-text pages are sent, grouped into contiguous shards; pages with a
+        usable text layer never leave the process. Output keeps the page markers of
+        local extraction, with processed pages marked (OCR).
+        """
+        scanned = [page_num for page_num, page_text in enumerate(local_pages) if page_needs_ocr(page_text, min_chars)]
+        self._count(documents=1, pages_sent=len(scanned), pages_kept_local=len(local_pages) - len(scanned))
+        logger.info(f"Page routing: {len(local_pages) - len(scanned)} local, {len(scanned)} to {self.name}")
+
+        ranges = page_runs(scanned, self.pages_per_shard)
+        remote_texts = self._process_ranges(
+            file_content, ranges, on_shard_error=lambda start, end: local_pages[start:end]
+        ) if ranges else []
+        remote_pages = {}
+        for (start, end), texts in zip(ranges, remote_texts):
+            remote_pages.update(zip(range(start, end), texts))
+
+        return "".join(
+            format_pdf_pages([remote_pages[page_num]], page_num + 1, 'OCR') if page_num in remote_pages
+            else format_pdf_pages([local_pages[page_num]], page_num + 1)
+            for page_num in range(len(local_pages))
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return call and page routing counters"""
+        with self._lock:
+            return dict(self.counters, processor=self.name, pages_per_shard=self.pages_per_shard,
+                        max_in_flight=self.max_in_flight)
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for counter, value in increments.items():
+                self.counters[counter] += value
+
+    def _page_texts(self, texts: List[str], start: int, end: int) -> List[Optional[str]]:
+        """Fit a processor result to the pages start..end; text without page layout goes on the first page"""
+        if len(texts) == end - start:
+            return list(texts)
+        logger.warning(f"{self.name} returned {len(texts)} pages for pages {start + 1}-{end}")
+        return ["\n".join(texts)] + [""] * (end - start - 1)
+
+    def _process_ranges(self, file_content: Buffer, ranges: List[Tuple[int, int]],
+                        on_shard_error: Optional[Callable[[int, int], List[Optional[str]]]]
+                        ) -> List[List[Optional[str]]]:
+        shards = self.run(split_pdf, file_content, ranges)
+        self._count(processor_calls=len(shards))
+        futures = [self._executor.submit(self.processor.process, shard, 'application/pdf') for shard in shards]
+
+        texts = []
+        for (start, end), future in zip(ranges, futures):
+            try:
+                texts.append(self._page_texts(future.result(), start, end))
+            except Exception as e:
+                if on_shard_error is None:
+                    raise
+                logger.warning(f"Shard for pages {start + 1}-{end} failed: {e}, using fallback")
+                texts.append(on_shard_error(start, end))
+        return texts
@@ -0,0 +1,101 @@
+import re
+import zipfile
+from typing import IO, Iterator, List, Set
+from xml.etree.ElementTree import iterparse
+
+from upload_handling import Buffer, open_buffer
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+
+PARAGRAPH = W + 'p'
+TABLE_ROW = W + 'tr'
+TABLE_CELL = W + 'tc'
+TEXT_PARTS = {W + 't': None, W + 'tab': '\t', W + 'br': '\n', W + 'cr': '\n'}
+
+BODY_PART = 'word/document.xml'
+HEADER_PART_PATTERN = re.compile(r'word/header\d*\.xml$')
+FOOTER_PART_PATTERN = re.compile(r'word/footer\d*\.xml$')
+
+def _paragraph_text(paragraph) -> str:
+    parts = []
+    for element in paragraph.iter():
+        if element.tag in TEXT_PARTS:
+            replacement = TEXT_PARTS[element.tag]
+            parts.append((element.text or '') if replacement is None else replacement)
+    return ''.join(parts)
+
+def iter_part_lines(stream: IO[bytes]) -> Iterator[str]:
+    """Yield the paragraphs of one WordprocessingML part as they are parsed.
+
+    Table rows are yielded as one line with cells separated by ' | '. Parsed
+    elements are cleared straight away, so memory stays flat on long documents.
+    Alternate content repeats the text of its preferred choice in mc:Fallback,
+    so nothing inside a fallback is yielded.
+    """
+    row_stack: List[List[str]] = []
+    cell_stack: List[List[str]] = []
+    fallback_depth = 0
+    for event, element in iterparse(stream, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if tag == MC_FALLBACK:
+                fallback_depth += 1
+            elif tag == TABLE_ROW and not fallback_depth:
+                row_stack.append([])
+            elif tag == TABLE_CELL and not fallback_depth:
+                cell_stack.append([])
+            continue
+
+        if tag == MC_FALLBACK:
+            fallback_depth -= 1
+            element.clear()
+        elif fallback_depth:
+            continue
+        elif tag == PARAGRAPH:
+            text = _paragraph_text(element)
+            element.clear()
+            if cell_stack:
+                cell_stack[-1].append(text)
+            else:
+                yield text
+        elif tag == TABLE_CELL:
+            row_stack[-1].append(' '.join(text for text in cell_stack.pop() if text))
+            element.clear()
+        elif tag == TABLE_ROW:
+            cells = row_stack.pop()
+            element.clear()
+            if not any(cells):
+                continue
+            line = ' | '.join(cells)
+            # Rows of a table nested in a cell become part of that cell
+            if cell_stack:
+                cell_stack[-1].append(line)
+            else:
+                yield line
+
+def _unique_part_lines(archive: zipfile.ZipFile, names: List[str], label: str, seen: Set[str]) -> Iterator[str]:
+    for name in names:
+        with archive.open(name) as stream:
+            lines = list(iter_part_lines(stream))
+        text = '\n'.join(lines)
+        if not text.strip() or text in seen:
+            continue
+        seen.add(text)
+        yield f"--- {label} ---"
+        yield from lines
+
+def iter_docx_lines(file_content: Buffer) -> Iterator[str]:
+    """Yield the lines of a DOCX: headers, then the body with tables, then footers.
+
+    Headers and footers that repeat across sections are included once.
+    """
+    with zipfile.ZipFile(open_buffer(file_content)) as archive:
+        names = archive.namelist()
+        seen: Set[str] = set()
+        yield from _unique_part_lines(archive, sorted(name for name in names if HEADER_PART_PATTERN.match(name)),
+                                      'Header', seen)
+        with archive.open(BODY_PART) as stream:
+            yield from iter_part_lines(stream)
+        yield from _unique_part_lines(archive, sorted(name for name in names if FOOTER_PART_PATTERN.match(name)),
+                                      'Footer', seen)
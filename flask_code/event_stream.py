@@ -0,0 +1,30 @@
+import json
+from typing import Any, Dict, Iterator, Optional
+
+from flask import Response
+
+# Progressive response formats shared by the streaming endpoints
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
+
+def requested_stream_format(requested: Optional[str], accept: str) -> str:
+    """Format asked for explicitly, otherwise SSE when the client accepts it and NDJSON if not"""
+    if requested:
+        return requested
+    return 'sse' if 'text/event-stream' in accept else 'ndjson'
+
+def format_stream_event(event: str, data: Dict[str, Any], stream_format: str) -> str:
+    """Serialize one progress event as an SSE message or an NDJSON line"""
+    if stream_format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({'event': event, 'data': data}) + "\n"
+
+def event_stream_response(events: Iterator[str], stream_format: str) -> Response:
+    """Streaming response for already formatted events"""
+    response = Response(events, mimetype=STREAM_FORMATS[stream_format])
+    # Keep reverse proxies from buffering the stream
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,223 @@
+import importlib
+import logging
+import mmap
+import multiprocessing
+import multiprocessing.util
+import os
+import signal
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+# RLIMIT_AS is only available on Unix; elsewhere workers run without a memory cap
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+EXTRACTION_TIMEOUT_SECONDS = float(os.getenv('EXTRACTION_TIMEOUT_SECONDS', '60'))
+# Address space a worker may grow by above its size at start-up
+EXTRACTION_MEMORY_LIMIT_MB = int(os.getenv('EXTRACTION_MEMORY_LIMIT_MB', '1024'))
+# Workers are replaced after this many documents so leaked parser state does not pile up
+EXTRACTION_TASKS_PER_WORKER = int(os.getenv('EXTRACTION_TASKS_PER_WORKER', '50'))
+# Processes a parser may start inside a worker; each inherits the worker's memory limit
+EXTRACTION_CHILD_PROCESSES = int(os.getenv('EXTRACTION_CHILD_PROCESSES', '2'))
+
+# Set in sandbox workers only
+_child_process_limit: Optional[int] = None
+
+class ExtractionError(Exception):
+    """Raised when a document could not be extracted in a sandbox worker"""
+
+class ExtractionTimeoutError(ExtractionError):
+    """Raised when extraction runs past the wall-clock timeout"""
+
+def _address_space_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def child_process_limit() -> Optional[int]:
+    """Processes a parser may start in this sandbox worker, or None outside the sandbox"""
+    return _child_process_limit
+
+def _worker_main(conn, memory_limit_mb: int, child_processes: int, preload: Sequence[str]) -> None:
+    global _child_process_limit
+    _child_process_limit = child_processes
+    # Lead a process group so the page pool a parser starts dies with the worker
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    # Workers start from a fresh interpreter; import the parsers before the cap applies
+    for module in preload:
+        importlib.import_module(module)
+    if RESOURCE_AVAILABLE and memory_limit_mb > 0:
+        limit = _address_space_bytes() + memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+
+        func, args = task
+        try:
+            conn.send(('ok', func(*args)))
+        except MemoryError:
+            # The heap may be left fragmented near the limit; let the parent start a fresh worker
+            conn.send(('memory', 'Document needs more memory than extraction is allowed'))
+            return
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: int, child_processes: int, preload: Sequence[str]):
+        self.conn, child_conn = context.Pipe()
+        # Not daemonic, so parsers may start page pools of their own
+        self.process = context.Process(target=_worker_main,
+                                       args=(child_conn, memory_limit_mb, child_processes, preload),
+                                       name='extraction-worker', daemon=False)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        if hasattr(os, 'killpg'):
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                # No children were left in the worker's group
+                pass
+        self.conn.close()
+
+class ExtractionSandbox:
+    """Runs parsers in recycled worker processes with a timeout and a memory cap.
+
+    A worker that times out, crashes or hits its address-space limit is killed
+    and replaced on the next call, so a malformed document costs one worker for
+    at most timeout seconds and never the calling request thread.
+
+    Workers come from a forkserver rather than a fork of the threaded server,
+    and are stopped when the interpreter exits. The memory limit applies to
+    each process, so parsers in a worker may start at most child_processes
+    more, bounding a worker's total to (child_processes + 1) times the limit.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = EXTRACTION_TIMEOUT_SECONDS,
+                 memory_limit_mb: int = EXTRACTION_MEMORY_LIMIT_MB,
+                 tasks_per_worker: int = EXTRACTION_TASKS_PER_WORKER,
+                 child_processes: int = EXTRACTION_CHILD_PROCESSES, preload: Sequence[str] = ()):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.tasks_per_worker = tasks_per_worker
+        self.child_processes = child_processes
+        # Modules each worker imports before its memory limit is set
+        self.preload = tuple(preload)
+        # Forking the server itself could copy a lock another thread holds into the worker
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+        self._slots = threading.BoundedSemaphore(workers)
+        self._idle: List[_Worker] = []
+        self._workers: Set[_Worker] = set()
+        self._lock = threading.Lock()
+        self.counters = {
+            'tasks': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'workers_started': 0,
+            'workers_replaced': 0
+        }
+        # Workers are not daemonic; stop them before multiprocessing waits for its children at exit
+        multiprocessing.util.Finalize(None, self.close, exitpriority=10)
+
+    def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Call func(*args) in a worker and return its result, or raise ExtractionError.
+
+        func must be importable by name. Plain memory maps cannot be pickled and
+        are sent as bytes; mapped uploads send their file descriptor instead.
+        """
+        args = tuple(bytes(arg) if type(arg) is mmap.mmap else arg for arg in args)
+        with self._slots:
+            worker = self._checkout()
+            try:
+                status, value = self._call(worker, func, args)
+            except BaseException:
+                self._discard(worker)
+                raise
+
+            worker.tasks += 1
+            if status == 'memory' or worker.tasks >= self.tasks_per_worker:
+                self._discard(worker)
+            else:
+                with self._lock:
+                    self._idle.append(worker)
+
+        if status != 'ok':
+            self._count(failed=1)
+            raise ExtractionError(value)
+        return value
+
+    def close(self) -> None:
+        """Stop every worker; later calls start new ones"""
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+            self._idle.clear()
+        for worker in workers:
+            worker.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return task and worker counters"""
+        with self._lock:
+            return dict(self.counters, workers=self.workers, idle_workers=len(self._idle),
+                        timeout_seconds=self.timeout, memory_limit_mb=self.memory_limit_mb,
+                        child_processes=self.child_processes)
+
+    def _call(self, worker: _Worker, func: Callable[..., Any], args: tuple) -> tuple:
+        self._count(tasks=1)
+        worker.conn.send((func, args))
+        if not worker.conn.poll(self.timeout):
+            self._count(timed_out=1, failed=1)
+            logger.warning(f"Extraction worker {worker.process.pid} timed out after {self.timeout}s, replacing it")
+            raise ExtractionTimeoutError(f"Extraction did not finish within {self.timeout:g} seconds")
+        try:
+            return worker.conn.recv()
+        except (EOFError, ConnectionResetError):
+            self._count(failed=1)
+            logger.warning(f"Extraction worker {worker.process.pid} exited with code {worker.process.exitcode}")
+            raise ExtractionError("Extraction worker crashed while parsing the document")
+
+    def _checkout(self) -> _Worker:
+        while True:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            if worker is None:
+                self._count(workers_started=1)
+                worker = _Worker(self._context, self.memory_limit_mb, self.child_processes, self.preload)
+                with self._lock:
+                    self._workers.add(worker)
+                return worker
+            if worker.process.is_alive():
+                return worker
+            self._discard(worker)
+
+    def _discard(self, worker: _Worker) -> None:
+        with self._lock:
+            self._workers.discard(worker)
+        worker.stop()
+        self._count(workers_replaced=1)
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for counter, value in increments.items():
+                self.counters[counter] += value
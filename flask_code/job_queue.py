@@ -0,0 +1,156 @@
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the pending queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class JobQueue:
+    """Fixed pool of worker threads fed from a bounded queue.
+
+    Finished jobs are kept for retention_seconds so clients can poll for them,
+    then dropped on the next submission. Workers start with the first job, so
+    importing a module that creates a queue starts no threads.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int = 32, retention_seconds: float = 3600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._running = 0
+        self._started = False
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_wait = 0.0
+        self.counters = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0
+        }
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> str:
+        """Queue func(*args) and return its job id, or raise QueueFullError"""
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        with self._lock:
+            self._expire_finished()
+            try:
+                self._pending.put_nowait((job_id, func, args))
+            except queue.Full:
+                self.counters['rejected'] += 1
+                raise QueueFullError(self._retry_after())
+            self._jobs[job_id] = job
+            self.counters['submitted'] += 1
+            if not self._started:
+                self._started = True
+                for index in range(self.workers):
+                    threading.Thread(target=self._work, name=f'analysis-worker-{index}', daemon=True).start()
+        return job_id
+
+    def get(self, job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """Return a snapshot of the job, waiting up to wait seconds for it to finish"""
+        deadline = time.monotonic() + wait
+        with self._lock:
+            job = self._jobs.get(job_id)
+            while job is not None and job['status'] in ('queued', 'running'):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._finished.wait(remaining)
+                job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            if snapshot['status'] == 'queued':
+                snapshot['queue_position'] = self._queue_position(job_id)
+            return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, wait times and job counters"""
+        with self._lock:
+            started = self.counters['completed'] + self.counters['failed'] + self._running
+            oldest_wait = 0.0
+            now = time.time()
+            for job in self._jobs.values():
+                if job['status'] == 'queued':
+                    oldest_wait = max(oldest_wait, now - job['submitted_at'])
+            stats = dict(self.counters)
+            stats.update({
+                'workers': self.workers,
+                'running': self._running,
+                'queue_depth': self._pending.qsize(),
+                'max_pending': self.max_pending,
+                'avg_wait_ms': round(self._total_wait / started * 1000, 1) if started else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 1),
+                'oldest_queued_ms': round(oldest_wait * 1000, 1)
+            })
+            return stats
+
+    def _work(self) -> None:
+        while True:
+            job_id, func, args = self._pending.get()
+            with self._lock:
+                job = self._jobs[job_id]
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                waited = job['started_at'] - job['submitted_at']
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+                self._running += 1
+
+            try:
+                result, error, status = func(*args), None, 'completed'
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                result, error, status = None, str(e), 'failed'
+
+            with self._lock:
+                job['finished_at'] = time.time()
+                job['result'] = result
+                job['error'] = error
+                job['status'] = status
+                self._running -= 1
+                self._total_run += job['finished_at'] - job['started_at']
+                self.counters[status] += 1
+                self._finished.notify_all()
+
+    def _queue_position(self, job_id: str) -> int:
+        queued = [job for job in self._jobs.values() if job['status'] == 'queued']
+        queued.sort(key=lambda job: job['submitted_at'])
+        return next(index for index, job in enumerate(queued, 1) if job['id'] == job_id)
+
+    def _retry_after(self) -> int:
+        # Time for the workers to drain the current backlog at the average job duration
+        finished = self.counters['completed'] + self.counters['failed']
+        average_run = self._total_run / finished if finished else 1.0
+        return max(1, math.ceil(average_run * self._pending.qsize() / self.workers))
+
+    def _expire_finished(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] is not None and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
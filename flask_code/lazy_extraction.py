@@ -0,0 +1,98 @@
+import logging
+import threading
+from typing import Iterator, List
+
+import PyPDF2
+
+from docx_extraction import iter_docx_lines
+from upload_handling import Buffer, open_buffer
+
+logger = logging.getLogger(__name__)
+
+def iter_pdf_blocks(file_content: Buffer) -> Iterator[str]:
+    """Yield one page-marked block per PDF page, parsing each page only when asked for"""
+    pdf_reader = PyPDF2.PdfReader(open_buffer(file_content))
+    for page_num, page in enumerate(pdf_reader.pages, 1):
+        try:
+            yield f"\n--- Page {page_num} ---\n{page.extract_text()}\n"
+        except Exception as e:
+            logger.warning(f"Failed to extract text from page {page_num}: {e}")
+            yield f"\n--- Page {page_num} (extraction failed) ---\n"
+
+def iter_docx_blocks(file_content: Buffer) -> Iterator[str]:
+    """Yield DOCX paragraphs, table rows, headers and footers one line at a time"""
+    for line in iter_docx_lines(file_content):
+        yield line + "\n"
+
+def iter_plain_blocks(file_content: Buffer) -> Iterator[str]:
+    raw = bytes(file_content)
+    try:
+        yield raw.decode('utf-8')
+    except UnicodeDecodeError:
+        yield raw.decode('latin-1')
+
+BLOCK_READERS = {
+    'application/pdf': iter_pdf_blocks,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': iter_docx_blocks,
+    'text/plain': iter_plain_blocks
+}
+
+class LazyDocumentText:
+    """Document text that is only parsed as far as callers have asked for.
+
+    prefix(budget) stops pulling blocks once budget characters are available;
+    full() parses the rest. Results match the eager extractors: leading and
+    trailing whitespace is stripped from the document as a whole.
+    """
+
+    def __init__(self, file_content: Buffer, mime_type: str):
+        if mime_type not in BLOCK_READERS:
+            raise ValueError(f"Unsupported MIME type: {mime_type}")
+        self.mime_type = mime_type
+        self._blocks = BLOCK_READERS[mime_type](file_content)
+        self._parts: List[str] = []
+        self._length = 0
+        self._leading = 0
+        self._started = False
+        self._complete = False
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self) -> bool:
+        return self._complete
+
+    @property
+    def parsed_chars(self) -> int:
+        return self._length
+
+    def prefix(self, budget: int) -> str:
+        """Return the first budget characters, parsing no further than needed"""
+        with self._lock:
+            # Leading whitespace is dropped, so keep pulling until the stripped text fills the budget
+            while not self._complete and self._length - self._leading < budget:
+                self._pull()
+            text = "".join(self._parts)
+        if self._complete:
+            return text.strip()[:budget]
+        return text.lstrip()[:budget]
+
+    def full(self) -> str:
+        """Parse any remaining blocks and return the whole document"""
+        with self._lock:
+            while not self._complete:
+                self._pull()
+            return "".join(self._parts).strip()
+
+    def _pull(self) -> None:
+        try:
+            block = next(self._blocks)
+        except StopIteration:
+            self._complete = True
+            self._blocks = iter(())
+            return
+        self._parts.append(block)
+        self._length += len(block)
+        if not self._started:
+            stripped = block.lstrip()
+            self._leading += len(block) - len(stripped)
+            self._started = bool(stripped)
@@ -4,15 +4,36 @@ import os
 import logging
 import json
 import re
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Optional, Iterator, Set, FrozenSet
 from dotenv import load_dotenv
 import traceback
-import PyPDF2
-import docx
+import time
+import threading
+import zipfile
+import zlib
+from functools import lru_cache
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
 from google.cloud import documentai
 import vertexai
 from vertexai.generative_models import GenerativeModel
+from contract_types import score_contract_types, ranked_contract_types
+from analysis_cache import ContentCache, content_digest, content_key
+from pdf_extraction import extract_pdf_pages, extract_page_range
+from document_extraction import MAGIC_AVAILABLE, create_document_extractor, detect_mime_type
+from extraction_sandbox import ExtractionError
+from event_stream import STREAM_FORMATS, event_stream_response, format_stream_event, requested_stream_format
+from page_index import PAGE_MARKER_PATTERN, PageIndex, annotate_clause_pages, annotate_entity_pages
+from text_normalization import NormalizedText, normalize_text, sentence_starts, sentence_window
+from upload_handling import Buffer, SpooledRequest, map_upload, read_head, upload_size
+from job_queue import JobQueue, QueueFullError
+from document_processors import (DocumentAIProcessor, ShardedDocumentProcessor,
+                                 DOCUMENT_AI_PAGE_LIMIT, MIN_PAGE_TEXT_CHARS)
 
 # Load environment variables
 load_dotenv()
@@ -25,6 +46,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Uploads are spooled to disk and memory-mapped rather than read into memory
+app.request_class = SpooledRequest
 
 # CORS configuration
 CORS(app, 
@@ -39,13 +62,46 @@ LOCATION = os.getenv('LOCATION', 'us')
 VERTEX_LOCATION = os.getenv('VERTEX_LOCATION', 'us-central1')
 PROCESSOR_ID = os.getenv('PROCESSOR_ID')
 MODEL_NAME = os.getenv('MODEL_NAME', 'gemini-2.5-flash-lite')
+DOCUMENT_AI_SHARD_PAGES = int(os.getenv('DOCUMENT_AI_SHARD_PAGES', str(DOCUMENT_AI_PAGE_LIMIT)))
+DOCUMENT_AI_MAX_IN_FLIGHT = int(os.getenv('DOCUMENT_AI_MAX_IN_FLIGHT', '4'))
+# Send only PDF pages without a usable text layer to the processor
+DOCUMENT_AI_PAGE_ROUTING = os.getenv('DOCUMENT_AI_PAGE_ROUTING', 'true').lower() == 'true'
+PAGE_ROUTING_MIN_CHARS = int(os.getenv('PAGE_ROUTING_MIN_CHARS', str(MIN_PAGE_TEXT_CHARS)))
 
 # File processing limits
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
-MAX_DOC_CHARS = 50000
+MAX_DOC_CHARS = 50000  # Document AI output is cut here; local extraction returns the whole document
 MAX_TEXT_LENGTH = 100000
 MIN_TEXT_LENGTH = 50
 
+# Analysis cache. Bump PROMPT_VERSION whenever a prompt or the response shape changes
+PROMPT_VERSION = '3'
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', '128'))
+# Optional SQLite store; analyses include the extracted text, so it is created owner-only
+ANALYSIS_CACHE_DB = os.getenv('ANALYSIS_CACHE_DB')
+
+# LLM pipeline: 'sequential' feeds the summary into the risk prompt, 'concurrent' runs
+# summary and risk analysis side by side with a document-only risk prompt
+PIPELINE_MODES = ('sequential', 'concurrent')
+DEFAULT_PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'sequential')
+if DEFAULT_PIPELINE_MODE not in PIPELINE_MODES:
+    logger.warning(f"Unknown PIPELINE_MODE '{DEFAULT_PIPELINE_MODE}', using 'sequential'")
+    DEFAULT_PIPELINE_MODE = 'sequential'
+LLM_STAGE_WORKERS = int(os.getenv('LLM_STAGE_WORKERS', '8'))
+
+# Asynchronous /jobs API: a fixed worker pool behind a bounded queue
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '4'))
+ANALYSIS_QUEUE_SIZE = int(os.getenv('ANALYSIS_QUEUE_SIZE', '32'))
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', '3600'))
+JOB_MAX_WAIT_SECONDS = 30
+
+# Batch analysis: documents are analyzed concurrently, and every model call across
+# all requests shares one concurrency limit
+MAX_BATCH_FILES = int(os.getenv('MAX_BATCH_FILES', '20'))
+MAX_BATCH_BYTES = 5 * MAX_FILE_SIZE
+BATCH_DOCUMENT_WORKERS = int(os.getenv('BATCH_DOCUMENT_WORKERS', '8'))
+VERTEX_MAX_CONCURRENCY = int(os.getenv('VERTEX_MAX_CONCURRENCY', '8'))
+
 # Supported file types
 SUPPORTED_MIME_TYPES = {
     'application/pdf': 'pdf',
@@ -53,25 +109,27 @@ SUPPORTED_MIME_TYPES = {
     'application/msword': 'doc'
 }
 
-EXTENSION_TO_MIME = {
-    '.pdf': 'application/pdf',
-    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-    '.doc': 'application/msword'
-}
-
 # Global clients
-_document_ai_client: Optional[documentai.DocumentProcessorServiceClient] = None
+_document_processor: Optional[ShardedDocumentProcessor] = None
 _vertex_ai_initialized = False
 _vertex_ai_available = False
 
-# Try to import python-magic with graceful fallback
+analysis_cache = ContentCache(max_entries=ANALYSIS_CACHE_SIZE, db_path=ANALYSIS_CACHE_DB)
+_llm_stage_executor = ThreadPoolExecutor(max_workers=LLM_STAGE_WORKERS, thread_name_prefix='llm-stage')
+job_queue = JobQueue(workers=ANALYSIS_WORKERS, max_pending=ANALYSIS_QUEUE_SIZE,
+                     retention_seconds=JOB_RETENTION_SECONDS)
+_vertex_semaphore = threading.BoundedSemaphore(VERTEX_MAX_CONCURRENCY)
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_DOCUMENT_WORKERS, thread_name_prefix='batch-doc')
+document_extractor = create_document_extractor()
+
+# Try to import pyahocorasick for the risk anchor prefilter with graceful fallback
 try:
-    import magic
-    MAGIC_AVAILABLE = True
-    logger.info("python-magic library loaded successfully")
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+    logger.info("pyahocorasick library loaded successfully")
 except ImportError:
-    MAGIC_AVAILABLE = False
-    logger.warning("python-magic not available. Using fallback MIME detection.")
+    AHOCORASICK_AVAILABLE = False
+    logger.info("pyahocorasick not available. Using regex anchor prefilter.")
 
 # COMPREHENSIVE RISK PATTERNS
 COMPREHENSIVE_RISK_PATTERNS = {
@@ -83,6 +141,7 @@ COMPREHENSIVE_RISK_PATTERNS = {
             r'(?i)end.*(?:this.*agreement|contract).*without.*(?:cause|reason)',
             r'(?i)cancel(?:lation)?.*without.*(?:notice|cause|penalty)',
         ],
+        'anchors': ['terminat', 'without'],
         'severity': 'high',
         'category': 'termination',
         'plain_english': 'They can cancel your contract anytime without giving you a reason',
@@ -118,6 +177,7 @@ COMPREHENSIVE_RISK_PATTERNS = {
             r'(?i)jointly.*and.*severally.*liable',
             r'(?i)responsible.*for.*all.*(?:legal.*costs|attorney.*fees|damages).*arising'
         ],
+        'anchors': ['unlimited', 'liable', 'indemnify', 'guarantee', 'responsible'],
         'severity': 'critical',
         'category': 'financial_liability',
         'plain_english': 'You are responsible for unlimited damages and costs if anything goes wrong',
@@ -155,6 +215,7 @@ COMPREHENSIVE_RISK_PATTERNS = {
             r'(?i)perpetual.*renewal',
             r'(?i)notice.*(?:30|60|90).*days.*prior.*to.*renewal'
         ],
+        'anchors': ['renew', 'continues', 'evergreen'],
         'severity': 'medium-high',
         'category': 'contract_terms',
         'plain_english': 'Your contract automatically extends and charges you again unless you actively cancel',
@@ -192,6 +253,7 @@ COMPREHENSIVE_RISK_PATTERNS = {
             r'(?i)class.*action.*waiver',
             r'(?i)mandatory.*arbitration'
         ],
+        'anchors': ['arbitration', 'waive'],
         'severity': 'high',
         'category': 'legal_rights',
         'plain_english': 'You give up your right to sue them in court and must use private arbitration',
@@ -229,6 +291,7 @@ COMPREHENSIVE_RISK_PATTERNS = {
             r'(?i)punitive.*damages.*(?:of|\$)',
             r'(?i)breach.*results.*in.*payment.*of.*\$[\d,]+'
         ],
+        'anchors': ['damages', 'penalty', 'forfeit', 'breach'],
         'severity': 'medium-high',
         'category': 'financial_penalties',
         'plain_english': 'You must pay specific penalty amounts for breaking any part of the contract',
@@ -266,6 +329,7 @@ COMPREHENSIVE_RISK_PATTERNS = {
             r'(?i)payment.*not.*returnable',
             r'(?i)fees.*paid.*in.*advance.*non-?refundable'
         ],
+        'anchors': ['refund', 'final', 'deposit', 'returnable'],
         'severity': 'medium',
         'category': 'payment_terms',
         'plain_english': 'You cannot get your money back under any circumstances, even if they fail to deliver',
@@ -305,6 +369,7 @@ CONTRACT_TYPE_PATTERNS = {
                 r'(?i)restraint.*of.*trade.*(?:for|during).*(?:\d+.*years?)',
                 r'(?i)covenant.*not.*to.*compete.*(?:worldwide|nationally)'
             ],
+            'anchors': ['compete', 'similar', 'restraint'],
             'severity': 'high',
             'category': 'employment_restrictions',
             'plain_english': 'You cannot work in your field for an unreasonably long time or broad area',
@@ -319,6 +384,7 @@ CONTRACT_TYPE_PATTERNS = {
                 r'(?i)license.*to.*use.*(?:your.*data|information.*provided)',
                 r'(?i)aggregate.*(?:data|information).*for.*(?:commercial|business).*purposes'
             ],
+            'anchors': ['collect', 'purpose', 'license', 'aggregate'],
             'severity': 'medium-high',
             'category': 'data_privacy',
             'plain_english': 'They can collect and sell your business data and customer information',
@@ -327,18 +393,239 @@ CONTRACT_TYPE_PATTERNS = {
     }
 }
 
+SEVERITY_ORDER = {'critical': 0, 'high': 1, 'medium-high': 2, 'medium': 3, 'low': 4}
+MAX_RULE_CLAUSES = 10
+
+# Risk patterns are only evaluated inside bounded clause windows so greedy
+# wildcards cannot backtrack across a whole single-line document
+MAX_CLAUSE_CHARS = 800
+CLAUSE_OVERLAP_CHARS = 200
+CLAUSE_BOUNDARY_PATTERN = re.compile(r'[.!?;]+(?=\s)|\n')
+RULES_TIME_BUDGET_SECONDS = float(os.getenv('RULES_TIME_BUDGET_SECONDS', '2.0'))
+
+_REQUIRED_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                     getattr(sre_constants, 'POSSESSIVE_REPEAT', sre_constants.MAX_REPEAT)}
+
+def _requires_anchor(parsed: Any, anchors: List[str]) -> bool:
+    """True when every match of a parsed pattern contains one of the lowercase anchors.
+    
+    Anchors are looked for in runs of literal characters the pattern cannot skip:
+    outside optional and zero-width parts, or in every branch of an alternation.
+    """
+    literal: List[str] = []
+    for op, av in list(parsed) + [(None, None)]:
+        if op is sre_constants.LITERAL:
+            literal.append(chr(av))
+            continue
+        if literal:
+            run = ''.join(literal).lower()
+            literal = []
+            if any(anchor in run for anchor in anchors):
+                return True
+        if op is sre_constants.SUBPATTERN and _requires_anchor(av[-1], anchors):
+            return True
+        if op in _REQUIRED_REPEATS and av[0] >= 1 and _requires_anchor(av[2], anchors):
+            return True
+        if op is sre_constants.BRANCH and all(_requires_anchor(branch, anchors) for branch in av[1]):
+            return True
+    return False
+
+class AnchorIndex:
+    """Multi-literal automaton over the 'anchors' of each risk type.
+    
+    Every match of every pattern of a risk type must contain one of its anchors, so a type
+    whose anchors never occur in the document cannot match and its regexes are skipped.
+    Types without anchors, or with a pattern that can match without one, such as an anchor
+    in only one branch of an alternation or in an optional group, are always candidates.
+    """
+    
+    def __init__(self, risk_patterns: Dict[str, Dict[str, Any]]):
+        self.always_candidates: Set[str] = set()
+        self.anchor_types: Dict[str, Set[str]] = {}
+        
+        for risk_type, risk_data in risk_patterns.items():
+            anchors = [anchor.lower() for anchor in risk_data.get('anchors', [])]
+            if not anchors or not all(_requires_anchor(sre_parse.parse(pattern), anchors)
+                                      for pattern in risk_data['patterns']):
+                self.always_candidates.add(risk_type)
+                continue
+            for anchor in anchors:
+                self.anchor_types.setdefault(anchor, set()).add(risk_type)
+        
+        self.all_types = set(risk_patterns)
+        self.automaton = None
+        self.regex = None
+        if AHOCORASICK_AVAILABLE:
+            self.automaton = ahocorasick.Automaton()
+            for anchor in self.anchor_types:
+                self.automaton.add_word(anchor, anchor)
+            self.automaton.make_automaton()
+        else:
+            # Longest first so the alternation prefers the most specific literal
+            literals = sorted(self.anchor_types, key=len, reverse=True)
+            self.regex = re.compile('|'.join(re.escape(anchor) for anchor in literals))
+    
+    def candidate_types(self, folded: str) -> Set[str]:
+        """Return the risk types that can possibly match the case-folded text"""
+        candidates = set(self.always_candidates)
+        if not self.anchor_types:
+            return candidates
+        
+        if self.automaton is not None:
+            anchors_found = (anchor for _, anchor in self.automaton.iter(folded))
+        else:
+            anchors_found = (match.group() for match in self.regex.finditer(folded))
+        
+        for anchor in anchors_found:
+            candidates |= self.anchor_types[anchor]
+            if len(candidates) == len(self.all_types):
+                break
+        return candidates
+
+class RiskScanner:
+    """All risk patterns for one contract type compiled into a single combined matcher.
+    
+    Patterns are matched against ASCII case-folded text so the combined expression can be
+    compiled case-sensitively, which lets the regex engine skip ahead on first characters.
+    Matching runs clause by clause, so the cost of a greedy pattern is bounded by the
+    window size rather than the document length.
+    """
+    
+    def __init__(self, risk_patterns: Dict[str, Dict[str, Any]]):
+        self.risk_patterns = risk_patterns
+        self.branches: List[Tuple[str, re.Pattern]] = []
+        
+        for risk_type, risk_data in risk_patterns.items():
+            for pattern in risk_data['patterns']:
+                self.branches.append((risk_type, re.compile(_strip_inline_flags(pattern))))
+        
+        self.anchor_index = AnchorIndex(risk_patterns)
+        self.sorted_risk_types = sorted(
+            risk_patterns,
+            key=lambda risk_type: SEVERITY_ORDER.get(risk_patterns[risk_type].get('severity', 'medium'), 3)
+        )
+        self._compile_subset = lru_cache(maxsize=64)(self._compile_subset)
+    
+    def _compile_subset(self, risk_types: FrozenSet[str]) -> Tuple[re.Pattern, List[Tuple[str, re.Pattern]]]:
+        """Combine the branches of the given risk types into one expression"""
+        branches = [(risk_type, branch) for risk_type, branch in self.branches if risk_type in risk_types]
+        return re.compile('|'.join(branch.pattern for _, branch in branches)), branches
+    
+    def scan(self, text: str, time_budget: Optional[float] = RULES_TIME_BUDGET_SECONDS,
+             use_prefilter: bool = True) -> Dict[str, Tuple[int, int]]:
+        """Return the span of the first hit for each risk type, matching only inside clause windows"""
+        folded = fold_case(text)
+        hits: Dict[str, Tuple[int, int]] = {}
+        
+        # One literal pass decides which risk types need their full regexes at all
+        candidates = self.anchor_index.candidate_types(folded) if use_prefilter else set(self.risk_patterns)
+        if not candidates:
+            return hits
+        regex, branches = self._compile_subset(frozenset(candidates))
+        deadline = time.perf_counter() + time_budget if time_budget else None
+        
+        for window_start, window_end in iter_clause_windows(folded):
+            if deadline is not None and time.perf_counter() > deadline:
+                logger.warning(f"Risk pattern time budget of {time_budget}s exhausted at offset {window_start:,} of {len(folded):,}")
+                break
+            
+            # Branches already known not to match in the rest of this window
+            exhausted = set()
+            for match in regex.finditer(folded, window_start, window_end):
+                position = match.start()
+                
+                # The combined match may shadow other branches in the same window,
+                # so resolve each open risk type from this position onwards
+                for index, (risk_type, branch) in enumerate(branches):
+                    if risk_type in hits or index in exhausted:
+                        continue
+                    branch_match = branch.search(folded, position, window_end)
+                    if branch_match:
+                        hits[risk_type] = branch_match.span()
+                    else:
+                        exhausted.add(index)
+                
+                if len(hits) == len(candidates):
+                    return hits
+        
+        return hits
+
+def iter_clause_windows(text: str) -> Iterator[Tuple[int, int]]:
+    """Yield (start, end) offsets of sentence/clause windows no longer than MAX_CLAUSE_CHARS"""
+    start = 0
+    for boundary in CLAUSE_BOUNDARY_PATTERN.finditer(text):
+        yield from _bounded_windows(start, boundary.end())
+        start = boundary.end()
+    if start < len(text):
+        yield from _bounded_windows(start, len(text))
+
+def _bounded_windows(start: int, end: int) -> Iterator[Tuple[int, int]]:
+    """Split an overlong clause into overlapping fixed-size windows"""
+    if end - start <= MAX_CLAUSE_CHARS:
+        yield start, end
+        return
+    step = MAX_CLAUSE_CHARS - CLAUSE_OVERLAP_CHARS
+    for window_start in range(start, end, step):
+        window_end = min(window_start + MAX_CLAUSE_CHARS, end)
+        yield window_start, window_end
+        if window_end == end:
+            break
+
+def _strip_inline_flags(pattern: str) -> str:
+    """Drop the leading (?i) flag since scanning happens on case-folded text"""
+    return pattern[4:] if pattern.startswith('(?i)') else pattern
+
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+def fold_case(text: str) -> str:
+    """Lowercase text while keeping character offsets identical to the original"""
+    folded = text.lower()
+    if len(folded) != len(text):
+        folded = text.translate(_ASCII_LOWER)
+    return folded
+
+def _build_risk_scanners() -> Dict[str, RiskScanner]:
+    """Compile one scanner per contract type at import time"""
+    scanners = {'general': RiskScanner(dict(COMPREHENSIVE_RISK_PATTERNS))}
+    for contract_type, type_patterns in CONTRACT_TYPE_PATTERNS.items():
+        all_patterns = dict(COMPREHENSIVE_RISK_PATTERNS)
+        all_patterns.update(type_patterns)
+        scanners[contract_type] = RiskScanner(all_patterns)
+    return scanners
+
+RISK_SCANNERS = _build_risk_scanners()
+
+@lru_cache(maxsize=32)
+def _combined_risk_scanner(contract_types: Tuple[str, ...]) -> RiskScanner:
+    """Scanner for general patterns plus the patterns of several contract types"""
+    all_patterns = dict(COMPREHENSIVE_RISK_PATTERNS)
+    for contract_type in contract_types:
+        all_patterns.update(CONTRACT_TYPE_PATTERNS[contract_type])
+    return RiskScanner(all_patterns)
+
+def get_risk_scanner(contract_type: str, secondary_types: Optional[List[str]] = None) -> RiskScanner:
+    """Return the precompiled scanner for a contract type, combined with close secondary types"""
+    contract_types = [t for t in [contract_type] + list(secondary_types or []) if t in CONTRACT_TYPE_PATTERNS]
+    if len(contract_types) <= 1:
+        return RISK_SCANNERS.get(contract_types[0] if contract_types else 'general', RISK_SCANNERS['general'])
+    return _combined_risk_scanner(tuple(sorted(set(contract_types))))
+
 def initialize_services():
     """Initialize Document AI and Vertex AI services"""
-    global _document_ai_client, _vertex_ai_initialized, _vertex_ai_available
+    global _document_processor, _vertex_ai_initialized, _vertex_ai_available
     
     # Initialize Document AI
     if PROJECT_ID and PROCESSOR_ID:
         try:
-            _document_ai_client = documentai.DocumentProcessorServiceClient()
+            client = documentai.DocumentProcessorServiceClient()
+            processor = DocumentAIProcessor(client, client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID))
+            # Uploads are only parsed in the extraction sandbox, also when counting and splitting pages
+            _document_processor = ShardedDocumentProcessor(processor, DOCUMENT_AI_SHARD_PAGES,
+                                                           DOCUMENT_AI_MAX_IN_FLIGHT, document_extractor.sandbox.run)
             logger.info("Document AI client initialized successfully")
         except Exception as e:
             logger.warning(f"Failed to initialize Document AI: {e}")
-            _document_ai_client = None
+            _document_processor = None
     
     # Initialize Vertex AI
     if PROJECT_ID and not _vertex_ai_initialized:
@@ -352,112 +639,150 @@ def initialize_services():
             _vertex_ai_available = False
             logger.warning(f"Failed to initialize Vertex AI: {e}")
 
-def detect_mime_type(file_content: bytes, filename: str) -> str:
-    """Detect MIME type using multiple methods"""
-    # Method 1: Try python-magic if available
-    if MAGIC_AVAILABLE:
-        try:
-            mime_type = magic.from_buffer(file_content, mime=True)
-            if mime_type in SUPPORTED_MIME_TYPES:
-                return mime_type
-        except Exception as e:
-            logger.warning(f"python-magic detection failed: {e}")
-    
-    # Method 2: Check file signature (magic bytes)
-    if file_content.startswith(b'%PDF'):
-        return 'application/pdf'
-    elif file_content.startswith(b'PK\x03\x04') or file_content.startswith(b'PK\x05\x06') or file_content.startswith(b'PK\x07\x08'):
-        if filename and filename.lower().endswith('.docx'):
-            return 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-    elif file_content.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
-        if filename and filename.lower().endswith('.doc'):
-            return 'application/msword'
-    
-    # Method 3: Extension-based fallback
-    if filename:
-        _, ext = os.path.splitext(filename.lower())
-        if ext in EXTENSION_TO_MIME:
-            return EXTENSION_TO_MIME[ext]
-    
-    raise ValueError(f"Could not determine MIME type for file: {filename}")
-
-def extract_text_fallback(file_content: bytes, mime_type: str) -> str:
-    """Fallback text extraction using local libraries"""
-    text = ""
-    
-    if mime_type == 'application/pdf':
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-        for page_num, page in enumerate(pdf_reader.pages):
-            try:
-                page_text = page.extract_text()
-                text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
-            except Exception as e:
-                logger.warning(f"Failed to extract text from page {page_num + 1}: {e}")
-                text += f"\n--- Page {page_num + 1} (extraction failed) ---\n"
-            
-    elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-        doc = docx.Document(BytesIO(file_content))
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-    
-    if not text.strip():
-        raise Exception("No text could be extracted from the document")
+def extract_text_fallback(file_content: Buffer, mime_type: str, digest: str) -> str:
+    """Fallback text extraction using local libraries, in a sandboxed worker process.
     
-    return text.strip()
+    Returns the whole document, so the rule scan sees every clause; prompts cut
+    their own excerpts. Text already extracted by either service is reused.
+    Raises ExtractionError when the parsers fail, time out or run out of memory.
+    """
+    text, _ = document_extractor.extract(file_content, mime_type, None, digest)
+    return text
 
-def extract_text_with_document_ai(file_content: bytes, mime_type: str) -> str:
-    """Extract text using Document AI or fallback"""
+def extract_text_with_document_ai(file_content: Buffer, mime_type: str, digest: str) -> Tuple[str, str]:
+    """Extract text using Document AI or fallback.
+    
+    Returns the text and the method that produced it: the processor's name, or
+    'fallback' when local extraction was used, including after a processor failure.
+    """
     try:
-        if not _document_ai_client:
+        if not _document_processor:
             logger.info("Document AI not available, using fallback extraction")
-            return extract_text_fallback(file_content, mime_type)
+            return extract_text_fallback(file_content, mime_type, digest), 'fallback'
         
-        name = _document_ai_client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID)
+        cached = document_extractor.cached_text(digest, mime_type, MAX_DOC_CHARS, allow_local=False)
+        if cached is not None:
+            logger.info(f"Using cached {_document_processor.name} text")
+            return cached[0], _document_processor.name
         
-        request_obj = documentai.ProcessRequest(
-            name=name,
-            raw_document=documentai.RawDocument(
-                content=file_content,
-                mime_type=mime_type
+        if mime_type == 'application/pdf' and DOCUMENT_AI_PAGE_ROUTING:
+            # Native-text pages are read locally; only scanned pages go to the processor
+            local_pages = document_extractor.sandbox.run(extract_pdf_pages, file_content)
+            extracted_text = _document_processor.process_scanned_pages(file_content, local_pages,
+                                                                       PAGE_ROUTING_MIN_CHARS)
+        else:
+            # Long PDFs are split into shards within the processor page limit; a failed
+            # shard is filled in locally instead of discarding the whole result
+            extracted_text = _document_processor.process(
+                bytes(file_content), mime_type,
+                on_shard_error=lambda start, end: document_extractor.sandbox.run(
+                    extract_page_range, file_content, start, end)
             )
-        )
         
-        result = _document_ai_client.process_document(request=request_obj)
-        extracted_text = result.document.text if result.document.text else ""
-        
-        if not extracted_text.strip():
+        if not PAGE_MARKER_PATTERN.sub('', extracted_text).strip():
             logger.warning("Document AI returned empty text, using fallback")
-            return extract_text_fallback(file_content, mime_type)
+            return extract_text_fallback(file_content, mime_type, digest), 'fallback'
         
-        if len(extracted_text) > MAX_DOC_CHARS:
+        complete = len(extracted_text) <= MAX_DOC_CHARS
+        if not complete:
             extracted_text = extracted_text[:MAX_DOC_CHARS]
+        document_extractor.store(digest, mime_type, extracted_text, complete, _document_processor.name)
         
         logger.info(f"Document AI extraction successful: {len(extracted_text)} characters")
-        return extracted_text
+        return extracted_text, _document_processor.name
         
+    except ExtractionError:
+        # The local parsers already failed on this document; trying them again would fail the same way
+        raise
     except Exception as e:
         logger.error(f"Document AI extraction failed: {e}, using fallback")
-        return extract_text_fallback(file_content, mime_type)
-
-def detect_contract_type(text: str) -> str:
-    """Detect the type of contract to apply specialized patterns"""
-    text_lower = text.lower()
-    
-    if any(keyword in text_lower for keyword in ['employee', 'employment', 'job', 'position', 'salary', 'wages']):
-        return 'employment'
-    elif any(keyword in text_lower for keyword in ['software', 'application', 'development', 'coding', 'programming']):
-        return 'software'
-    elif any(keyword in text_lower for keyword in ['lease', 'rent', 'tenant', 'landlord', 'property']):
-        return 'rental'
-    elif any(keyword in text_lower for keyword in ['service', 'consulting', 'professional services']):
-        return 'service'
-    elif any(keyword in text_lower for keyword in ['purchase', 'sale', 'buy', 'sell', 'goods']):
-        return 'sales'
-    else:
-        return 'general'
+        return extract_text_fallback(file_content, mime_type, digest), 'fallback'
+
+# KEY INFORMATION RULES
+# (bucket, trigger tokens, pattern, kind). A rule is only tried where one of its trigger
+# tokens starts; 'value' rules keep capture group 1 (or the whole match), 'clause' rules
+# keep the sentence around the match. Patterns run on case-folded text.
+KEY_INFO_RULES = [
+    # Parties
+    ('parties', ('between',), r'between\s+([^,\(]{1,200}?(?:\([^)]{0,100}\))?)\s+(?:and|&)', 'value'),
+    ('parties', ('client', 'customer', 'buyer', 'tenant', 'lessee', 'contractor', 'employee'),
+     r'(?:client|customer|buyer|tenant|lessee|contractor|employee)[:\s]+([^,\.\n]+)', 'value'),
+    ('parties', ('company', 'provider', 'seller', 'landlord', 'lessor', 'employer'),
+     r'(?:company|provider|seller|landlord|lessor|employer)[:\s]+([^,\.\n]+)', 'value'),
+    ('parties', ('corp', 'corporation', 'llc', 'ltd', 'inc'),
+     r'(?:corp\.|corporation|llc|ltd\.?|inc\.?)[,\s]*([^,\.\n]+)', 'value'),
+    ('parties', ('"',), r'"([^"]+)"[,\s]+(?:a|an)\s+(?:corporation|company|llc)', 'value'),
+    
+    # Dates
+    ('dates', ('date', 'dated', 'effective', 'starting', 'begin', 'begins', 'end', 'ends', 'expire', 'expires', 'due', 'term'),
+     r'(?:dated?|effective|starting|begins?|ends?|expires?|due|term[^\n]{0,80}?(?:begins|ends))\s+([a-z]+ \d{1,2},? \d{4})', 'value'),
+    ('dates', ('on', 'by', 'before', 'after', 'until', 'from'),
+     r'(?:on|by|before|after|until|from)\s+([a-z]+ \d{1,2},? \d{4})', 'value'),
+    ('dates', ('#date',), r'\b(\d{1,2}[/-]\d{1,2}[/-]\d{4})\b', 'value'),
+    ('dates', ('term', 'period', 'duration'),
+     r'(?:term|period|duration)[^\n]{0,80}?of\s+(\d+\s+(?:years?|months?|days?))', 'value'),
+    
+    # Monetary amounts
+    ('amounts', ('$',), r'\$[\d,]+(?:\.\d{2})?', 'value'),
+    ('amounts', ('fee', 'cost', 'price', 'amount', 'payment', 'salary', 'wage', 'penalty', 'fine', 'deposit'),
+     r'(?:fee|cost|price|amount|payment|salary|wage|penalty|fine|deposit)\s+(?:of\s+)?\$?([\d,]+(?:\.\d{2})?)', 'value'),
+    ('amounts', ('dollar', 'dollars', 'usd'), r'(?:dollars?|usd)\s+([\d,]+(?:\.\d{2})?)', 'value'),
+    ('amounts', ('total', 'sum', 'aggregate'), r'(?:total|sum|aggregate)\s+(?:of\s+)?\$?([\d,]+(?:\.\d{2})?)', 'value'),
+    
+    # Clause buckets
+    ('obligations', ('shall', 'must', 'agree', 'agrees', 'required', 'obligated'),
+     r'(?:shall|must|agrees?\s+to|required\s+to|obligated\s+to)\b', 'clause'),
+    ('rights', ('right', 'rights', 'entitled', 'option', 'discretion'),
+     r'(?:rights?\s+to|entitled\s+to|option\s+to|discretion)\b', 'clause'),
+    ('termination_clauses', ('terminate', 'terminates', 'terminated', 'termination', 'cancel', 'cancelled', 'canceled', 'cancellation'),
+     r'(?:terminat|cancel)[a-z]*', 'clause'),
+    ('payment_terms', ('payment', 'payments', 'payable', 'invoice', 'invoices', 'invoiced', 'billing', 'billed'),
+     r'(?:payments?|payable|invoice[sd]?|bill(?:ing|ed))\b', 'clause'),
+    ('penalty_clauses', ('penalty', 'penalties', 'liquidated', 'forfeit', 'forfeited', 'forfeiture', 'late'),
+     r'(?:penalt(?:y|ies)|liquidated\s+damages|forfeit(?:ed|ure)?|late\s+(?:fees?|charges?))\b', 'clause'),
+    ('liability_clauses', ('liable', 'liability', 'indemnify', 'indemnifies', 'indemnification', 'hold'),
+     r'(?:liable|liability|indemnif(?:y|ies|ication)|hold\s+harmless)\b', 'clause'),
+    ('confidentiality_clauses', ('confidential', 'confidentiality', 'non', 'proprietary'),
+     r'(?:confidential(?:ity)?|non-disclosure|proprietary\s+information)\b', 'clause'),
+    ('modification_clauses', ('amend', 'amended', 'amendment', 'amendments', 'modify', 'modified', 'modification', 'modifications'),
+     r'(?:amend(?:ed|ments?)?|modif(?:y|ied|ications?))\b', 'clause'),
+    ('governing_law', ('governed', 'governing', 'laws'),
+     r'(?:governed\s+by|governing\s+law|laws\s+of\s+the\s+state\s+of)\b', 'clause'),
+    ('dispute_resolution', ('arbitration', 'arbitrator', 'mediation', 'jurisdiction', 'venue', 'dispute', 'disputes'),
+     r'(?:arbitrat(?:ion|or)|mediation|jurisdiction|venue|disputes?)\b', 'clause'),
+]
+
+MAX_CLAUSES_PER_BUCKET = 10
+
+# Words, currency/quote marks and the start of numeric dates are the only trigger tokens
+KEY_INFO_TOKEN_PATTERN = re.compile(r'[a-z]+|[$"]|\d{1,2}[/-]')
+
+def _build_key_info_triggers() -> Dict[str, List[Tuple[str, re.Pattern, str]]]:
+    """Map each trigger token to the compiled rules that can start there"""
+    triggers: Dict[str, List[Tuple[str, re.Pattern, str]]] = {}
+    for bucket, tokens, pattern, kind in KEY_INFO_RULES:
+        compiled = re.compile(pattern)
+        for token in tokens:
+            triggers.setdefault(token, []).append((bucket, compiled, kind))
+    return triggers
+
+KEY_INFO_TRIGGERS = _build_key_info_triggers()
+
+def _enclosing_sentence(text: str, start: int, end: int, limit: int = 300) -> Tuple[int, int]:
+    """Return the bounds of the sentence around a match, looking at most limit chars each way"""
+    sentence_start = max(0, start - limit)
+    for boundary in CLAUSE_BOUNDARY_PATTERN.finditer(text, sentence_start, start):
+        sentence_start = boundary.end()
+    boundary = CLAUSE_BOUNDARY_PATTERN.search(text, end, end + limit)
+    sentence_end = boundary.end() if boundary else min(len(text), end + limit)
+    return sentence_start, sentence_end
 
 def extract_key_information_enhanced(text: str) -> Dict[str, Any]:
-    """Enhanced key information extraction with deeper analysis"""
+    """Enhanced key information extraction in a single tokenizing pass.
+    
+    Each bucket holds the distinct values in document order; "entities" lists every
+    kept value with its type and character offsets into the original text.
+    """
     key_info = {
         "parties": [],
         "dates": [],
@@ -471,55 +796,63 @@ def extract_key_information_enhanced(text: str) -> Dict[str, Any]:
         "confidentiality_clauses": [],
         "modification_clauses": [],
         "governing_law": [],
-        "dispute_resolution": []
+        "dispute_resolution": [],
+        "entities": []
     }
+    folded = fold_case(text)
+    seen = {bucket: set() for bucket in key_info}
+    # End of the last sentence taken per clause bucket, so one sentence is not re-read per trigger
+    covered_until: Dict[str, int] = {}
     
-    # Enhanced party extraction
-    party_patterns = [
-        r'between\s+([^,\(]+(?:\([^)]+\))?)\s+(?:and|&)',
-        r'(?:Client|Customer|Buyer|Tenant|Lessee|Contractor|Employee)[:\s]+([^,\.\n]+)',
-        r'(?:Company|Provider|Seller|Landlord|Lessor|Employer)[:\s]+([^,\.\n]+)',
-        r'(?:Corp\.|Corporation|LLC|Ltd\.?|Inc\.?)[,\s]*([^,\.\n]+)',
-        r'"([^"]+)"[,\s]+(?:a|an)\s+(?:corporation|company|LLC)',
-    ]
-    
-    for pattern in party_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
-            clean_match = re.sub(r'\s*\([^)]*\)', '', match).strip()
-            if clean_match and len(clean_match) > 2 and clean_match not in key_info["parties"]:
-                key_info["parties"].append(clean_match)
-    
-    # Enhanced date extraction
-    date_patterns = [
-        r'(?:dated?|effective|starting|begins?|ends?|expires?|due|term.*(?:begins|ends))\s+([A-Za-z]+ \d{1,2},? \d{4})',
-        r'(?:on|by|before|after|until|from)\s+([A-Za-z]+ \d{1,2},? \d{4})',
-        r'\b(\d{1,2}[/-]\d{1,2}[/-]\d{4})\b',
-        r'(?:term.*of|period.*of|duration.*of)\s+(\d+\s+(?:years?|months?|days?))',
-    ]
-    
-    for pattern in date_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        key_info["dates"].extend(matches)
-    
-    # Enhanced monetary amount extraction
-    amount_patterns = [
-        r'\$[\d,]+(?:\.\d{2})?',
-        r'(?:fee|cost|price|amount|payment|salary|wage|penalty|fine|deposit)\s+(?:of\s+)?\$?([\d,]+(?:\.\d{2})?)',
-        r'(?:dollars?|USD)\s+([\d,]+(?:\.\d{2})?)',
-        r'(?:total|sum|aggregate)\s+(?:of\s+)?\$?([\d,]+(?:\.\d{2})?)',
-    ]
-    
-    for pattern in amount_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        key_info["amounts"].extend(matches)
+    for token_match in KEY_INFO_TOKEN_PATTERN.finditer(folded):
+        token = token_match.group()
+        rules = KEY_INFO_TRIGGERS.get(token)
+        if rules is None:
+            if token[-1] not in '/-':
+                continue
+            rules = KEY_INFO_TRIGGERS['#date']
+        
+        position = token_match.start()
+        for bucket, rule, kind in rules:
+            if kind == 'clause' and (len(key_info[bucket]) >= MAX_CLAUSES_PER_BUCKET
+                                     or position < covered_until.get(bucket, 0)):
+                continue
+            match = rule.match(folded, position)
+            if not match:
+                continue
+            
+            if kind == 'clause':
+                start, end = _enclosing_sentence(folded, match.start(), match.end())
+                covered_until[bucket] = end
+                value = ' '.join(text[start:end].split())
+                if len(value) > 200:
+                    value = value[:197] + "..."
+            else:
+                group = 1 if rule.groups else 0
+                start, end = match.span(group)
+                value = text[start:end]
+                if bucket == 'parties':
+                    value = re.sub(r'\s*\([^)]*\)', '', value)
+                value = value.strip()
+                if bucket == 'parties' and len(value) <= 2:
+                    continue
+            
+            if not value or value.lower() in seen[bucket]:
+                continue
+            seen[bucket].add(value.lower())
+            key_info[bucket].append(value)
+            key_info["entities"].append({"type": bucket, "text": value, "start": start, "end": end})
     
     return key_info
 
-def analyze_risks_with_enhanced_vertex_ai(text: str, summary_text: str, contract_type: str) -> List[Dict[str, Any]]:
-    """Enhanced AI-powered risk analysis with contract type awareness"""
+def analyze_risks_with_enhanced_vertex_ai(text: str, summary_text: str, contract_type: str,
+                                         secondary_types: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], str]:
+    """Enhanced AI-powered risk analysis with contract type awareness.
+    
+    Returns the clauses and the method that produced them, 'vertex_ai' or 'rules_based'.
+    """
     if not _vertex_ai_available:
-        return analyze_risks_with_enhanced_rules(text, summary_text, contract_type)
+        return analyze_risks_with_enhanced_rules(text, summary_text, contract_type, secondary_types), 'rules_based'
     
     try:
         # Create specialized prompt based on contract type
@@ -543,6 +876,14 @@ def analyze_risks_with_enhanced_vertex_ai(text: str, summary_text: str, contract
             - Automatic updates and feature changes
             """
         
+        if secondary_types:
+            contract_specific_guidance += f"""
+            This document also reads like a {', '.join(t.title() for t in secondary_types)} contract; check those terms too.
+            """
+        
+        # The concurrent pipeline has no summary yet, so the prompt is built from the document alone
+        summary_section = f"\nSUMMARY:\n{summary_text[:2000]}\n" if summary_text else ""
+        
         prompt = f"""
 You are an expert legal analyst specializing in protecting consumers and small businesses from predatory contract terms. 
 
@@ -551,10 +892,7 @@ CONTRACT TYPE: {contract_type.title()}
 
 DOCUMENT TEXT (first 12000 chars):
 {text[:12000]}
-
-SUMMARY:
-{summary_text[:2000]}
-
+{summary_section}
 Your task is to identify truly problematic clauses that could harm the person signing this contract. Focus on HIDDEN DANGERS and PREDATORY TERMS.
 
 Provide a JSON response with this exact structure:
@@ -603,7 +941,8 @@ REQUIREMENTS:
             "top_k": 20
         }
         
-        response = model.generate_content(prompt, generation_config=generation_config)
+        with _vertex_semaphore:
+            response = model.generate_content(prompt, generation_config=generation_config)
         response_text = response.text.strip()
         
         # Extract JSON
@@ -619,79 +958,63 @@ REQUIREMENTS:
             raise ValueError("No JSON found in response")
         
         result = json.loads(json_text)
-        return result.get('risky_clauses', [])
+        return result.get('risky_clauses', []), 'vertex_ai'
         
     except Exception as e:
         logger.error(f"Enhanced Vertex AI risk analysis failed: {e}")
-        return analyze_risks_with_enhanced_rules(text, summary_text, contract_type)
+        return analyze_risks_with_enhanced_rules(text, summary_text, contract_type, secondary_types), 'rules_based'
 
-def analyze_risks_with_enhanced_rules(text: str, summary_text: str, contract_type: str) -> List[Dict[str, Any]]:
+def analyze_risks_with_enhanced_rules(text: str, summary_text: str, contract_type: str,
+                                      secondary_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """Enhanced rule-based risk analysis with contract-type specific patterns"""
     risky_clauses = []
     full_text = f"{text}\n\n{summary_text}"
-    clause_number = 1
-    
-    # Combine general patterns with contract-specific patterns
-    all_patterns = dict(COMPREHENSIVE_RISK_PATTERNS)
-    if contract_type in CONTRACT_TYPE_PATTERNS:
-        all_patterns.update(CONTRACT_TYPE_PATTERNS[contract_type])
     
-    # Sort patterns by severity
-    severity_order = {'critical': 0, 'high': 1, 'medium-high': 2, 'medium': 3, 'low': 4}
-    sorted_patterns = sorted(all_patterns.items(), 
-                           key=lambda x: severity_order.get(x[1].get('severity', 'medium'), 3))
+    # Single pass over the document for general plus contract-specific patterns
+    scanner = get_risk_scanner(contract_type, secondary_types)
+    hits = scanner.scan(full_text)
+    sentences = sentence_starts(full_text) if hits else None
     
-    for risk_type, risk_data in sorted_patterns:
-        patterns = risk_data['patterns']
-        found_match = False
+    for risk_type in scanner.sorted_risk_types:
+        if risk_type not in hits:
+            continue
         
-        for pattern in patterns:
-            matches = list(re.finditer(pattern, full_text, re.IGNORECASE | re.MULTILINE))
-            
-            for match in matches:
-                if found_match:
-                    continue
-                
-                # Extract context around match
-                start = max(0, match.start() - 100)
-                end = min(len(full_text), match.end() + 100)
-                
-                context = full_text[start:end]
-                sentences = re.split(r'[.!?]+', context)
-                
-                clause_text = ' '.join(sentences[max(0, len(sentences)//2-1):len(sentences)//2+2]).strip()
-                clause_text = ' '.join(clause_text.split())
-                if len(clause_text) > 200:
-                    clause_text = clause_text[:197] + "..."
-                
-                risky_clauses.append({
-                    "clause_number": clause_number,
-                    "clause_text": clause_text,
-                    "plain_english": risk_data['plain_english'],
-                    "hidden_tricks": risk_data.get('hidden_tricks', [risk_data['plain_english']]),
-                    "real_world_consequences": risk_data.get('real_world_consequences', [risk_data.get('consequence', 'Could result in financial or legal problems')]),
-                    "negotiation_tips": risk_data.get('negotiation_tips', [risk_data.get('negotiation_tip', 'Negotiate better terms or seek legal advice')]),
-                    "comparative_justice": risk_data['comparative_justice'],
-                    "severity": risk_data.get('severity', 'medium'),
-                    "risk_category": risk_data.get('category', 'general'),
-                    "red_flags": risk_data.get('red_flags', [])
-                })
-                
-                clause_number += 1
-                found_match = True
-                
-                if clause_number > 10:
-                    break
-                    
-        if clause_number > 10:
+        risk_data = scanner.risk_patterns[risk_type]
+        match_start, match_end = hits[risk_type]
+        
+        # The sentences around the match; normalized text only has single spaces and newlines
+        start, end = sentence_window(full_text, sentences, match_start, match_end)
+        clause_text = full_text[start:end].replace('\n', ' ').strip()
+        if len(clause_text) > 200:
+            clause_text = clause_text[:197] + "..."
+        
+        risky_clauses.append({
+            "clause_number": len(risky_clauses) + 1,
+            "clause_text": clause_text,
+            "plain_english": risk_data['plain_english'],
+            "hidden_tricks": risk_data.get('hidden_tricks', [risk_data['plain_english']]),
+            "real_world_consequences": risk_data.get('real_world_consequences', [risk_data.get('consequence', 'Could result in financial or legal problems')]),
+            "negotiation_tips": risk_data.get('negotiation_tips', [risk_data.get('negotiation_tip', 'Negotiate better terms or seek legal advice')]),
+            "comparative_justice": risk_data['comparative_justice'],
+            "severity": risk_data.get('severity', 'medium'),
+            "risk_category": risk_data.get('category', 'general'),
+            "red_flags": risk_data.get('red_flags', []),
+            # Matches in the appended summary have no place in the document
+            "match_offset": match_start if match_start < len(text) else None
+        })
+        
+        if len(risky_clauses) >= MAX_RULE_CLAUSES:
             break
     
     return risky_clauses
 
-def generate_enhanced_summary_with_vertex_ai(text: str, key_info: Dict[str, Any], contract_type: str) -> str:
-    """Generate enhanced summary with contract type awareness"""
+def generate_enhanced_summary_with_vertex_ai(text: str, key_info: Dict[str, Any], contract_type: str) -> Tuple[str, str]:
+    """Generate enhanced summary with contract type awareness.
+    
+    Returns the summary and the method that produced it, 'vertex_ai' or 'fallback'.
+    """
     if not _vertex_ai_available:
-        return generate_enhanced_fallback_summary(text, key_info, contract_type)
+        return generate_enhanced_fallback_summary(text, key_info, contract_type), 'fallback'
     
     try:
         prompt = f"""
@@ -738,12 +1061,13 @@ Write in clear, professional language without legal jargon. Use flowing paragrap
             "top_k": 40
         }
         
-        response = model.generate_content(prompt, generation_config=generation_config)
-        return response.text.strip()
+        with _vertex_semaphore:
+            response = model.generate_content(prompt, generation_config=generation_config)
+        return response.text.strip(), 'vertex_ai'
         
     except Exception as e:
         logger.error(f"Vertex AI summary failed: {e}")
-        return generate_enhanced_fallback_summary(text, key_info, contract_type)
+        return generate_enhanced_fallback_summary(text, key_info, contract_type), 'fallback'
 
 def generate_enhanced_fallback_summary(text: str, key_info: Dict[str, Any], contract_type: str) -> str:
     """Generate fallback summary with contract type awareness"""
@@ -905,6 +1229,519 @@ def format_enhanced_final_analysis(risky_clauses: List[Dict[str, Any]]) -> Dict[
         }
     }
 
+def _timed_stage(func, *args) -> Tuple[Any, float]:
+    """Run one pipeline stage and return its result with the elapsed milliseconds"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, round((time.perf_counter() - start) * 1000, 1)
+
+def iter_llm_stages(text: str, key_info: Dict[str, Any], contract_type: str, secondary_types: List[str],
+                    pipeline_mode: str = 'sequential') -> Iterator[Tuple[str, Any, float, str]]:
+    """Yield (stage, result, milliseconds, method) for the summary and risk stages as each one finishes.
+    
+    Each stage falls back to its local implementation on its own, so a failed
+    Vertex call in one stage does not affect the other.
+    """
+    if pipeline_mode == 'concurrent':
+        futures = {
+            _llm_stage_executor.submit(
+                _timed_stage, generate_enhanced_summary_with_vertex_ai, text, key_info, contract_type): 'summary',
+            _llm_stage_executor.submit(
+                _timed_stage, analyze_risks_with_enhanced_vertex_ai, text, "", contract_type, secondary_types): 'risk_analysis'
+        }
+        for future in as_completed(futures):
+            (result, method), elapsed_ms = future.result()
+            yield futures[future], result, elapsed_ms, method
+    else:
+        (summary_text, summary_method), summary_ms = _timed_stage(
+            generate_enhanced_summary_with_vertex_ai, text, key_info, contract_type)
+        yield 'summary', summary_text, summary_ms, summary_method
+        (risky_clauses, risk_method), risk_ms = _timed_stage(
+            analyze_risks_with_enhanced_vertex_ai, text, summary_text, contract_type, secondary_types)
+        yield 'risk_analysis', risky_clauses, risk_ms, risk_method
+
+def run_llm_stages(text: str, key_info: Dict[str, Any], contract_type: str, secondary_types: List[str],
+                   pipeline_mode: str = 'sequential') -> Tuple[str, List[Dict[str, Any]], Dict[str, float], Dict[str, str]]:
+    """Run the summary and risk stages and report the latency and method of each"""
+    results = {}
+    stage_latency_ms = {}
+    stage_methods = {}
+    for stage, result, elapsed_ms, method in iter_llm_stages(text, key_info, contract_type, secondary_types,
+                                                             pipeline_mode):
+        results[stage] = result
+        stage_latency_ms[stage] = elapsed_ms
+        stage_methods[stage] = method
+    
+    return results['summary'], results['risk_analysis'], stage_latency_ms, stage_methods
+
+def read_pipeline_mode() -> Tuple[Optional[str], Optional[Tuple[Any, int]]]:
+    """Pipeline option of the current request; returns (mode, None) or (None, error_response)"""
+    pipeline_mode = request.form.get('pipeline', DEFAULT_PIPELINE_MODE)
+    if pipeline_mode not in PIPELINE_MODES:
+        return None, (jsonify({
+            'error': 'Invalid pipeline mode',
+            'message': f"Pipeline must be one of: {', '.join(PIPELINE_MODES)}"
+        }), 400)
+    return pipeline_mode, None
+
+def read_document_upload() -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Any, int]]]:
+    """Validate the uploaded document and pipeline option of the current request.
+    
+    Returns the upload details, or an error response to return as is.
+    """
+    if 'document' not in request.files:
+        return None, (jsonify({
+            'error': 'No document file provided',
+            'message': 'Please upload a document'
+        }), 400)
+    
+    file = request.files['document']
+    
+    if not file or file.filename == '':
+        return None, (jsonify({
+            'error': 'No file selected',
+            'message': 'Please select a file'
+        }), 400)
+    
+    # Size and type are checked from the spool before the body is mapped
+    file_size = upload_size(file)
+    
+    if not file_size:
+        return None, (jsonify({
+            'error': 'Empty file',
+            'message': 'The file appears to be empty'
+        }), 400)
+    
+    if file_size > MAX_FILE_SIZE:
+        return None, (jsonify({
+            'error': 'File too large',
+            'message': f'File size exceeds {MAX_FILE_SIZE:,} bytes'
+        }), 413)
+    
+    logger.info(f"Processing file: {file.filename}, size: {file_size:,} bytes")
+    
+    try:
+        mime_type = detect_mime_type(read_head(file), file.filename, SUPPORTED_MIME_TYPES)
+        logger.info(f"Detected MIME type: {mime_type}")
+    except ValueError as e:
+        return None, (jsonify({
+            'error': 'Unsupported file type',
+            'message': str(e),
+            'supported_types': list(SUPPORTED_MIME_TYPES.values())
+        }), 400)
+    
+    pipeline_mode, error_response = read_pipeline_mode()
+    if error_response:
+        return None, error_response
+    
+    content = map_upload(file)
+    return {
+        'filename': file.filename,
+        'content': content,
+        'digest': content_digest(content),
+        'size': file_size,
+        'mime_type': mime_type,
+        'pipeline_mode': pipeline_mode
+    }, None
+
+def analysis_cache_key(upload: Dict[str, Any]) -> str:
+    """Identical bytes analyzed with the same model, prompts and services give the same result"""
+    return content_key(upload['digest'], upload['mime_type'], MODEL_NAME, PROMPT_VERSION,
+                       _document_processor is not None, _vertex_ai_available, upload['pipeline_mode'])
+
+def cache_analysis(cache_key: str, response: Dict[str, Any]) -> bool:
+    """Store a finished analysis unless a stage fell back after a Document AI or Vertex AI failure.
+    
+    The key assumes the configured engines produced the result; a degraded
+    result stored under it would be served after the service recovers.
+    """
+    processing_info = response["processing_info"]
+    if _document_processor and processing_info["extraction_method"] != _document_processor.name:
+        logger.info(f"Not caching analysis of locally extracted {response['document_info']['filename']}")
+        return False
+    if _vertex_ai_available and (processing_info["summarization_method"] != "vertex_ai"
+                                 or processing_info["risk_analysis_method"] != "vertex_ai"):
+        logger.info(f"Not caching degraded analysis of {response['document_info']['filename']}")
+        return False
+    analysis_cache.put(cache_key, response)
+    return True
+
+def get_cached_analysis(upload: Dict[str, Any], cache_key: str) -> Optional[Dict[str, Any]]:
+    """Return a cached analysis relabelled for this upload, or None"""
+    cached_response = analysis_cache.get(cache_key)
+    if cached_response is None:
+        return None
+    cached_response["document_info"]["filename"] = upload['filename']
+    cached_response["processing_info"]["cache_hit"] = True
+    logger.info(f"Analysis cache hit for {upload['filename']}")
+    return cached_response
+
+def format_key_information(key_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Trim extracted key information to the response shape"""
+    return {
+        "parties_involved": key_info["parties"][:4],
+        "important_dates": key_info["dates"][:4],
+        "monetary_amounts": key_info["amounts"][:5],
+        "payment_terms": key_info.get("payment_terms", [])[:3],
+        "penalty_clauses": key_info.get("penalty_clauses", [])[:3],
+        "termination_info": key_info.get("termination_clauses", [])[:3]
+    }
+
+def format_risk_analysis(final_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a formatted analysis to the risk_analysis response section"""
+    return {
+        "risky_clauses": final_analysis["risky_clauses"],
+        "hidden_tricks": final_analysis["hidden_tricks"],
+        "real_world_consequences": final_analysis["consequences"],
+        "negotiation_tips": final_analysis["negotiation_points"],
+        "comparative_justice": final_analysis["comparative_justice"],
+        "summary": final_analysis["summary"],
+        "detailed_clauses": final_analysis["detailed_clauses"]
+    }
+
+def build_analysis_response(upload: Dict[str, Any], extracted_text: str, normalized: NormalizedText,
+                            page_index: PageIndex, contract_scores: Dict[str, float], contract_type: str,
+                            secondary_types: List[str], key_info: Dict[str, Any], summary_text: str,
+                            risky_clauses: List[Dict[str, Any]], stage_latency_ms: Dict[str, float],
+                            stage_methods: Dict[str, str]) -> Dict[str, Any]:
+    """Assemble the complete /analyze-document response"""
+    annotate_clause_pages(risky_clauses, normalized, page_index)
+    final_analysis = format_enhanced_final_analysis(risky_clauses)
+    
+    logger.info(f"Analysis finished: Type: {contract_type}, "
+               f"{len(extracted_text)} chars, {len(risky_clauses)} risks, "
+               f"Level: {final_analysis['summary']['risk_level']}")
+    
+    return {
+        "status": "success",
+        "document_info": {
+            "filename": upload['filename'],
+            "file_size": upload['size'],
+            "mime_type": upload['mime_type'],
+            "contract_type": contract_type,
+            "secondary_contract_types": secondary_types,
+            "contract_type_scores": contract_scores,
+            "extracted_text_length": len(extracted_text),
+            "normalized_text_length": len(normalized),
+            "summary_length": len(summary_text),
+            "page_count": page_index.page_count
+        },
+        "extraction": {
+            "text": extracted_text,
+            "page_index": page_index.to_dict(),
+            "key_information": format_key_information(key_info),
+            "entities": key_info["entities"]
+        },
+        "summary": {
+            "contract_type": contract_type,
+            "summary_text": summary_text
+        },
+        "risk_analysis": format_risk_analysis(final_analysis),
+        "processing_info": {
+            "extraction_method": stage_methods['extraction'],
+            "summarization_method": stage_methods['summary'],
+            "risk_analysis_method": stage_methods['risk_analysis'],
+            "contract_type_detected": contract_type,
+            "pipeline_mode": upload['pipeline_mode'],
+            "stage_latency_ms": stage_latency_ms,
+            "total_risks_found": len(risky_clauses),
+            "severity_breakdown": {
+                "critical": final_analysis["summary"]["critical_risks"],
+                "high": final_analysis["summary"]["high_risks"],
+                "medium_high": final_analysis["summary"]["medium_high_risks"],
+                "total": final_analysis["summary"]["total_risks"]
+            }
+        }
+    }
+
+def text_too_short_error(extracted_text: str) -> Dict[str, Any]:
+    """Error payload for documents with too little extractable text"""
+    return {
+        'error': 'Extracted text too short',
+        'message': f'Text must be at least {MIN_TEXT_LENGTH} characters',
+        'extracted_length': len(extracted_text)
+    }
+
+def extraction_failed_error(error: ExtractionError) -> Dict[str, Any]:
+    """Error payload for documents the local parsers could not read"""
+    return {
+        'error': 'Extraction failed',
+        'message': str(error)
+    }
+
+def detect_contract_types(extracted_text: str) -> Tuple[Dict[str, float], str, List[str]]:
+    """Score contract types; close runners-up also get their specialized patterns"""
+    contract_scores = score_contract_types(extracted_text)
+    contract_types = ranked_contract_types(contract_scores)
+    logger.info(f"Contract type: {contract_types[0]} (scores: {contract_scores})")
+    return contract_scores, contract_types[0], contract_types[1:]
+
+def validate_batch_file(filename: str, file_content: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Return the MIME type of one batch file, or an error message"""
+    if not file_content:
+        return None, 'The file appears to be empty'
+    if len(file_content) > MAX_FILE_SIZE:
+        return None, f'File size exceeds {MAX_FILE_SIZE:,} bytes'
+    try:
+        return detect_mime_type(file_content, filename, SUPPORTED_MIME_TYPES), None
+    except ValueError as e:
+        return None, str(e)
+
+def read_batch_uploads() -> Tuple[Optional[List[Dict[str, Any]]], Optional[Tuple[Any, int]]]:
+    """Collect the files of a batch request, expanding ZIP archives.
+    
+    Files that fail validation are kept with an 'error' so they are reported per
+    document instead of failing the whole batch.
+    """
+    files = request.files.getlist('documents') + request.files.getlist('document')
+    files = [file for file in files if file and file.filename]
+    if not files:
+        return None, (jsonify({
+            'error': 'No documents provided',
+            'message': 'Upload one or more files, or a ZIP archive, in the "documents" field'
+        }), 400)
+    
+    pipeline_mode, error_response = read_pipeline_mode()
+    if error_response:
+        return None, error_response
+    
+    entries = []
+    total_bytes = 0
+    for file in files:
+        file_content = file.read()
+        if file.filename.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(BytesIO(file_content))
+            except zipfile.BadZipFile:
+                entries.append({'filename': file.filename, 'error': 'Invalid ZIP archive'})
+                continue
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                    continue
+                # Check the declared size before inflating anything
+                if info.file_size > MAX_FILE_SIZE:
+                    entries.append({'filename': name, 'error': f'File size exceeds {MAX_FILE_SIZE:,} bytes'})
+                    continue
+                total_bytes += info.file_size
+                if total_bytes > MAX_BATCH_BYTES:
+                    return None, (jsonify({
+                        'error': 'Batch too large',
+                        'message': f'Uncompressed batch size exceeds {MAX_BATCH_BYTES:,} bytes'
+                    }), 413)
+                try:
+                    member_content = archive.read(info)
+                except (zipfile.BadZipFile, RuntimeError, NotImplementedError, zlib.error) as e:
+                    # Corrupt, encrypted or unsupported members fail on their own
+                    logger.warning(f"Could not read {name} from {file.filename}: {e}")
+                    entries.append({'filename': name, 'error': f'Unreadable ZIP member: {e}'})
+                    continue
+                entries.append({'filename': name, 'content': member_content})
+        else:
+            total_bytes += len(file_content)
+            entries.append({'filename': file.filename, 'content': file_content})
+    
+    if total_bytes > MAX_BATCH_BYTES:
+        return None, (jsonify({
+            'error': 'Batch too large',
+            'message': f'Batch size exceeds {MAX_BATCH_BYTES:,} bytes'
+        }), 413)
+    if len(entries) > MAX_BATCH_FILES:
+        return None, (jsonify({
+            'error': 'Too many documents',
+            'message': f'A batch may contain at most {MAX_BATCH_FILES} documents'
+        }), 400)
+    
+    uploads = []
+    for entry in entries:
+        if 'error' in entry:
+            uploads.append(entry)
+            continue
+        mime_type, error = validate_batch_file(entry['filename'], entry['content'])
+        if error:
+            uploads.append({'filename': entry['filename'], 'error': error})
+            continue
+        uploads.append({
+            'filename': entry['filename'],
+            'content': entry['content'],
+            'digest': content_digest(entry['content']),
+            'size': len(entry['content']),
+            'mime_type': mime_type,
+            'pipeline_mode': pipeline_mode
+        })
+    
+    return uploads, None
+
+def analyze_batch(uploads: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], int]]:
+    """Analyze several uploads at once and return (payload, status) in upload order.
+    
+    Local parsing spreads over the extraction sandbox workers so it scales with
+    cores; the model stages run concurrently under the shared Vertex limit.
+    """
+    results: List[Optional[Tuple[Dict[str, Any], int]]] = [None] * len(uploads)
+    pending = []
+    
+    for index, upload in enumerate(uploads):
+        if 'error' in upload:
+            results[index] = ({'error': 'Invalid document', 'message': upload['error']}, 400)
+            continue
+        cache_key = analysis_cache_key(upload)
+        cached_response = get_cached_analysis(upload, cache_key)
+        if cached_response is not None:
+            results[index] = (cached_response, 200)
+            continue
+        pending.append((index, _batch_executor.submit(run_analysis_pipeline, upload, cache_key)))
+    
+    for index, future in pending:
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            logger.error(f"Batch analysis of {uploads[index]['filename']} failed: {str(e)}")
+            results[index] = ({'error': 'Analysis failed', 'message': str(e)}, 500)
+    
+    return results
+
+def build_batch_rollup(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine the risks of every analyzed document into one assessment"""
+    combined_clauses = []
+    by_document = []
+    for document in documents:
+        analysis = document.get('analysis')
+        if not analysis:
+            continue
+        risk_summary = analysis['risk_analysis']['summary']
+        by_document.append({
+            'filename': document['filename'],
+            'contract_type': analysis['document_info']['contract_type'],
+            'risk_level': risk_summary['risk_level'],
+            'total_risks': risk_summary['total_risks']
+        })
+        for clause in analysis['risk_analysis']['detailed_clauses']:
+            combined_clauses.append(dict(clause, document=document['filename']))
+    
+    combined = format_enhanced_final_analysis(combined_clauses)
+    return {
+        'documents_analyzed': len(by_document),
+        'risk_level': combined['summary']['risk_level'],
+        'recommendation': combined['summary']['recommendation'],
+        'severity_breakdown': {
+            'critical': combined['summary']['critical_risks'],
+            'high': combined['summary']['high_risks'],
+            'medium_high': combined['summary']['medium_high_risks'],
+            'total': combined['summary']['total_risks']
+        },
+        'categories_affected': combined['summary']['categories_affected'],
+        'by_document': by_document,
+        'risky_clauses': [
+            {
+                'document': clause['document'],
+                'severity': clause.get('severity', 'medium'),
+                'plain_english': clause.get('plain_english', '')
+            }
+            for clause in combined['detailed_clauses']
+        ]
+    }
+
+def generate_analysis_events(upload: Dict[str, Any], stream_format: str) -> Iterator[str]:
+    """Run the analysis pipeline and yield each section as soon as it is ready.
+    
+    Events arrive in order: started, document_info, key_information, rules_risks,
+    then summary and risk_analysis in completion order, and finally complete with
+    the same payload /analyze-document returns. Failures end the stream with error.
+    """
+    def event(name: str, data: Dict[str, Any]) -> str:
+        return format_stream_event(name, data, stream_format)
+    
+    try:
+        yield event('started', {
+            'filename': upload['filename'],
+            'file_size': upload['size'],
+            'mime_type': upload['mime_type'],
+            'pipeline_mode': upload['pipeline_mode']
+        })
+        
+        cache_key = analysis_cache_key(upload)
+        cached_response = get_cached_analysis(upload, cache_key)
+        if cached_response is not None:
+            yield event('document_info', cached_response['document_info'])
+            yield event('key_information', {
+                'key_information': cached_response['extraction']['key_information'],
+                'entities': cached_response['extraction']['entities']
+            })
+            yield event('summary', cached_response['summary'])
+            yield event('risk_analysis', cached_response['risk_analysis'])
+            yield event('complete', cached_response)
+            return
+        
+        try:
+            (extracted_text, extraction_method), extraction_ms = _timed_stage(
+                extract_text_with_document_ai, upload['content'], upload['mime_type'], upload['digest'])
+        except ExtractionError as e:
+            yield event('error', extraction_failed_error(e))
+            return
+        if len(extracted_text.strip()) < MIN_TEXT_LENGTH:
+            yield event('error', text_too_short_error(extracted_text))
+            return
+        
+        # Every analyzer reads the normalized text; offsets are mapped back for the response
+        normalized = normalize_text(extracted_text)
+        page_index = PageIndex.from_text(extracted_text)
+        contract_scores, contract_type, secondary_types = detect_contract_types(normalized.text)
+        yield event('document_info', {
+            'filename': upload['filename'],
+            'file_size': upload['size'],
+            'mime_type': upload['mime_type'],
+            'contract_type': contract_type,
+            'secondary_contract_types': secondary_types,
+            'contract_type_scores': contract_scores,
+            'extracted_text_length': len(extracted_text),
+            'page_count': page_index.page_count,
+            'extraction_ms': extraction_ms
+        })
+        
+        key_info = extract_key_information_enhanced(normalized.text)
+        annotate_entity_pages(key_info['entities'], normalized, page_index)
+        yield event('key_information', {
+            'key_information': format_key_information(key_info),
+            'entities': key_info['entities']
+        })
+        
+        # The local rules give a preliminary picture while the model calls are in flight
+        rules_clauses = analyze_risks_with_enhanced_rules(normalized.text, "", contract_type, secondary_types)
+        annotate_clause_pages(rules_clauses, normalized, page_index)
+        yield event('rules_risks', {
+            'preliminary': True,
+            'risk_analysis': format_risk_analysis(format_enhanced_final_analysis(rules_clauses))
+        })
+        
+        results = {}
+        stage_latency_ms = {'extraction': extraction_ms}
+        stage_methods = {'extraction': extraction_method}
+        for stage, result, elapsed_ms, method in iter_llm_stages(normalized.text, key_info, contract_type,
+                                                                 secondary_types, upload['pipeline_mode']):
+            results[stage] = result
+            stage_latency_ms[stage] = elapsed_ms
+            stage_methods[stage] = method
+            if stage == 'summary':
+                yield event('summary', {'contract_type': contract_type, 'summary_text': result,
+                                        'elapsed_ms': elapsed_ms})
+            else:
+                annotate_clause_pages(result, normalized, page_index)
+                yield event('risk_analysis', dict(format_risk_analysis(format_enhanced_final_analysis(result)),
+                                                  elapsed_ms=elapsed_ms))
+        
+        complete_response = build_analysis_response(upload, extracted_text, normalized, page_index,
+                                                    contract_scores, contract_type, secondary_types, key_info,
+                                                    results['summary'], results['risk_analysis'], stage_latency_ms,
+                                                    stage_methods)
+        cache_analysis(cache_key, complete_response)
+        complete_response["processing_info"]["cache_hit"] = False
+        yield event('complete', complete_response)
+    
+    except Exception as e:
+        logger.error(f"Streaming analysis failed: {str(e)}")
+        yield event('error', {'error': 'Analysis failed', 'message': str(e)})
+
 # ROUTES
 @app.before_request
 def handle_preflight():
@@ -922,6 +1759,66 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS')
     return response
 
+def analyze_upload(upload: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Run the full analysis pipeline on a validated upload and return the payload and status code"""
+    cache_key = analysis_cache_key(upload)
+    cached_response = get_cached_analysis(upload, cache_key)
+    if cached_response is not None:
+        return cached_response, 200
+    
+    return run_analysis_pipeline(upload, cache_key)
+
+def run_analysis_pipeline(upload: Dict[str, Any], cache_key: str) -> Tuple[Dict[str, Any], int]:
+    """Analyze an upload that missed the cache"""
+    # Extract text
+    try:
+        (extracted_text, extraction_method), extraction_ms = _timed_stage(
+            extract_text_with_document_ai, upload['content'], upload['mime_type'], upload['digest'])
+    except ExtractionError as e:
+        logger.warning(f"Extraction failed for {upload['filename']}: {e}")
+        return extraction_failed_error(e), 422
+    
+    if len(extracted_text.strip()) < MIN_TEXT_LENGTH:
+        return text_too_short_error(extracted_text), 400
+    
+    logger.info(f"Text extraction completed: {len(extracted_text)} characters")
+    # Every analyzer reads the normalized text; offsets are mapped back for the response
+    normalized = normalize_text(extracted_text)
+    page_index = PageIndex.from_text(extracted_text)
+    
+    # Detect contract type
+    contract_scores, contract_type, secondary_types = detect_contract_types(normalized.text)
+    
+    # Extract key information
+    key_info = extract_key_information_enhanced(normalized.text)
+    annotate_entity_pages(key_info['entities'], normalized, page_index)
+    
+    # Summary and risk analysis
+    summary_text, risky_clauses, stage_latency_ms, stage_methods = run_llm_stages(
+        normalized.text, key_info, contract_type, secondary_types, upload['pipeline_mode'])
+    stage_latency_ms['extraction'] = extraction_ms
+    stage_methods['extraction'] = extraction_method
+    logger.info(f"Summary generated: {len(summary_text)} characters")
+    logger.info(f"Risk analysis completed: {len(risky_clauses)} risks found")
+    logger.info(f"Stage latency ({upload['pipeline_mode']}): {stage_latency_ms}")
+    
+    # Complete response
+    complete_response = build_analysis_response(upload, extracted_text, normalized, page_index, contract_scores,
+                                                contract_type, secondary_types, key_info, summary_text, risky_clauses,
+                                                stage_latency_ms, stage_methods)
+    
+    cache_analysis(cache_key, complete_response)
+    complete_response["processing_info"]["cache_hit"] = False
+    
+    return complete_response, 200
+
+def run_analysis_job(upload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job queue entry point; analysis errors become failed jobs"""
+    payload, status_code = analyze_upload(upload)
+    if status_code != 200:
+        raise ValueError(payload['message'])
+    return payload
+
 @app.route('/analyze-document', methods=['POST', 'OPTIONS'])
 def analyze_document():
     """Document analysis workflow"""
@@ -932,140 +1829,155 @@ def analyze_document():
         logger.info("Starting document analysis")
         
         # Validate file upload
-        if 'document' not in request.files:
-            return jsonify({
-                'error': 'No document file provided',
-                'message': 'Please upload a document'
-            }), 400
-        
-        file = request.files['document']
+        upload, error_response = read_document_upload()
+        if error_response:
+            return error_response
         
-        if not file or file.filename == '':
-            return jsonify({
-                'error': 'No file selected',
-                'message': 'Please select a file'
-            }), 400
-        
-        file_content = file.read()
+        payload, status_code = analyze_upload(upload)
+        return jsonify(payload), status_code
         
-        if not file_content:
-            return jsonify({
-                'error': 'Empty file',
-                'message': 'The file appears to be empty'
-            }), 400
-        
-        file_size = len(file_content)
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({
-                'error': 'File too large',
-                'message': f'File size exceeds {MAX_FILE_SIZE:,} bytes'
-            }), 413
-        
-        logger.info(f"Processing file: {file.filename}, size: {file_size:,} bytes")
-        
-        # Extract text
-        try:
-            mime_type = detect_mime_type(file_content, file.filename)
-            logger.info(f"Detected MIME type: {mime_type}")
-        except ValueError as e:
-            return jsonify({
-                'error': 'Unsupported file type',
-                'message': str(e),
-                'supported_types': list(SUPPORTED_MIME_TYPES.values())
-            }), 400
-        
-        extracted_text = extract_text_with_document_ai(file_content, mime_type)
-        
-        if len(extracted_text.strip()) < MIN_TEXT_LENGTH:
-            return jsonify({
-                'error': 'Extracted text too short',
-                'message': f'Text must be at least {MIN_TEXT_LENGTH} characters',
-                'extracted_length': len(extracted_text)
-            }), 400
-        
-        logger.info(f"Text extraction completed: {len(extracted_text)} characters")
-        
-        # Detect contract type
-        contract_type = detect_contract_type(extracted_text)
-        logger.info(f"Contract type: {contract_type}")
-        
-        # Extract key information
-        key_info = extract_key_information_enhanced(extracted_text)
+    except Exception as e:
+        logger.error(f"Document analysis failed: {str(e)}")
+        return jsonify({
+            'error': 'Analysis failed',
+            'message': str(e)
+        }), 500
+
+@app.route('/analyze-document/stream', methods=['POST', 'OPTIONS'])
+def analyze_document_stream():
+    """Document analysis that streams each section as it completes"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    stream_format = requested_stream_format(request.args.get('format') or request.form.get('format'),
+                                            request.headers.get('Accept', ''))
+    if stream_format not in STREAM_FORMATS:
+        return jsonify({
+            'error': 'Invalid stream format',
+            'message': f"Format must be one of: {', '.join(STREAM_FORMATS)}"
+        }), 400
+    
+    logger.info(f"Starting streaming document analysis ({stream_format})")
+    upload, error_response = read_document_upload()
+    if error_response:
+        return error_response
+    
+    return event_stream_response(generate_analysis_events(upload, stream_format), stream_format)
+
+@app.route('/analyze-batch', methods=['POST', 'OPTIONS'])
+def analyze_batch_documents():
+    """Analyze a contract pack of several files or a ZIP archive"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        uploads, error_response = read_batch_uploads()
+        if error_response:
+            return error_response
         
-        # Generate summary
-        summary_text = generate_enhanced_summary_with_vertex_ai(extracted_text, key_info, contract_type)
-        logger.info(f"Summary generated: {len(summary_text)} characters")
+        logger.info(f"Starting batch analysis of {len(uploads)} documents")
+        start = time.perf_counter()
+        results = analyze_batch(uploads)
         
-        # Risk analysis
-        risky_clauses = analyze_risks_with_enhanced_vertex_ai(extracted_text, summary_text, contract_type)
-        logger.info(f"Risk analysis completed: {len(risky_clauses)} risks found")
+        documents = []
+        for upload, (payload, status_code) in zip(uploads, results):
+            if status_code == 200:
+                documents.append({'filename': upload['filename'], 'status': 'success', 'analysis': payload})
+            else:
+                documents.append({'filename': upload['filename'], 'status': 'error', 'error': payload})
         
-        # Format analysis
-        final_analysis = format_enhanced_final_analysis(risky_clauses)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"Batch analysis finished: {len(documents)} documents in {elapsed_ms} ms")
         
-        # Complete response
-        complete_response = {
-            "status": "success",
-            "document_info": {
-                "filename": file.filename,
-                "file_size": file_size,
-                "mime_type": mime_type,
-                "contract_type": contract_type,
-                "extracted_text_length": len(extracted_text),
-                "summary_length": len(summary_text)
-            },
-            "extraction": {
-                "text": extracted_text,
-                "key_information": {
-                    "parties_involved": key_info["parties"][:4],
-                    "important_dates": key_info["dates"][:4],
-                    "monetary_amounts": key_info["amounts"][:5],
-                    "payment_terms": key_info.get("payment_terms", [])[:3],
-                    "penalty_clauses": key_info.get("penalty_clauses", [])[:3],
-                    "termination_info": key_info.get("termination_clauses", [])[:3]
-                }
-            },
-            "summary": {
-                "contract_type": contract_type,
-                "summary_text": summary_text
-            },
-            "risk_analysis": {
-                "risky_clauses": final_analysis["risky_clauses"],
-                "hidden_tricks": final_analysis["hidden_tricks"],
-                "real_world_consequences": final_analysis["consequences"],
-                "negotiation_tips": final_analysis["negotiation_points"],
-                "comparative_justice": final_analysis["comparative_justice"],
-                "summary": final_analysis["summary"],
-                "detailed_clauses": final_analysis["detailed_clauses"]
-            },
-            "processing_info": {
-                "extraction_method": "document_ai" if _document_ai_client else "fallback",
-                "summarization_method": "vertex_ai" if _vertex_ai_available else "fallback",
-                "risk_analysis_method": "vertex_ai" if _vertex_ai_available else "rules_based",
-                "contract_type_detected": contract_type,
-                "total_risks_found": len(risky_clauses),
-                "severity_breakdown": {
-                    "critical": final_analysis["summary"]["critical_risks"],
-                    "high": final_analysis["summary"]["high_risks"],
-                    "medium_high": final_analysis["summary"]["medium_high_risks"],
-                    "total": final_analysis["summary"]["total_risks"]
-                }
+        return jsonify({
+            'status': 'success',
+            'documents': documents,
+            'rollup': build_batch_rollup(documents),
+            'processing_info': {
+                'document_count': len(documents),
+                'failed_count': sum(1 for document in documents if document['status'] == 'error'),
+                'extraction_method': _document_processor.name if _document_processor else 'fallback',
+                'elapsed_ms': elapsed_ms
             }
-        }
-        
-        logger.info(f"Analysis finished: Type: {contract_type}, "
-                   f"{len(extracted_text)} chars, {len(risky_clauses)} risks, "
-                   f"Level: {final_analysis['summary']['risk_level']}")
-        
-        return jsonify(complete_response)
-        
+        })
+    
     except Exception as e:
-        logger.error(f"Document analysis failed: {str(e)}")
+        logger.error(f"Batch analysis failed: {str(e)}")
         return jsonify({
-            'error': 'Analysis failed',
+            'error': 'Batch analysis failed',
             'message': str(e)
         }), 500
 
+@app.route('/jobs', methods=['POST', 'OPTIONS'])
+def submit_analysis_job():
+    """Queue a document analysis and return its job id immediately"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    upload, error_response = read_document_upload()
+    if error_response:
+        return error_response
+    
+    try:
+        job_id = job_queue.submit(run_analysis_job, upload)
+    except QueueFullError as e:
+        logger.warning(f"Rejected job for {upload['filename']}: queue full")
+        response = jsonify({
+            'error': 'Too many pending analyses',
+            'message': str(e),
+            'retry_after': e.retry_after
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    logger.info(f"Queued analysis job {job_id} for {upload['filename']}")
+    job = job_queue.get(job_id)
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'] if job else 'queued',
+        'status_url': f'/jobs/{job_id}',
+        'queue_depth': job_queue.stats()['queue_depth']
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+def get_analysis_job(job_id):
+    """Job status and, once finished, its result. Pass wait=<seconds> to long-poll"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), JOB_MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({
+            'error': 'Invalid wait',
+            'message': 'wait must be a number of seconds'
+        }), 400
+    
+    job = job_queue.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({
+            'error': 'Job not found',
+            'message': f'No job with id {job_id}'
+        }), 404
+    
+    response = {
+        'job_id': job_id,
+        'status': job['status'],
+        'submitted_at': job['submitted_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['started_at']:
+        response['wait_ms'] = round((job['started_at'] - job['submitted_at']) * 1000, 1)
+    if job['status'] == 'queued':
+        response['queue_position'] = job['queue_position']
+    elif job['status'] == 'completed':
+        response['result'] = job['result']
+    elif job['status'] == 'failed':
+        response['error'] = job['error']
+    
+    return jsonify(response)
+
 @app.route('/health', methods=['GET', 'OPTIONS'])
 def health_check():
     """Health check endpoint"""
@@ -1073,7 +1985,7 @@ def health_check():
         return '', 200
         
     try:
-        doc_ai_status = _document_ai_client is not None
+        doc_ai_status = _document_processor is not None
         vertex_ai_status = _vertex_ai_available
         
         return jsonify({
@@ -1084,7 +1996,10 @@ def health_check():
                 'max_file_size_mb': MAX_FILE_SIZE // (1024 * 1024),
                 'supported_types': list(SUPPORTED_MIME_TYPES.values()),
                 'project_id': PROJECT_ID,
-                'model': MODEL_NAME
+                'model': MODEL_NAME,
+                'document_processor': _document_processor.name if _document_processor else None,
+                'document_ai_shard_pages': DOCUMENT_AI_SHARD_PAGES,
+                'document_ai_max_in_flight': DOCUMENT_AI_MAX_IN_FLIGHT
             },
             'features': {
                 'document_ai_extraction': doc_ai_status,
@@ -1092,8 +2007,13 @@ def health_check():
                 'contract_type_detection': True,
                 'risk_pattern_matching': True,
                 'python_magic_available': MAGIC_AVAILABLE,
+                'ahocorasick_prefilter_available': AHOCORASICK_AVAILABLE,
                 'risk_patterns': len(COMPREHENSIVE_RISK_PATTERNS)
             },
+            'analysis_cache': analysis_cache.stats(),
+            'job_queue': job_queue.stats(),
+            'extraction': document_extractor.stats(),
+            'document_processor': _document_processor.stats() if _document_processor else None,
             'contract_types_supported': list(CONTRACT_TYPE_PATTERNS.keys()) + ['general'],
             'severity_levels': ['critical', 'high', 'medium-high', 'medium', 'low']
         })
@@ -1115,9 +2035,16 @@ def root():
             'url': '/analyze-document',
             'method': 'POST',
             'description': 'Upload document for analysis',
-            'input': 'Multipart form with "document" field (PDF, DOCX, DOC)'
+            'input': 'Multipart form with "document" field (PDF, DOCX, DOC)',
+            'options': {
+                'pipeline': 'sequential (default) or concurrent - run summary and risk analysis in parallel'
+            }
         },
         'other_endpoints': {
+            '/analyze-document/stream': 'POST - Same input, streams sections as NDJSON or SSE (format=ndjson|sse)',
+            '/analyze-batch': 'POST - Several files or a ZIP in the "documents" field; per-document results plus a combined risk roll-up',
+            '/jobs': 'POST - Same input, queues the analysis and returns a job id (429 with Retry-After when busy)',
+            '/jobs/<job_id>': 'GET - Job status and result; wait=<seconds> long-polls until it finishes',
             '/health': 'GET - Health check',
             '/': 'GET - API information'
         },
@@ -1156,12 +2083,13 @@ if __name__ == '__main__':
         initialize_services()
         
         logger.info("Starting Legal Document Risk Analyzer...")
-        logger.info(f"Document AI: {'✓ Available' if _document_ai_client else '✗ Fallback mode'}")
+        logger.info(f"Document AI: {'✓ ' + _document_processor.name if _document_processor else '✗ Fallback mode'}")
         logger.info(f"Vertex AI: {'✓ Available' if _vertex_ai_available else '✗ Fallback mode'}")
         logger.info(f"Model: {MODEL_NAME}")
         logger.info(f"Risk patterns: {len(COMPREHENSIVE_RISK_PATTERNS)}")
         logger.info(f"Contract types: {len(CONTRACT_TYPE_PATTERNS) + 1}")
         logger.info(f"python-magic: {'✓' if MAGIC_AVAILABLE else '✗'}")
+        logger.info(f"pyahocorasick: {'✓' if AHOCORASICK_AVAILABLE else '✗'}")
         
         # Run the application
         app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,98 @@
+import re
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional
+
+from text_normalization import NormalizedText
+
+# Markers written by local PDF extraction and document processors, e.g. '--- Page 3 ---',
+# '--- Page 4 (extraction failed) ---' or '--- Page 5 (OCR) ---'
+PAGE_MARKER_PATTERN = re.compile(r'^--- Page (\d+)(?: \([a-zA-Z ]+\))? ---$', re.MULTILINE)
+QUOTE_PATTERN = re.compile(r'["“]([^"“”]{20,400})["”]')
+# Words of a snippet used to find it again in the document
+LOCATE_WORDS = 12
+
+class PageIndex:
+    """Start offset and page number of every page block in a document's text.
+
+    Offsets are kept in array('I') so the index costs a few bytes per page;
+    page_at is a binary search.
+    """
+
+    __slots__ = ('offsets', 'pages')
+
+    def __init__(self, offsets: Optional[array] = None, pages: Optional[array] = None):
+        self.offsets = offsets if offsets is not None else array('I')
+        self.pages = pages if pages is not None else array('I')
+
+    @classmethod
+    def from_text(cls, text: str) -> 'PageIndex':
+        """Index the page markers of extracted text in one scan.
+
+        Extraction results are cached as plain text, so the markers are found
+        again here rather than carried alongside the text.
+        """
+        index = cls()
+        for match in PAGE_MARKER_PATTERN.finditer(text):
+            index.offsets.append(match.start())
+            index.pages.append(int(match.group(1)))
+        return index
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def page_count(self) -> int:
+        return self.pages[-1] if self.pages else 0
+
+    def page_at(self, offset: Optional[int]) -> Optional[int]:
+        """Page containing a text offset, or None when the text has no page markers"""
+        if offset is None or not self.offsets:
+            return None
+        return self.pages[max(0, bisect_right(self.offsets, offset) - 1)]
+
+    def to_dict(self) -> Dict[str, List[int]]:
+        return {'pages': self.pages.tolist(), 'offsets': self.offsets.tolist()}
+
+def locate_text(text: str, snippet: str) -> Optional[int]:
+    """Offset of a quoted snippet in the document, ignoring whitespace differences"""
+    words = snippet.replace('...', ' ').split()[:LOCATE_WORDS]
+    if not words:
+        return None
+    match = re.search(r'\s+'.join(re.escape(word) for word in words), text)
+    return match.start() if match else None
+
+def _original_page(normalized: NormalizedText, page_index: PageIndex, offset: Optional[int]) -> Optional[int]:
+    return page_index.page_at(None if offset is None else normalized.to_original(offset))
+
+def annotate_clause_pages(clauses: List[Dict[str, Any]], normalized: NormalizedText, page_index: PageIndex) -> None:
+    """Set 'page' on clauses not yet placed, from their match offset or by finding their quoted text.
+
+    The match offset is in normalized coordinates, so it is removed once used.
+    """
+    for clause in clauses:
+        offset = clause.pop('match_offset', None)
+        if 'page' in clause:
+            continue
+        if offset is None and page_index:
+            offset = locate_text(normalized.text, clause.get('clause_text', ''))
+        clause['page'] = _original_page(normalized, page_index, offset)
+
+def annotate_entity_pages(entities: List[Dict[str, Any]], normalized: NormalizedText, page_index: PageIndex) -> None:
+    """Point entity offsets found in normalized text back at the original, and set their page"""
+    for entity in entities:
+        entity['start'] = normalized.to_original(entity['start'])
+        entity['end'] = normalized.to_original(entity['end'] - 1) + 1
+        entity['page'] = page_index.page_at(entity['start'])
+
+def find_quote_pages(response_text: str, normalized: NormalizedText, page_index: PageIndex) -> List[Dict[str, Any]]:
+    """Pages of the document passages a response quotes"""
+    if not page_index:
+        return []
+    quotes = []
+    for match in QUOTE_PATTERN.finditer(response_text):
+        quote = match.group(1).strip()
+        page = _original_page(normalized, page_index, locate_text(normalized.text, quote))
+        if page is not None:
+            quotes.append({'quote': quote[:80], 'page': page})
+    return quotes
@@ -0,0 +1,105 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import PyPDF2
+
+from extraction_sandbox import child_process_limit
+from upload_handling import Buffer, MappedUpload, open_buffer, spool_buffer
+
+logger = logging.getLogger(__name__)
+
+# Documents shorter than this are parsed in-process; worker start-up and the
+# per-worker PDF parse would cost more than they save
+PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '16'))
+PDF_EXTRACTION_PROCESSES = int(os.getenv('PDF_EXTRACTION_PROCESSES', str(os.cpu_count() or 2)))
+# Page ranges per worker; more than one evens out pages of very different density
+CHUNKS_PER_PROCESS = 2
+
+_page_pools: Dict[int, ProcessPoolExecutor] = {}
+_page_pools_lock = threading.Lock()
+
+def _get_page_pool(processes: int) -> ProcessPoolExecutor:
+    with _page_pools_lock:
+        if processes not in _page_pools:
+            _page_pools[processes] = ProcessPoolExecutor(max_workers=processes)
+            logger.info(f"Started PDF page pool with {processes} processes")
+        return _page_pools[processes]
+
+def pdf_page_count(file_content: Buffer) -> int:
+    """Number of pages in a PDF"""
+    return len(PyPDF2.PdfReader(open_buffer(file_content)).pages)
+
+def split_pdf(file_content: Buffer, ranges: List[Tuple[int, int]]) -> List[bytes]:
+    """Build one PDF per [start, end) page range"""
+    reader = PyPDF2.PdfReader(open_buffer(file_content))
+    shards = []
+    for start, end in ranges:
+        writer = PyPDF2.PdfWriter()
+        for page_num in range(start, end):
+            writer.add_page(reader.pages[page_num])
+        buffer = BytesIO()
+        writer.write(buffer)
+        shards.append(buffer.getvalue())
+    return shards
+
+def extract_page_range(file_content: Buffer, start: int, end: int) -> List[Optional[str]]:
+    """Extract pages [start, end) of a PDF; None marks a page that failed"""
+    pdf_reader = PyPDF2.PdfReader(open_buffer(file_content))
+    pages: List[Optional[str]] = []
+    for page_num in range(start, end):
+        try:
+            pages.append(pdf_reader.pages[page_num].extract_text())
+        except Exception as e:
+            logger.warning(f"Failed to extract text from page {page_num + 1}: {e}")
+            pages.append(None)
+    return pages
+
+def page_ranges(page_count: int, chunks: int) -> List[Tuple[int, int]]:
+    """Split page_count pages into at most chunks contiguous ranges"""
+    chunks = max(1, min(chunks, page_count))
+    size, remainder = divmod(page_count, chunks)
+    ranges = []
+    start = 0
+    for index in range(chunks):
+        end = start + size + (1 if index < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def extract_pdf_pages(file_content: Buffer, processes: Optional[int] = None) -> List[Optional[str]]:
+    """Extract every page of a PDF, spreading large documents across worker processes"""
+    page_count = pdf_page_count(file_content)
+    processes = PDF_EXTRACTION_PROCESSES if processes is None else processes
+    if child_process_limit() is not None:
+        # Every pool process may use as much memory as the sandbox worker itself
+        processes = min(processes, child_process_limit())
+
+    # Daemonic processes cannot start a pool of their own; sandbox workers are not daemonic
+    if processes <= 1 or page_count < PARALLEL_MIN_PAGES or multiprocessing.current_process().daemon:
+        return extract_page_range(file_content, 0, page_count)
+
+    pool = _get_page_pool(processes)
+    # Chunks share one mapped file, sent to the pool as a descriptor, instead of a copy each
+    payload = file_content if isinstance(file_content, MappedUpload) else spool_buffer(file_content)
+    futures = [pool.submit(extract_page_range, payload, start, end)
+               for start, end in page_ranges(page_count, processes * CHUNKS_PER_PROCESS)]
+    pages: List[Optional[str]] = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+def format_pdf_pages(pages: List[Optional[str]], first_page: int = 1, label: Optional[str] = None) -> str:
+    """Join page texts with page markers in a single pass; label is added to each marker, e.g. 'OCR'"""
+    suffix = f" ({label})" if label else ""
+    parts = []
+    for page_num, page_text in enumerate(pages, first_page):
+        if page_text is None:
+            parts.append(f"\n--- Page {page_num} (extraction failed) ---\n")
+        else:
+            parts.append(f"\n--- Page {page_num}{suffix} ---\n{page_text}\n")
+    return "".join(parts)
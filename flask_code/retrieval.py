@@ -0,0 +1,251 @@
+import heapq
+import logging
+import math
+import os
+import re
+import tempfile
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, defaultdict
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# NumPy is optional; without it retrieval uses BM25 alone
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Chunks hold whole lines of normalized text up to about this many characters
+CHUNK_CHARS = 1000
+LINE_PATTERN = re.compile(r'[^\n]+')
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Dense index settings: hashed feature dimensions, character n-gram sizes, and the
+# size above which a document's chunk matrix lives in a memory-mapped temp file
+EMBEDDING_DIMENSIONS = 512
+NGRAM_SIZES = (3, 4, 5)
+DENSE_MMAP_BYTES = int(os.getenv('DENSE_MMAP_BYTES', str(32 * 1024 * 1024)))
+EMBED_BATCH_SIZE = 256
+# Reciprocal rank fusion constant; larger values flatten the difference between ranks
+RRF_K = 60
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in into is it
+its may me my no not of on or our shall should so than that the their them then there these they this
+to under was we were what when where which who will with would you your
+""".split())
+
+# Everyday words mapped to the contract vocabulary they usually stand for
+CONCEPT_SYNONYMS = {
+    'drop': 'terminate', 'fire': 'terminate', 'end': 'terminate', 'cancel': 'terminate', 'quit': 'terminate',
+    'leave': 'terminate', 'exit': 'terminate',
+    'pay': 'payment', 'owe': 'payment', 'cost': 'fee', 'price': 'fee', 'charge': 'fee', 'money': 'payment',
+    'sue': 'dispute', 'court': 'dispute', 'fight': 'dispute', 'disagree': 'dispute',
+    'secret': 'confidential', 'private': 'confidential', 'share': 'disclose',
+    'fine': 'penalty', 'late': 'penalty', 'punish': 'penalty',
+    'blame': 'liability', 'responsible': 'liability', 'damage': 'liability', 'hurt': 'indemnify',
+    'change': 'modify', 'extend': 'renewal', 'renew': 'renewal', 'refund': 'refundable',
+}
+
+class Chunk(NamedTuple):
+    start: int
+    text: str
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords; a plural 's' is dropped so 'fees' matches 'fee'"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS) -> List[Chunk]:
+    """Split text into chunks of whole lines; lines longer than a chunk are cut at a space"""
+    chunks = []
+    start = end = 0
+    for line in LINE_PATTERN.finditer(text):
+        if end > start and line.end() - start > chunk_chars:
+            chunks.append(Chunk(start, text[start:end]))
+            start = line.start()
+        end = line.end()
+        while end - start > chunk_chars:
+            cut = text.rfind(' ', start + 1, start + chunk_chars)
+            if cut < 0:
+                cut = start + chunk_chars
+            chunks.append(Chunk(start, text[start:cut]))
+            start = cut + 1 if text[cut] == ' ' else cut
+    if end > start:
+        chunks.append(Chunk(start, text[start:end]))
+    return chunks
+
+class BM25Index:
+    """Okapi BM25 over the chunks of one document.
+
+    Postings are built once at upload; a search only touches the postings of
+    the query terms.
+    """
+
+    def __init__(self, chunks: List[Chunk], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = array('I')
+        for chunk_id, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk.text))
+            lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self._postings[term].append((chunk_id, frequency))
+
+        average_length = (sum(lengths) / len(lengths)) if lengths else 0
+        # Length normalization depends only on the chunk, so it is folded in up front
+        self._norms = [k1 * (1 - b + b * length / average_length) if average_length else k1 for length in lengths]
+        self._idf = {
+            term: math.log(1 + (len(chunks) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, query: str, k: int) -> List[Tuple[Chunk, float]]:
+        """Best k chunks for the query with their scores, best first"""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, frequency in self._postings[term]:
+                scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + self._norms[chunk_id])
+        best = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+        return [(self.chunks[chunk_id], score) for chunk_id, score in best]
+
+class EmbeddingBackend(ABC):
+    """Turns texts into L2-normalized float32 vectors; swap in a real model by subclassing"""
+
+    name = 'embedding'
+    dimensions = EMBEDDING_DIMENSIONS
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> 'np.ndarray':
+        """Return one row per text"""
+
+@lru_cache(maxsize=65536)
+def _token_features(token: str, dimensions: int) -> Tuple[Tuple[int, ...], Tuple[float, ...]]:
+    features = ['w:' + token]
+    padded = f' {token} '
+    for size in NGRAM_SIZES:
+        features.extend(padded[index:index + size] for index in range(len(padded) - size + 1))
+    hashes = [zlib.crc32(feature.encode()) for feature in features]
+    # One hash bit picks the sign so colliding features tend to cancel out rather than add up
+    return (tuple(value % dimensions for value in hashes),
+            tuple(1.0 if value & 0x80000000 else -1.0 for value in hashes))
+
+class HashedNgramEmbedding(EmbeddingBackend):
+    """Deterministic offline embedding from hashed word and character n-gram features.
+
+    Character n-grams match inflections such as 'terminate' and 'termination';
+    CONCEPT_SYNONYMS adds the contract term behind common everyday words.
+    """
+
+    name = 'hashed_ngram'
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed(self, texts: List[str]) -> 'np.ndarray':
+        rows: List[int] = []
+        columns: List[int] = []
+        values: List[float] = []
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                for word in (token, CONCEPT_SYNONYMS.get(token)):
+                    if word is None:
+                        continue
+                    indices, signs = _token_features(word, self.dimensions)
+                    rows.extend([row] * len(indices))
+                    columns.extend(indices)
+                    values.extend(signs)
+
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(vectors, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)),
+                  np.asarray(values, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+class DenseIndex:
+    """Chunk vectors of one document in a single contiguous float32 matrix.
+
+    Search is one matrix-vector product plus a partial sort. Matrices larger than
+    DENSE_MMAP_BYTES are written to an anonymous memory-mapped temp file. vectors
+    takes chunk embeddings computed elsewhere, such as by a batch embedding job.
+    """
+
+    def __init__(self, chunks: List[Chunk], backend: EmbeddingBackend, vectors: Optional['np.ndarray'] = None):
+        self.chunks = chunks
+        self.backend = backend
+        shape = (len(chunks), backend.dimensions)
+        if len(chunks) * backend.dimensions * 4 > DENSE_MMAP_BYTES:
+            self._file = tempfile.TemporaryFile()
+            self.matrix = np.memmap(self._file, dtype=np.float32, mode='w+', shape=shape)
+        else:
+            self._file = None
+            self.matrix = np.empty(shape, dtype=np.float32)
+        if vectors is not None:
+            self.matrix[:] = vectors
+            return
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            batch = chunks[start:start + EMBED_BATCH_SIZE]
+            self.matrix[start:start + len(batch)] = backend.embed([chunk.text for chunk in batch])
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def memory_mapped(self) -> bool:
+        return self._file is not None
+
+    def search(self, query: str, k: int) -> List[Tuple[Chunk, float]]:
+        """Best k chunks by cosine similarity to the query, best first"""
+        if not self.chunks:
+            return []
+        scores = self.matrix @ self.backend.embed([query])[0]
+        if k < len(scores):
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return [(self.chunks[chunk_id], float(scores[chunk_id])) for chunk_id in best if scores[chunk_id] > 0]
+
+class DocumentRetriever:
+    """Keyword and, when NumPy is available, dense retrieval over one document's chunks"""
+
+    def __init__(self, text: str, backend: Optional[EmbeddingBackend] = None):
+        self.chunks = chunk_text(text)
+        self.keyword_index = BM25Index(self.chunks)
+        self.dense_index: Optional[DenseIndex] = None
+        if NUMPY_AVAILABLE:
+            self.dense_index = DenseIndex(self.chunks, backend or HashedNgramEmbedding())
+
+    def search(self, query: str, k: int) -> List[Chunk]:
+        """Top k chunks, merging the keyword and dense rankings by reciprocal rank fusion"""
+        rankings = [self.keyword_index.search(query, k)]
+        if self.dense_index is not None:
+            rankings.append(self.dense_index.search(query, k))
+        fused: Dict[Chunk, float] = defaultdict(float)
+        for ranking in rankings:
+            for rank, (chunk, _) in enumerate(ranking):
+                fused[chunk] += 1 / (RRF_K + rank)
+        return heapq.nlargest(k, fused, key=fused.__getitem__)
+
+    def context(self, query: str, k: int) -> str:
+        """Top k chunks for the query in document order, or the opening chunks when nothing matches"""
+        chunks = self.search(query, k) or self.chunks[:k]
+        return "\n[...]\n".join(chunk.text for chunk in sorted(chunks))
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The services are flat modules run from flask_code; make them importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep extracted test documents out of the shared on-disk text cache
+os.environ.setdefault('TEXT_CACHE_DB', '')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Analysis service test client with an empty result cache and the rules-based engine"""
+    import nego
+    from analysis_cache import ContentCache
+
+    monkeypatch.setattr(nego, 'analysis_cache', ContentCache(max_entries=8))
+    monkeypatch.setattr(nego, '_vertex_ai_available', False)
+    return nego.app.test_client()
@@ -0,0 +1,44 @@
+import threading
+import time
+from io import BytesIO
+from typing import List
+
+import PyPDF2
+
+from document_processors import DOCUMENT_AI_PAGE_LIMIT, DocumentProcessor
+
+
+class FakeDocumentProcessor(DocumentProcessor):
+    """Local stand-in for Document AI that enforces the page limit and simulates latency.
+
+    Text comes from PyPDF2. Calls and the highest number of concurrent calls are
+    counted so sharding can be checked without a Google Cloud project.
+    """
+
+    name = 'fake'
+
+    def __init__(self, page_limit: int = DOCUMENT_AI_PAGE_LIMIT, latency: float = 0.0):
+        self.page_limit = page_limit
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def process(self, file_content: bytes, mime_type: str) -> List[str]:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if mime_type != 'application/pdf':
+                raise ValueError(f"Fake processor only handles PDF, got {mime_type}")
+            pages = PyPDF2.PdfReader(BytesIO(file_content)).pages
+            if len(pages) > self.page_limit:
+                raise ValueError(f"Document has {len(pages)} pages, limit is {self.page_limit}")
+            return [page.extract_text() for page in pages]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
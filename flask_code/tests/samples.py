@@ -0,0 +1,118 @@
+"""Synthetic contracts and the pre-optimization extractors, shared by the tests and bench.py.
+
+Only the standard library, PyPDF2 and python-docx are imported, so the tests do
+not pull in the services, Vertex AI or NumPy through these helpers.
+"""
+import re
+from io import BytesIO
+from typing import Any, Dict, List, Sequence
+
+import docx
+import PyPDF2
+
+SAMPLE_CLAUSES = [
+    "This Services Agreement is entered into between Acme Holdings LLC and Beta Supplies Inc.",
+    "The Client shall pay a monthly fee of $4,500.00 within thirty days of invoice.",
+    "Either party shall provide the services described in Schedule A in a professional manner.",
+    "The Provider may terminate this agreement without cause at any time upon notice.",
+    "This agreement will automatically renew for successive one year terms unless cancelled.",
+    "All disputes shall be resolved through binding arbitration in the State of Delaware.",
+    "The Client agrees to indemnify and hold harmless the Provider from any and all claims.",
+    "All deposits and fees paid in advance are non-refundable under any circumstance.",
+    "Liquidated damages of $25,000 shall be payable upon any material breach.",
+    "The parties agree that confidential information shall remain protected for five years.",
+    "This agreement is governed by the laws of the State of New York effective January 1, 2024.",
+]
+
+FILLER_SENTENCE = "The parties acknowledge the recitals above and the definitions set out in Section 1 of this document. "
+
+
+def make_contract(target_chars: int, risky: bool = True) -> str:
+    """Build a synthetic contract of roughly target_chars characters"""
+    parts: List[str] = []
+    length = 0
+    clauses = SAMPLE_CLAUSES if risky else SAMPLE_CLAUSES[:3]
+    index = 0
+    while length < target_chars:
+        sentence = clauses[index % len(clauses)] + " " if index % 4 == 0 else FILLER_SENTENCE
+        if index % 12 == 11:
+            sentence += "\n"
+        parts.append(sentence)
+        length += len(sentence)
+        index += 1
+    return "".join(parts)
+
+
+def legacy_rule_hits(text: str, summary_text: str, risk_patterns: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """Per-pattern finditer loop the rules engine used before the combined scanner"""
+    full_text = f"{text}\n\n{summary_text}"
+    hits = {}
+    for risk_type, risk_data in risk_patterns.items():
+        for pattern in risk_data['patterns']:
+            matches = list(re.finditer(pattern, full_text, re.IGNORECASE | re.MULTILINE))
+            if matches and risk_type not in hits:
+                hits[risk_type] = matches[0].start()
+    return hits
+
+
+def make_pdf(page_count: int, lines_per_page: int = 45, scanned_pages: Sequence[int] = ()) -> bytes:
+    """Build a PDF with page_count pages of contract-like lines; scanned_pages have no text layer"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for page_num in range(page_count):
+        lines = []
+        for line_num in range(0 if page_num in scanned_pages else lines_per_page):
+            sentence = SAMPLE_CLAUSES[(page_num + line_num) % len(SAMPLE_CLAUSES)]
+            lines.append(f"({sentence.replace('(', '').replace(')', '')}) Tj 0 -14 Td")
+        stream = ("BT /F1 10 Tf 40 780 Td " + " ".join(lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref)
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % page_count
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def legacy_pdf_text(file_content: bytes) -> str:
+    """Single-core page loop with string concatenation used before page-parallel extraction"""
+    text = ""
+    pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
+    for page_num, page in enumerate(pdf_reader.pages):
+        page_text = page.extract_text()
+        text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
+    return text
+
+
+def make_large_docx(paragraphs: int) -> bytes:
+    """DOCX with many paragraphs and a fee table every 50 paragraphs"""
+    document = docx.Document()
+    for index in range(paragraphs):
+        document.add_paragraph(SAMPLE_CLAUSES[index % len(SAMPLE_CLAUSES)])
+        if index % 50 == 49:
+            table = document.add_table(rows=3, cols=3)
+            for row in range(3):
+                for column in range(3):
+                    table.cell(row, column).text = f"Fee {row}.{column}: ${(row + 1) * 100 * (column + 1):,}"
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def python_docx_text(file_content: bytes) -> str:
+    """Object-model extraction used before the streaming reader; tables are dropped"""
+    document = docx.Document(BytesIO(file_content))
+    return "".join(paragraph.text + "\n" for paragraph in document.paragraphs)
@@ -0,0 +1,32 @@
+"""Tasks the sandbox tests run in worker processes; kept light so workers start quickly"""
+import os
+import time
+
+import pdf_extraction
+
+
+def extract_with_page_pool(file_content, processes):
+    pages = pdf_extraction.extract_pdf_pages(file_content, processes)
+    pool_pids = sorted(pid for pool in pdf_extraction._page_pools.values() for pid in pool._processes)
+    return len(pages), os.getpid(), pool_pids
+
+
+def describe_buffer(file_content):
+    return type(file_content).__name__, bytes(file_content[:8])
+
+
+def sleep_for(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def allocate(megabytes):
+    return len(bytearray(megabytes * 1024 * 1024))
+
+
+def exit_abruptly():
+    os._exit(3)
+
+
+def fail():
+    raise ValueError("malformed document")
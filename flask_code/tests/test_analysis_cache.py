@@ -0,0 +1,110 @@
+import os
+import stat
+import subprocess
+import sys
+
+import pytest
+
+import document_extraction
+import nego
+from analysis_cache import ContentCache, content_digest
+from samples import make_pdf
+
+
+def pdf_upload(filename="contract.pdf"):
+    content = make_pdf(2)
+    return {
+        'filename': filename,
+        'content': content,
+        'digest': content_digest(content),
+        'size': len(content),
+        'mime_type': 'application/pdf',
+        'pipeline_mode': 'sequential'
+    }
+
+
+class FailingModel:
+    def __init__(self, model_name):
+        pass
+
+    def generate_content(self, *args, **kwargs):
+        raise RuntimeError("quota exceeded")
+
+
+@pytest.fixture
+def analysis_cache(monkeypatch):
+    cache = ContentCache(max_entries=8)
+    monkeypatch.setattr(nego, 'analysis_cache', cache)
+    return cache
+
+
+def test_disk_store_is_private_to_the_owner(tmp_path):
+    db_path = tmp_path / 'cache' / 'text.db'
+    cache = ContentCache(max_entries=2, db_path=str(db_path))
+    cache.put('key', {'text': 'confidential contract text'})
+    assert stat.S_IMODE(os.stat(db_path.parent).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(db_path).st_mode) == 0o600
+    assert ContentCache(max_entries=2, db_path=str(db_path)).get('key') == {'text': 'confidential contract text'}
+
+
+def test_text_cache_is_memory_only_unless_configured():
+    env = {name: value for name, value in os.environ.items() if name != 'TEXT_CACHE_DB'}
+    code = "import document_extraction; print(document_extraction.create_document_extractor(1).cache.db_path)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(document_extraction.__file__),
+                            env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'None'
+
+
+def test_rule_based_results_are_cached_without_vertex(analysis_cache, monkeypatch):
+    monkeypatch.setattr(nego, '_vertex_ai_available', False)
+    upload = pdf_upload()
+    response, status = nego.analyze_upload(upload)
+    assert status == 200
+    assert response["processing_info"]["summarization_method"] == "fallback"
+    assert response["processing_info"]["risk_analysis_method"] == "rules_based"
+
+    cached, status = nego.analyze_upload(pdf_upload("renamed.pdf"))
+    assert cached["processing_info"]["cache_hit"] is True
+    assert cached["document_info"]["filename"] == "renamed.pdf"
+
+
+def test_fallback_after_vertex_failure_is_not_cached(analysis_cache, monkeypatch):
+    monkeypatch.setattr(nego, '_vertex_ai_available', True)
+    monkeypatch.setattr(nego, 'GenerativeModel', FailingModel)
+    upload = pdf_upload()
+    response, status = nego.analyze_upload(upload)
+    assert status == 200
+    assert response["processing_info"]["summarization_method"] == "fallback"
+    assert response["processing_info"]["risk_analysis_method"] == "rules_based"
+    assert analysis_cache.get(nego.analysis_cache_key(upload)) is None
+
+    again, _ = nego.analyze_upload(upload)
+    assert again["processing_info"]["cache_hit"] is False
+
+
+def test_streamed_fallback_is_not_cached(analysis_cache, monkeypatch):
+    monkeypatch.setattr(nego, '_vertex_ai_available', True)
+    monkeypatch.setattr(nego, 'GenerativeModel', FailingModel)
+    upload = pdf_upload()
+    events = list(nego.generate_analysis_events(upload, 'ndjson'))
+    assert '"event": "complete"' in events[-1]
+    assert analysis_cache.get(nego.analysis_cache_key(upload)) is None
+
+
+class FailingProcessor:
+    name = 'document_ai'
+
+    def process_scanned_pages(self, *args, **kwargs):
+        raise RuntimeError("processor unavailable")
+
+    def process(self, *args, **kwargs):
+        raise RuntimeError("processor unavailable")
+
+
+def test_fallback_after_document_ai_failure_is_not_cached(analysis_cache, monkeypatch):
+    monkeypatch.setattr(nego, '_document_processor', FailingProcessor())
+    upload = pdf_upload()
+    response, status = nego.analyze_upload(upload)
+    assert status == 200
+    assert response["processing_info"]["extraction_method"] == "fallback"
+    assert analysis_cache.get(nego.analysis_cache_key(upload)) is None
@@ -0,0 +1,78 @@
+import json
+from io import BytesIO
+
+import nego
+from event_stream import format_stream_event, requested_stream_format
+from samples import make_pdf
+
+EVENT_ORDER = ['started', 'document_info', 'key_information', 'rules_risks', 'summary', 'risk_analysis',
+               'complete']
+
+
+def post_stream(client, content, query='', headers=None):
+    return client.post(f'/analyze-document/stream{query}', data={'document': (BytesIO(content), 'contract.pdf')},
+                       content_type='multipart/form-data', headers=headers or {})
+
+
+def parse_ndjson(body):
+    return [json.loads(line) for line in body.splitlines() if line]
+
+
+def parse_sse(body):
+    events = []
+    for message in body.split('\n\n'):
+        if not message:
+            continue
+        fields = dict(line.split(': ', 1) for line in message.split('\n'))
+        events.append({'event': fields['event'], 'data': json.loads(fields['data'])})
+    return events
+
+
+def test_ndjson_stream_sends_each_section_then_the_full_response(client):
+    response = post_stream(client, make_pdf(3), '?format=ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    events = parse_ndjson(response.get_data(as_text=True))
+    names = [event['event'] for event in events]
+    assert names[:4] == EVENT_ORDER[:4]
+    assert sorted(names[4:6]) == sorted(EVENT_ORDER[4:6])
+    assert names[-1] == 'complete'
+    complete = events[-1]['data']
+    assert complete['document_info']['contract_type'] == events[1]['data']['contract_type']
+    assert complete['extraction']['entities'] == events[2]['data']['entities']
+    assert complete['processing_info']['cache_hit'] is False
+
+
+def test_sse_is_chosen_from_the_accept_header(client):
+    response = post_stream(client, make_pdf(3), headers={'Accept': 'text/event-stream'})
+    assert response.mimetype == 'text/event-stream'
+    events = parse_sse(response.get_data(as_text=True))
+    assert [event['event'] for event in events][0] == 'started'
+    assert events[-1]['event'] == 'complete'
+
+
+def test_second_stream_replays_the_cached_analysis(client):
+    content = make_pdf(3)
+    first = parse_ndjson(post_stream(client, content).get_data(as_text=True))[-1]['data']
+    events = parse_ndjson(post_stream(client, content).get_data(as_text=True))
+    assert 'rules_risks' not in [event['event'] for event in events]
+    assert events[-1]['data']['risk_analysis'] == first['risk_analysis']
+
+
+def test_unreadable_document_ends_the_stream_with_an_error(client):
+    events = parse_ndjson(post_stream(client, b'%PDF-1.4 not really a pdf').get_data(as_text=True))
+    assert events[0]['event'] == 'started'
+    assert events[-1]['event'] == 'error'
+
+
+def test_unknown_format_is_rejected(client):
+    assert post_stream(client, make_pdf(1), '?format=xml').status_code == 400
+
+
+def test_format_helpers():
+    assert requested_stream_format(None, 'text/event-stream') == 'sse'
+    assert requested_stream_format(None, '*/*') == 'ndjson'
+    assert requested_stream_format('ndjson', 'text/event-stream') == 'ndjson'
+    assert format_stream_event('summary', {'a': 1}, 'sse') == 'event: summary\ndata: {"a": 1}\n\n'
+    assert json.loads(format_stream_event('summary', {'a': 1}, 'ndjson')) == {'event': 'summary', 'data': {'a': 1}}
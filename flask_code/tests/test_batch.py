@@ -0,0 +1,61 @@
+import zipfile
+from io import BytesIO
+
+import nego
+from samples import make_pdf
+
+
+def build_archive(members):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for info, content in members:
+            archive.writestr(info, content)
+    return buffer.getvalue()
+
+
+def post_batch(client, archive):
+    return client.post('/analyze-batch', data={'documents': (BytesIO(archive), 'pack.zip')},
+                       content_type='multipart/form-data')
+
+
+def documents_by_name(response):
+    return {document['filename']: document for document in response.get_json()['documents']}
+
+
+def test_corrupt_member_is_reported_per_item(client):
+    pdf = make_pdf(2)
+    archive = bytearray(build_archive([('good.pdf', pdf), ('bad.pdf', pdf)]))
+    # Flip a byte inside the second member's data so its CRC check fails
+    second = archive.rindex(b'%PDF')
+    archive[second + 20] ^= 0xFF
+    response = post_batch(client, bytes(archive))
+    assert response.status_code == 200
+    documents = documents_by_name(response)
+    assert documents['good.pdf']['status'] == 'success'
+    assert documents['bad.pdf']['status'] == 'error'
+    assert 'Unreadable ZIP member' in documents['bad.pdf']['error']['message']
+
+
+def test_encrypted_member_is_reported_per_item(client):
+    encrypted = zipfile.ZipInfo('secret.pdf')
+    encrypted.flag_bits |= 0x1
+    archive = build_archive([('good.pdf', make_pdf(2)), (encrypted, b'not really encrypted')])
+    response = post_batch(client, archive)
+    assert response.status_code == 200
+    documents = documents_by_name(response)
+    assert documents['good.pdf']['status'] == 'success'
+    assert documents['secret.pdf']['status'] == 'error'
+
+
+def test_invalid_archive_is_reported_per_item(client):
+    response = post_batch(client, b'PK not a zip')
+    assert response.status_code == 200
+    assert documents_by_name(response)['pack.zip']['error']['message'] == 'Invalid ZIP archive'
+
+
+def test_invalid_pipeline_mode_is_rejected_by_single_and_batch_uploads(client):
+    for route, field in [('/analyze-document', 'document'), ('/analyze-batch', 'documents')]:
+        response = client.post(route, data={field: (BytesIO(make_pdf(1)), 'contract.pdf'), 'pipeline': 'parallel'},
+                               content_type='multipart/form-data')
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Invalid pipeline mode'
@@ -0,0 +1,238 @@
+import json
+import time
+from io import BytesIO
+
+import pytest
+
+import chatbot
+from samples import make_contract, make_pdf
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(chatbot, 'CHAT_MODEL', 'fake')
+    monkeypatch.setattr(chatbot, 'CONTEXT_CACHING', False)
+    monkeypatch.setattr(chatbot, 'document_contexts', {})
+    chatbot.get_chat_model.cache_clear()
+    yield chatbot.app.test_client()
+    chatbot.get_chat_model.cache_clear()
+
+
+def upload(client, content, filename='contract.pdf'):
+    response = client.post('/upload-document', data={'document': (BytesIO(content), filename)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def wait_for_index(document_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not chatbot.document_store[document_id]['index_complete']:
+        assert time.monotonic() < deadline, "full-text index was not built in time"
+        time.sleep(0.05)
+    return chatbot.document_store[document_id]
+
+
+def test_long_document_index_covers_every_page(client):
+    result = upload(client, make_pdf(120))
+    info = result['document_info']
+    assert info['text_complete'] is False
+    assert info['full_text_indexing'] is True
+    assert info['text_length'] == chatbot.MAX_DOC_CHARS
+
+    document = wait_for_index(result['document_id'])
+    # The prompt keeps the budget; the index, quote pages and normalized text cover the whole document
+    assert len(document['text']) <= chatbot.MAX_DOC_CHARS
+    assert document['indexed_length'] > chatbot.MAX_DOC_CHARS
+    assert document['page_index'].page_count == 120
+    chunks = document['retriever'].chunks
+    assert chunks[-1].start > chatbot.MAX_DOC_CHARS
+    assert chunks[-1].start + len(chunks[-1].text) == len(document['normalized'].text)
+
+
+def test_chat_turns_retrieve_from_the_full_index(client):
+    late_clause = "Disputes shall be settled by arbitration seated in Zanzibar under maritime rules."
+    text = make_contract(3 * chatbot.MAX_DOC_CHARS) + "\n" + late_clause + "\n"
+    result = upload(client, text.encode('utf-8'), 'contract.txt')
+    # The session's chatbot is built before the full index is ready and must pick it up afterwards
+    client.post('/chat', json={'session_id': result['session_id'], 'message': 'Hello'})
+    wait_for_index(result['document_id'])
+    response = client.post('/chat', json={'session_id': result['session_id'],
+                                          'message': 'Where is arbitration seated according to this document?'})
+    assert response.status_code == 200
+    assert late_clause in chatbot.get_chat_model().prompts[-1]
+
+
+def test_short_documents_are_not_reindexed(client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(chatbot.full_text_index_executor, 'submit', lambda *args: submitted.append(args))
+    result = upload(client, make_pdf(2))
+    assert result['document_info']['text_complete'] is True
+    assert result['document_info']['full_text_indexing'] is False
+    assert chatbot.document_store[result['document_id']]['index_complete'] is True
+    assert submitted == []
+
+
+def test_failed_full_extraction_keeps_the_prefix_index(client, monkeypatch):
+    result = upload(client, make_pdf(120))
+    wait_for_index(result['document_id'])
+    document = chatbot.document_store[result['document_id']]
+    retriever = document['retriever']
+
+    def failing_extract(*args):
+        raise chatbot.ExtractionError("worker crashed")
+
+    monkeypatch.setattr(chatbot.document_extractor, 'extract', failing_extract)
+    chatbot.index_full_text(result['document_id'], b'', 'application/pdf', 'digest')
+    assert document['retriever'] is retriever
+
+
+def start_session(client, text='The Client shall pay the fee within thirty days of each invoice.\n' * 20):
+    return upload(client, text.encode('utf-8'), 'contract.txt')['session_id']
+
+
+def chat(client, session_id, message):
+    response = client.post('/chat', json={'session_id': session_id, 'message': message})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_session_reuses_its_chatbot_and_prompt_prefix(client):
+    session_id = start_session(client)
+    chat(client, session_id, 'When is the fee due under this contract?')
+    bot = chatbot.session_chatbots[session_id]
+    chat(client, session_id, 'What happens if I pay the invoice late?')
+    assert chatbot.session_chatbots[session_id] is bot
+    assert bot.model is chatbot.get_chat_model()
+    first, second = chatbot.get_chat_model().prompts[-2:]
+    assert first.startswith(bot.document_prefix) and second.startswith(bot.document_prefix)
+
+
+def test_deleting_a_session_drops_its_chatbot(client):
+    session_id = start_session(client)
+    chat(client, session_id, 'When is the fee due under this contract?')
+    assert client.delete(f'/session/{session_id}').status_code == 200
+    assert session_id not in chatbot.session_chatbots
+
+
+def stream_chat(client, session_id, message, **kwargs):
+    response = client.post('/chat/stream', json={'session_id': session_id, 'message': message}, **kwargs)
+    assert response.status_code == 200
+    return response
+
+
+def test_chat_stream_sends_deltas_then_the_stored_reply(client):
+    session_id = start_session(client)
+    response = stream_chat(client, session_id, 'When is the fee due under this contract?')
+    assert response.mimetype == 'application/x-ndjson'
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    names = [event['event'] for event in events]
+    assert names[0] == 'started' and names[-1] == 'complete'
+    deltas = [event['data']['text'] for event in events if event['event'] == 'delta']
+    assert len(deltas) > 1
+    reply = events[-1]['data']['ai_response']
+    assert reply['content'] == ''.join(deltas).strip() == chatbot.get_chat_model().answer
+    assert chatbot.chat_sessions[session_id].messages[-1] == reply
+
+
+def test_chat_stream_as_sse(client):
+    session_id = start_session(client)
+    body = stream_chat(client, session_id, 'When is the fee due?', headers={'Accept': 'text/event-stream'})
+    assert body.mimetype == 'text/event-stream'
+    text = body.get_data(as_text=True)
+    assert text.startswith('event: started\n') and 'event: complete\n' in text
+
+
+def test_model_failure_mid_stream_keeps_the_partial_reply(client, monkeypatch):
+    session_id = start_session(client)
+
+    def failing_stream(prompt, context=None):
+        yield 'Partial '
+        raise RuntimeError('connection reset')
+
+    monkeypatch.setattr(chatbot.get_chat_model(), 'stream', failing_stream)
+    events = [json.loads(line) for line in
+              stream_chat(client, session_id, 'When is the fee due?').get_data(as_text=True).splitlines()]
+    assert events[-1]['event'] == 'error'
+    stored = chatbot.chat_sessions[session_id].messages[-1]
+    assert stored['content'] == 'Partial' and stored['metadata']['incomplete'] is True
+
+
+def test_chat_stream_rejects_unknown_sessions_and_formats(client):
+    assert client.post('/chat/stream', json={'session_id': 'missing', 'message': 'hi'}).status_code == 404
+    session_id = start_session(client)
+    assert client.post('/chat/stream?format=xml', json={'session_id': session_id, 'message': 'hi'}).status_code == 400
+
+
+def start_cached_session(client, monkeypatch):
+    monkeypatch.setattr(chatbot, 'CONTEXT_CACHING', True)
+    result = upload(client, make_contract(2 * chatbot.CONTEXT_CACHE_MIN_CHARS).encode('utf-8'), 'contract.txt')
+    assert result['document_info']['context_cached'] is True
+    return result['session_id'], chatbot.document_store[result['document_id']]
+
+
+def test_cached_document_turns_send_only_the_turn_suffix(client, monkeypatch):
+    session_id, document = start_cached_session(client, monkeypatch)
+    model = chatbot.get_chat_model()
+    prefix = model.context_prefixes[document['context'].name]
+    assert prefix.endswith(chatbot.DOCUMENT_TEXT_PROMPT.format(document_text=document['text']))
+    chat(client, session_id, 'When is the fee due under this contract?')
+    chat(client, session_id, 'What does this contract say about termination?')
+    for prompt in model.prompts[-2:]:
+        assert document['text'][:200] not in prompt
+        assert not prompt.startswith(chatbot.session_chatbots[session_id].document_prefix)
+
+
+def test_short_documents_are_sent_inline(client, monkeypatch):
+    monkeypatch.setattr(chatbot, 'CONTEXT_CACHING', True)
+    result = upload(client, b'The Client shall pay the fee within thirty days.\n' * 5, 'contract.txt')
+    assert result['document_info']['context_cached'] is False
+    assert chatbot.get_chat_model().contexts == {}
+
+
+def test_expired_context_is_cached_again(client, monkeypatch):
+    session_id, document = start_cached_session(client, monkeypatch)
+    expired = document['context']._replace(expires_at=time.time())
+    document['context'] = chatbot.document_contexts[expired.digest] = expired
+    chat(client, session_id, 'When is the fee due under this contract?')
+    bot = chatbot.session_chatbots[session_id]
+    assert bot.context.name != expired.name and not bot.context.expired()
+    assert document['context'] == bot.context
+    assert not chatbot.get_chat_model().prompts[-1].startswith(bot.document_prefix)
+
+
+def test_reuploads_share_one_cached_context(client, monkeypatch):
+    first_session, first = start_cached_session(client, monkeypatch)
+    second_session, second = start_cached_session(client, monkeypatch)
+    model = chatbot.get_chat_model()
+    assert first['context'] == second['context']
+    assert list(model.contexts) == [first['context'].name]
+
+    assert client.delete(f'/session/{first_session}').status_code == 200
+    assert first['id'] not in chatbot.document_store
+    assert list(model.contexts) == [second['context'].name]
+    assert client.delete(f'/session/{second_session}').status_code == 200
+    assert model.contexts == {}
+    assert chatbot.document_contexts == {}
+
+
+def test_cached_turns_quote_text_past_the_cached_prefix(client, monkeypatch):
+    monkeypatch.setattr(chatbot, 'CONTEXT_CACHING', True)
+    late_clause = "Disputes shall be settled by arbitration seated in Zanzibar under maritime rules."
+    text = make_contract(3 * chatbot.MAX_DOC_CHARS) + "\n" + late_clause + "\n"
+    result = upload(client, text.encode('utf-8'), 'contract.txt')
+    assert result['document_info']['context_cached'] is True
+    wait_for_index(result['document_id'])
+    chat(client, result['session_id'], 'Where is arbitration seated according to this document?')
+    prompt = chatbot.get_chat_model().prompts[-1]
+    assert late_clause in prompt
+    assert prompt.startswith("RELEVANT EXCERPTS FROM LATER IN THE DOCUMENT")
+
+
+def test_rejected_context_is_dropped_and_the_turn_retried_inline(client, monkeypatch):
+    session_id, document = start_cached_session(client, monkeypatch)
+    # The service lost the context before it expired
+    chatbot.get_chat_model().contexts.clear()
+    reply = chat(client, session_id, 'When is the fee due under this contract?')['ai_response']['content']
+    assert reply == chatbot.get_chat_model().answer
+    assert chatbot.session_chatbots[session_id].context is None
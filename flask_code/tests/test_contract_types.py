@@ -0,0 +1,46 @@
+import pytest
+
+import nego
+from contract_types import detect_contract_type, ranked_contract_types, score_contract_types, token_counts
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("The Employee shall receive a salary. Employment begins on the start date.", "employment"),
+    ("The Tenant shall pay rent to the Landlord for the premises under this lease.", "rental"),
+    ("Licensor grants Licensee a SaaS software license with 99.9% uptime.", "software"),
+    ("The Seller shall deliver the goods to the Buyer after purchase.", "sales"),
+    ("Consultant will provide consulting services and deliverables.", "service"),
+])
+def test_detects_the_contract_type(text, expected):
+    assert detect_contract_type(text) == expected
+
+
+def test_text_without_keywords_is_general():
+    assert detect_contract_type("Nothing relevant here at all.") == "general"
+    assert ranked_contract_types(score_contract_types("")) == ["general"]
+
+
+def test_repeated_keywords_are_damped():
+    # One keyword repeated many times must not outweigh several distinct signals
+    text = "software " * 20 + "employee employer employment salary wages severance"
+    scores = score_contract_types(text)
+    assert scores["software"] < 3.0 * 20
+    assert ranked_contract_types(scores)[0] == "employment"
+
+
+def test_close_runner_up_types_are_kept():
+    scores = {"employment": 10.0, "software": 9.0, "rental": 2.0}
+    assert ranked_contract_types(scores) == ["employment", "software"]
+
+
+def test_tokenization_is_cached_per_text():
+    text = "The Tenant pays rent to the Landlord."
+    assert token_counts(text) is token_counts(text)
+
+
+def test_nego_detection_returns_scores_and_secondary_types():
+    scores, contract_type, secondary = nego.detect_contract_types(
+        "The Employee writes software for the Employer under this employment agreement; software license applies.")
+    assert contract_type in scores
+    assert contract_type not in secondary
+    assert all(scores[other] >= scores[contract_type] * 0.8 for other in secondary)
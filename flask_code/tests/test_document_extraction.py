@@ -0,0 +1,74 @@
+import pytest
+
+import nego
+from analysis_cache import ContentCache, content_digest
+from document_extraction import DocumentExtractor, extract_local_prefix
+from extraction_sandbox import ExtractionSandbox
+from lazy_extraction import LazyDocumentText
+from pdf_extraction import extract_pdf_pages, format_pdf_pages
+from samples import make_pdf
+
+
+@pytest.fixture(scope='module')
+def long_pdf():
+    return make_pdf(120)
+
+
+@pytest.fixture
+def extractor():
+    sandbox = ExtractionSandbox(workers=1, preload=('document_extraction', 'pdf_extraction'))
+    yield DocumentExtractor(sandbox, ContentCache(max_entries=8))
+    sandbox.close()
+
+
+def test_prefix_parses_only_what_the_budget_needs(long_pdf):
+    document_text = LazyDocumentText(long_pdf, 'application/pdf')
+    prefix = document_text.prefix(5000)
+    assert len(prefix) == 5000
+    assert not document_text.complete
+    assert document_text.parsed_chars < 20000
+
+
+def test_full_text_matches_eager_extraction(long_pdf):
+    eager = format_pdf_pages(extract_pdf_pages(long_pdf, 1)).strip()
+    assert LazyDocumentText(long_pdf, 'application/pdf').full() == eager
+    assert extract_local_prefix(long_pdf, 'application/pdf', None) == (eager, True)
+    assert LazyDocumentText(long_pdf, 'application/pdf').prefix(3000) == eager[:3000]
+
+
+def test_unbudgeted_extract_is_not_served_from_a_prefix(extractor, long_pdf):
+    digest = content_digest(long_pdf)
+    prefix, complete = extractor.extract(long_pdf, 'application/pdf', 5000, digest)
+    assert not complete
+    assert extractor.cached_text(digest, 'application/pdf', None) is None
+
+    text, complete = extractor.extract(long_pdf, 'application/pdf', None, digest)
+    assert complete
+    assert text.startswith(prefix)
+    assert len(text) > nego.MAX_DOC_CHARS
+    # The whole document now serves every later request, budgeted or not
+    assert extractor.cached_text(digest, 'application/pdf', None) == (text, True)
+    assert extractor.cached_text(digest, 'application/pdf', 5000) == (prefix, False)
+
+
+def test_fallback_extraction_returns_the_whole_document(long_pdf):
+    text = nego.extract_text_fallback(long_pdf, 'application/pdf', content_digest(long_pdf))
+    assert len(text) > nego.MAX_DOC_CHARS
+    assert "--- Page 120 ---" in text
+
+
+def test_analysis_scans_past_the_prompt_budget(long_pdf, monkeypatch):
+    monkeypatch.setattr(nego, 'analysis_cache', ContentCache(max_entries=8))
+    monkeypatch.setattr(nego, '_vertex_ai_available', False)
+    upload = {
+        'filename': 'long.pdf',
+        'content': long_pdf,
+        'digest': content_digest(long_pdf),
+        'size': len(long_pdf),
+        'mime_type': 'application/pdf',
+        'pipeline_mode': 'sequential'
+    }
+    response, status = nego.analyze_upload(upload)
+    assert status == 200
+    assert response['document_info']['extracted_text_length'] > nego.MAX_DOC_CHARS
+    assert response['document_info']['page_count'] == 120
@@ -0,0 +1,137 @@
+import pytest
+from google.cloud import documentai
+
+import pdf_extraction
+from document_extraction import create_document_extractor
+from document_processors import DocumentAIProcessor, ShardedDocumentProcessor, page_needs_ocr, page_runs
+from extraction_sandbox import ExtractionError
+from fakes import FakeDocumentProcessor
+from page_index import PageIndex
+from samples import make_pdf
+
+
+class RecordingRunner:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, func, *args):
+        self.calls.append(func.__name__)
+        return func(*args)
+
+
+@pytest.fixture(scope='module')
+def sandbox():
+    extractor = create_document_extractor(1)
+    yield extractor.sandbox
+    extractor.sandbox.close()
+
+
+def test_page_runs_split_at_gaps_and_limit():
+    assert page_runs([0, 1, 2, 5, 6, 9], 2) == [(0, 2), (2, 3), (5, 7), (9, 10)]
+
+
+def test_sharding_parses_the_upload_through_run():
+    runner = RecordingRunner()
+    processor = FakeDocumentProcessor()
+    sharded = ShardedDocumentProcessor(processor, pages_per_shard=5, run=runner)
+    text = sharded.process(make_pdf(12), 'application/pdf')
+    assert runner.calls == ['pdf_page_count', 'split_pdf']
+    assert processor.calls == 3
+    assert text.strip()
+
+
+def test_page_routing_splits_through_run():
+    runner = RecordingRunner()
+    pdf = make_pdf(6, scanned_pages=[2, 3])
+    sharded = ShardedDocumentProcessor(FakeDocumentProcessor(), run=runner)
+    text = sharded.process_scanned_pages(pdf, pdf_extraction.extract_pdf_pages(pdf, 1))
+    assert runner.calls == ['split_pdf']
+    assert "--- Page 3 (OCR) ---" in text and "--- Page 4 (OCR) ---" in text
+
+
+def test_sandboxed_sharding_matches_in_process(sandbox):
+    pdf = make_pdf(12)
+    inline = ShardedDocumentProcessor(FakeDocumentProcessor(), pages_per_shard=5)
+    sandboxed = ShardedDocumentProcessor(FakeDocumentProcessor(), pages_per_shard=5, run=sandbox.run)
+    assert sandboxed.process(pdf, 'application/pdf') == inline.process(pdf, 'application/pdf')
+
+
+def test_malformed_pdf_fails_in_the_sandbox(sandbox):
+    sharded = ShardedDocumentProcessor(FakeDocumentProcessor(), run=sandbox.run)
+    with pytest.raises(ExtractionError):
+        sharded.process(b'%PDF-1.4 not really a pdf', 'application/pdf')
+
+
+def test_shards_run_concurrently_up_to_the_limit():
+    processor = FakeDocumentProcessor(page_limit=5, latency=0.05)
+    sharded = ShardedDocumentProcessor(processor, pages_per_shard=5, max_in_flight=2)
+    sharded.process(make_pdf(22), 'application/pdf')
+    assert processor.calls == 5
+    assert processor.max_in_flight == 2
+    assert sharded.stats()['pages_sent'] == 22
+
+
+def test_shard_text_stays_in_page_order():
+    pdf = make_pdf(12)
+    sharded = ShardedDocumentProcessor(FakeDocumentProcessor(page_limit=3, latency=0.01), pages_per_shard=3)
+    text = sharded.process(pdf, 'application/pdf')
+    assert text == pdf_extraction.format_pdf_pages(FakeDocumentProcessor().process(pdf, 'application/pdf'))
+    assert PageIndex.from_text(text).pages.tolist() == list(range(1, 13))
+
+
+def test_failed_shard_uses_the_fallback_text():
+    sharded = ShardedDocumentProcessor(FakeDocumentProcessor(page_limit=4), pages_per_shard=5)
+    text = sharded.process(make_pdf(10), 'application/pdf',
+                           on_shard_error=lambda start, end: [f"local {page_num}" for page_num in range(start, end)])
+    assert text == pdf_extraction.format_pdf_pages([f"local {page_num}" for page_num in range(10)])
+    with pytest.raises(ValueError):
+        sharded.process(make_pdf(10), 'application/pdf')
+
+
+def test_pages_without_a_text_layer_need_ocr():
+    assert page_needs_ocr(None)
+    assert page_needs_ocr(" \n 12 \n")
+    assert not page_needs_ocr("The Client shall pay the fee within thirty days of each invoice. " * 3)
+    assert page_needs_ocr("word " * 10, min_chars=50)
+
+
+def test_only_scanned_pages_are_sent_to_the_processor():
+    pdf = make_pdf(8, scanned_pages=[1, 5, 6])
+    processor = FakeDocumentProcessor()
+    sharded = ShardedDocumentProcessor(processor)
+    local_pages = pdf_extraction.extract_pdf_pages(pdf, 1)
+    text = sharded.process_scanned_pages(pdf, local_pages)
+    assert processor.calls == 2
+    assert sharded.stats()['pages_sent'] == 3 and sharded.stats()['pages_kept_local'] == 5
+    assert [marker for marker in text.splitlines() if "(OCR)" in marker] == [
+        "--- Page 2 (OCR) ---", "--- Page 6 (OCR) ---", "--- Page 7 (OCR) ---"]
+    assert f"--- Page 1 ---\n{local_pages[0]}\n" in text
+
+
+def test_failed_ocr_keeps_the_local_page_text():
+    pdf = make_pdf(4, scanned_pages=[2])
+    local_pages = pdf_extraction.extract_pdf_pages(pdf, 1)
+    text = ShardedDocumentProcessor(FakeDocumentProcessor(page_limit=0)).process_scanned_pages(pdf, local_pages)
+    assert text.count("--- Page") == 4
+    assert "--- Page 3 (OCR) ---" in text
+
+
+class StubDocumentAIClient:
+    def __init__(self, document):
+        self.document = document
+
+    def process_document(self, request):
+        return documentai.ProcessResponse(document=self.document)
+
+
+def test_document_ai_text_is_split_at_its_pages():
+    text = "The Client shall pay the fee.\nThe Provider may terminate.\n"
+    segment = documentai.Document.TextAnchor.TextSegment
+    pages = [documentai.Document.Page(layout=documentai.Document.Page.Layout(
+        text_anchor=documentai.Document.TextAnchor(text_segments=[segment(start_index=start, end_index=end)])))
+        for start, end in [(0, 30), (30, len(text))]]
+    processor = DocumentAIProcessor(StubDocumentAIClient(documentai.Document(text=text, pages=pages)), 'processor')
+    assert processor.process(b'%PDF', 'application/pdf') == ["The Client shall pay the fee.\n",
+                                                             "The Provider may terminate.\n"]
+    sharded = ShardedDocumentProcessor(processor, run=lambda func, *args: 2)
+    assert PageIndex.from_text(sharded.process(b'%PDF', 'application/pdf')).pages.tolist() == [1, 2]
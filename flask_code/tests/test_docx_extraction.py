@@ -0,0 +1,77 @@
+from io import BytesIO
+
+import docx
+
+from docx_extraction import iter_docx_lines
+from samples import SAMPLE_CLAUSES, make_large_docx, python_docx_text
+
+
+def build_docx(header=None, footer=None, second_section=False):
+    document = docx.Document()
+    document.add_paragraph("The Client shall pay the fee.")
+    table = document.add_table(rows=2, cols=2)
+    table.cell(0, 0).text, table.cell(0, 1).text = "Item", "Fee"
+    table.cell(1, 0).text, table.cell(1, 1).text = "Setup", "$500"
+    document.add_paragraph("Either party may terminate.")
+    if header:
+        document.sections[0].header.paragraphs[0].text = header
+    if footer:
+        document.sections[0].footer.paragraphs[0].text = footer
+    if second_section:
+        document.add_section()
+        # A section with its own header part repeating the same text
+        document.sections[1].header.is_linked_to_previous = False
+        document.sections[1].header.paragraphs[0].text = header
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def test_body_paragraphs_and_table_rows_in_document_order():
+    lines = [line for line in iter_docx_lines(build_docx()) if line]
+    assert lines == ["The Client shall pay the fee.", "Item | Fee", "Setup | $500", "Either party may terminate."]
+
+
+def test_headers_and_footers_are_labelled_and_deduplicated():
+    lines = list(iter_docx_lines(build_docx(header="ACME CONFIDENTIAL", footer="Page footer",
+                                            second_section=True)))
+    assert lines[:2] == ["--- Header ---", "ACME CONFIDENTIAL"]
+    assert lines.count("ACME CONFIDENTIAL") == 1
+    assert lines[-2:] == ["--- Footer ---", "Page footer"]
+
+
+def test_paragraph_text_matches_python_docx():
+    content = make_large_docx(120)
+    streamed = [line for line in iter_docx_lines(content) if " | " not in line]
+    assert streamed == python_docx_text(content).splitlines()
+    assert sum(" | " in line for line in iter_docx_lines(content)) == 2 * 3
+    assert streamed[0] == SAMPLE_CLAUSES[0]
+
+
+TEXT_BOX_RUN = (
+    '<w:r xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    ' xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+    ' xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"'
+    ' xmlns:v="urn:schemas-microsoft-com:vml">'
+    '<mc:AlternateContent><mc:Choice Requires="wps"><w:drawing><wps:txbx><w:txbxContent>'
+    '<w:p><w:r><w:t>Liability is capped at the fees paid.</w:t></w:r></w:p>'
+    '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Cap</w:t></w:r></w:p></w:tc>'
+    '<w:tc><w:p><w:r><w:t>$10,000</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+    '</w:txbxContent></wps:txbx></w:drawing></mc:Choice>'
+    '<mc:Fallback><w:pict><v:shape><v:textbox><w:txbxContent>'
+    '<w:p><w:r><w:t>Liability is capped at the fees paid.</w:t></w:r></w:p>'
+    '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Cap</w:t></w:r></w:p></w:tc>'
+    '<w:tc><w:p><w:r><w:t>$10,000</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+    '</w:txbxContent></v:textbox></v:shape></w:pict></mc:Fallback>'
+    '</mc:AlternateContent></w:r>'
+)
+
+
+def test_text_box_fallback_is_not_repeated():
+    document = docx.Document()
+    paragraph = document.add_paragraph("See the box.")
+    paragraph._p.append(docx.oxml.parse_xml(TEXT_BOX_RUN))
+    buffer = BytesIO()
+    document.save(buffer)
+    lines = [line for line in iter_docx_lines(buffer.getvalue()) if line]
+    assert lines == ["Liability is capped at the fees paid.", "Cap | $10,000", "See the box."]
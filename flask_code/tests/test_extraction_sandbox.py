@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+import pdf_extraction
+import sandbox_tasks
+from extraction_sandbox import ExtractionError, ExtractionSandbox, ExtractionTimeoutError
+from samples import make_pdf
+from sandbox_tasks import allocate, describe_buffer, exit_abruptly, extract_with_page_pool, fail, sleep_for
+from upload_handling import spool_buffer
+
+
+@pytest.fixture
+def sandbox():
+    sandbox = ExtractionSandbox(workers=1, timeout=30, memory_limit_mb=512, preload=[sandbox_tasks.__name__])
+    yield sandbox
+    sandbox.close()
+
+
+def test_sandboxed_pdf_extraction_uses_a_page_pool(sandbox):
+    page_count = max(pdf_extraction.PARALLEL_MIN_PAGES, 2) + 4
+    pdf = make_pdf(page_count)
+    pages, worker_pid, pool_pids = sandbox.run(extract_with_page_pool, pdf, 2)
+    assert pages == page_count
+    assert worker_pid != os.getpid()
+    assert len(pool_pids) == 2
+    assert worker_pid not in pool_pids
+
+
+def test_page_pool_size_is_capped_in_workers(sandbox):
+    sandbox.child_processes = 1
+    pdf = make_pdf(max(pdf_extraction.PARALLEL_MIN_PAGES, 2) + 4)
+    _, _, pool_pids = sandbox.run(extract_with_page_pool, pdf, 4)
+    assert pool_pids == []
+
+
+def test_mapped_uploads_reach_the_worker_as_a_map(sandbox):
+    pdf = make_pdf(2)
+    assert sandbox.run(describe_buffer, spool_buffer(pdf)) == ('MappedUpload', pdf[:8])
+
+
+def test_sandboxed_text_matches_in_process_extraction(sandbox):
+    pdf = make_pdf(3)
+    assert sandbox.run(pdf_extraction.extract_pdf_pages, pdf, 1) == pdf_extraction.extract_pdf_pages(pdf, 1)
+
+
+def test_timeout_replaces_the_worker(sandbox):
+    sandbox.timeout = 0.5
+    with pytest.raises(ExtractionTimeoutError):
+        sandbox.run(sleep_for, 10)
+    sandbox.timeout = 30
+    assert sandbox.run(sleep_for, 0) == 0
+    stats = sandbox.stats()
+    assert stats['timed_out'] == 1
+    assert stats['workers_replaced'] == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'setpgrp'), reason="memory limits need RLIMIT_AS")
+def test_memory_limit_is_enforced(sandbox):
+    sandbox.memory_limit_mb = 64
+    with pytest.raises(ExtractionError, match="more memory"):
+        sandbox.run(allocate, 1024)
+    assert sandbox.run(allocate, 8) == 8 * 1024 * 1024
+
+
+def test_crashed_worker_is_reported_and_replaced(sandbox):
+    with pytest.raises(ExtractionError, match="crashed"):
+        sandbox.run(exit_abruptly)
+    assert sandbox.run(sleep_for, 0) == 0
+
+
+def test_parser_errors_keep_the_worker(sandbox):
+    with pytest.raises(ExtractionError, match="ValueError: malformed document"):
+        sandbox.run(fail)
+    assert sandbox.run(sleep_for, 0) == 0
+    assert sandbox.stats()['workers_started'] == 1
+
+
+def test_close_stops_every_worker(sandbox):
+    sandbox.run(sleep_for, 0)
+    worker = sandbox._idle[0]
+    sandbox.close()
+    assert not worker.process.is_alive()
+    assert sandbox.run(sleep_for, 0) == 0
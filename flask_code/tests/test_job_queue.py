@@ -0,0 +1,94 @@
+import threading
+import time
+from io import BytesIO
+
+import pytest
+
+import nego
+from job_queue import JobQueue, QueueFullError
+from samples import make_pdf
+
+
+def blocking_queue(max_pending):
+    """A one-worker queue whose first job holds the worker until release is set"""
+    release = threading.Event()
+    jobs = JobQueue(workers=1, max_pending=max_pending)
+    running = jobs.submit(release.wait)
+    while jobs.get(running)['status'] == 'queued':
+        time.sleep(0.01)
+    return jobs, release, running
+
+
+def test_jobs_complete_and_report_their_result():
+    jobs = JobQueue(workers=2)
+    job_id = jobs.submit(sum, [1, 2, 3])
+    job = jobs.get(job_id, wait=5)
+    assert job['status'] == 'completed'
+    assert job['result'] == 6
+    assert jobs.stats()['completed'] == 1
+
+
+def test_failed_job_keeps_its_error():
+    jobs = JobQueue(workers=1)
+    job = jobs.get(jobs.submit(int, 'not a number'), wait=5)
+    assert job['status'] == 'failed'
+    assert 'invalid literal' in job['error']
+
+
+def test_full_queue_rejects_with_retry_after():
+    jobs, release, running = blocking_queue(max_pending=2)
+    queued = [jobs.submit(sum, [index]) for index in range(2)]
+    assert [jobs.get(job_id)['queue_position'] for job_id in queued] == [1, 2]
+    with pytest.raises(QueueFullError) as rejected:
+        jobs.submit(sum, [3])
+    assert rejected.value.retry_after >= 1
+    assert jobs.stats()['rejected'] == 1
+    release.set()
+    assert all(jobs.get(job_id, wait=5)['status'] == 'completed' for job_id in [running] + queued)
+
+
+def test_workers_start_with_the_first_job():
+    before = threading.active_count()
+    jobs = JobQueue(workers=3)
+    assert threading.active_count() == before
+    jobs.get(jobs.submit(sum, []), wait=5)
+    assert threading.active_count() == before + 3
+
+
+def test_finished_jobs_expire_after_retention():
+    jobs = JobQueue(workers=1, retention_seconds=0)
+    job_id = jobs.submit(sum, [])
+    assert jobs.get(job_id, wait=5)['status'] == 'completed'
+    jobs.submit(sum, [])
+    assert jobs.get(job_id) is None
+
+
+def post_job(client, content):
+    return client.post('/jobs', data={'document': (BytesIO(content), 'contract.pdf')},
+                       content_type='multipart/form-data')
+
+
+def test_job_endpoint_returns_the_analysis(client, monkeypatch):
+    monkeypatch.setattr(nego, 'job_queue', JobQueue(workers=1))
+    response = post_job(client, make_pdf(2))
+    assert response.status_code == 202
+    job = client.get(f"{response.get_json()['status_url']}?wait=10").get_json()
+    assert job['status'] == 'completed'
+    assert job['result']['status'] == 'success'
+
+
+def test_job_endpoint_answers_429_when_full(client, monkeypatch):
+    jobs, release, _ = blocking_queue(max_pending=1)
+    monkeypatch.setattr(nego, 'job_queue', jobs)
+    try:
+        assert post_job(client, make_pdf(1)).status_code == 202
+        response = post_job(client, make_pdf(1))
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) == response.get_json()['retry_after'] >= 1
+    finally:
+        release.set()
+
+
+def test_unknown_job_and_bad_wait(client):
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/jobs/missing?wait=soon').status_code == 400
@@ -0,0 +1,47 @@
+import nego
+from samples import make_contract
+
+CONTRACT = (
+    'This Agreement is made between Acme Holdings (the "Company") and Jane Doe. '
+    "The term begins January 5, 2024 and the first invoice is due by March 1, 2024. "
+    "The renewal date is 03/15/2025. The Client shall pay a fee of $12,500.00 within 30 days. "
+    "The Company may terminate this agreement on notice. "
+    "This Agreement is governed by the laws of the State of New York."
+)
+
+
+def test_extracts_each_kind_of_value():
+    key_info = nego.extract_key_information_enhanced(CONTRACT)
+    assert "Acme Holdings" in key_info["parties"]
+    assert {"January 5, 2024", "March 1, 2024", "03/15/2025"} <= set(key_info["dates"])
+    assert any("12,500.00" in amount for amount in key_info["amounts"])
+    assert any("terminate" in clause for clause in key_info["termination_clauses"])
+    assert any("governed by" in clause for clause in key_info["governing_law"])
+
+
+def test_entity_offsets_point_into_the_original_text():
+    key_info = nego.extract_key_information_enhanced(CONTRACT)
+    assert key_info["entities"]
+    for entity in key_info["entities"]:
+        # Clause values are whitespace-collapsed and may be shortened with an ellipsis
+        span = " ".join(CONTRACT[entity["start"]:entity["end"]].split())
+        assert entity["text"].removesuffix("...") in span
+
+
+def test_values_are_deduplicated_case_insensitively_in_document_order():
+    text = "Payment of $500 is due. A later payment of $500 is due. Then $700 more, and $500 again."
+    amounts = nego.extract_key_information_enhanced(text)["amounts"]
+    assert len(amounts) == len({amount.lower() for amount in amounts})
+    assert amounts.index("$500") < amounts.index("$700")
+
+
+def test_clause_buckets_are_capped():
+    text = " ".join(f"The Client shall deliver report {index}." for index in range(50))
+    key_info = nego.extract_key_information_enhanced(text)
+    assert len(key_info["obligations"]) == nego.MAX_CLAUSES_PER_BUCKET
+
+
+def test_every_bucket_value_has_an_entity():
+    key_info = nego.extract_key_information_enhanced(make_contract(50_000))
+    bucket_values = sum(len(values) for bucket, values in key_info.items() if bucket != "entities")
+    assert bucket_values == len(key_info["entities"])
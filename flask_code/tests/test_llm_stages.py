@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import nego
+
+STAGE_SECONDS = 0.3
+
+
+@pytest.fixture
+def slow_stages(monkeypatch):
+    """Stand-ins for the two model calls that each take STAGE_SECONDS and record their inputs"""
+    calls = {}
+
+    def summary(text, key_info, contract_type):
+        time.sleep(STAGE_SECONDS)
+        return 'summary text', 'vertex_ai'
+
+    def risks(text, summary_text, contract_type, secondary_types):
+        calls['risk_summary'] = summary_text
+        time.sleep(STAGE_SECONDS)
+        return [{'risk_type': 'test'}], 'rules_based'
+
+    monkeypatch.setattr(nego, 'generate_enhanced_summary_with_vertex_ai', summary)
+    monkeypatch.setattr(nego, 'analyze_risks_with_enhanced_vertex_ai', risks)
+    return calls
+
+
+def test_sequential_stages_pass_the_summary_to_the_risk_stage(slow_stages):
+    start = time.perf_counter()
+    summary, risks, latency, methods = nego.run_llm_stages('text', {}, 'general', [], 'sequential')
+    assert time.perf_counter() - start >= 2 * STAGE_SECONDS
+    assert slow_stages['risk_summary'] == 'summary text'
+    assert summary == 'summary text' and risks == [{'risk_type': 'test'}]
+    assert methods == {'summary': 'vertex_ai', 'risk_analysis': 'rules_based'}
+    assert set(latency) == {'summary', 'risk_analysis'}
+
+
+def test_concurrent_stages_overlap(slow_stages):
+    start = time.perf_counter()
+    summary, risks, latency, methods = nego.run_llm_stages('text', {}, 'general', [], 'concurrent')
+    elapsed = time.perf_counter() - start
+    assert elapsed < 2 * STAGE_SECONDS
+    assert slow_stages['risk_summary'] == ''
+    assert summary == 'summary text' and risks == [{'risk_type': 'test'}]
+    assert methods == {'summary': 'vertex_ai', 'risk_analysis': 'rules_based'}
+    assert all(ms >= STAGE_SECONDS * 1000 for ms in latency.values())
+
+
+def test_concurrent_stages_are_yielded_in_completion_order(monkeypatch):
+    monkeypatch.setattr(nego, 'generate_enhanced_summary_with_vertex_ai',
+                        lambda *args: (time.sleep(STAGE_SECONDS), ('late', 'fallback'))[1])
+    monkeypatch.setattr(nego, 'analyze_risks_with_enhanced_vertex_ai', lambda *args: ([], 'rules_based'))
+    stages = [stage for stage, *_ in nego.iter_llm_stages('text', {}, 'general', [], 'concurrent')]
+    assert stages == ['risk_analysis', 'summary']
+
+
+def test_unknown_default_pipeline_mode_falls_back_to_sequential():
+    env = dict(os.environ, PIPELINE_MODE='parallel')
+    result = subprocess.run([sys.executable, '-c', 'import nego; print(nego.DEFAULT_PIPELINE_MODE)'],
+                            cwd=os.path.dirname(nego.__file__), env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip().splitlines()[-1] == 'sequential'
+    assert "Unknown PIPELINE_MODE 'parallel'" in result.stderr
@@ -0,0 +1,59 @@
+from page_index import PageIndex, annotate_clause_pages, annotate_entity_pages, find_quote_pages, locate_text
+from text_normalization import normalize_text
+
+TEXT = ("--- Page 1 ---\nThe Client shall pay the fee.\n"
+        "--- Page 2 (OCR) ---\nThe Provider may terminate this agreement without cause.\n"
+        "--- Page 3 (OCR) ---\nNotices must be given in writing.\n"
+        "--- Page 4 (extraction failed) ---\n\n"
+        "--- Page 5 ---\nDisputes go to binding arbitration in Delaware.\n")
+
+
+def test_index_reads_every_marker_form():
+    index = PageIndex.from_text(TEXT)
+    assert index.pages.tolist() == [1, 2, 3, 4, 5]
+    assert index.page_count == 5
+
+
+def test_page_at_finds_the_enclosing_page():
+    index = PageIndex.from_text(TEXT)
+    assert index.page_at(0) == 1
+    assert index.page_at(TEXT.index("terminate")) == 2
+    assert index.page_at(TEXT.index("arbitration")) == 5
+    assert index.page_at(None) is None
+
+
+def test_text_without_markers_has_no_pages():
+    index = PageIndex.from_text("Plain text from a DOCX file.")
+    assert not index and index.page_count == 0
+    assert index.page_at(5) is None
+
+
+def test_locate_text_ignores_whitespace_differences():
+    assert locate_text(TEXT, "may  terminate\nthis agreement") == TEXT.index("may terminate")
+    assert locate_text(TEXT, "not in the document") is None
+
+
+def test_entities_are_mapped_to_original_offsets_and_pages():
+    normalized = normalize_text(TEXT)
+    start = normalized.text.index("binding arbitration")
+    entities = [{'start': start, 'end': start + len("binding arbitration")}]
+    annotate_entity_pages(entities, normalized, PageIndex.from_text(TEXT))
+    assert TEXT[entities[0]['start']:entities[0]['end']] == "binding arbitration"
+    assert entities[0]['page'] == 5
+
+
+def test_quoted_passages_are_given_their_page():
+    normalized = normalize_text(TEXT)
+    answer = 'The contract says "The Provider may terminate this agreement without cause".'
+    assert find_quote_pages(answer, normalized, PageIndex.from_text(TEXT)) == [
+        {'quote': "The Provider may terminate this agreement without cause", 'page': 2}]
+
+
+def test_clauses_are_placed_and_lose_their_match_offset():
+    normalized = normalize_text(TEXT)
+    clauses = [{'clause_text': "Notices must be given in writing.",
+                'match_offset': normalized.text.index("Notices")},
+               {'clause_text': "Disputes go to binding arbitration in Delaware."}]
+    annotate_clause_pages(clauses, normalized, PageIndex.from_text(TEXT))
+    assert [clause['page'] for clause in clauses] == [3, 5]
+    assert all('match_offset' not in clause for clause in clauses)
@@ -0,0 +1,39 @@
+import mmap
+
+import pytest
+
+import pdf_extraction
+from samples import legacy_pdf_text, make_pdf
+
+
+@pytest.mark.parametrize("page_count, chunks", [(1, 4), (10, 3), (16, 16), (17, 4)])
+def test_page_ranges_cover_every_page_once(page_count, chunks):
+    ranges = pdf_extraction.page_ranges(page_count, chunks)
+    assert len(ranges) == min(chunks, page_count)
+    assert [page for start, end in ranges for page in range(start, end)] == list(range(page_count))
+    sizes = [end - start for start, end in ranges]
+    assert max(sizes) - min(sizes) <= 1
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_page_parallel_text_matches_the_page_loop(processes):
+    pdf = make_pdf(pdf_extraction.PARALLEL_MIN_PAGES + 5)
+    pages = pdf_extraction.extract_pdf_pages(pdf, processes=processes)
+    assert len(pages) == pdf_extraction.PARALLEL_MIN_PAGES + 5
+    assert pdf_extraction.format_pdf_pages(pages) == legacy_pdf_text(pdf)
+
+
+def test_memory_mapped_uploads_are_extracted(tmp_path):
+    path = tmp_path / "contract.pdf"
+    path.write_bytes(make_pdf(pdf_extraction.PARALLEL_MIN_PAGES))
+    with open(path, "rb") as source:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    assert pdf_extraction.format_pdf_pages(pdf_extraction.extract_pdf_pages(mapped, processes=2)) == \
+        legacy_pdf_text(path.read_bytes())
+
+
+def test_failed_pages_are_marked():
+    text = pdf_extraction.format_pdf_pages(["first", None, "third"])
+    assert text == ("\n--- Page 1 ---\nfirst\n"
+                    "\n--- Page 2 (extraction failed) ---\n"
+                    "\n--- Page 3 ---\nthird\n")
@@ -0,0 +1,75 @@
+import pytest
+
+import retrieval
+from retrieval import BM25Index, Chunk, DenseIndex, DocumentRetriever, HashedNgramEmbedding, chunk_text, tokenize
+
+CLAUSES = [
+    "The Client shall pay each invoice within thirty days of receipt.",
+    "Either party may terminate this Agreement on ninety days written notice.",
+    "All information exchanged is confidential and shall not be disclosed to third parties.",
+    "Any dispute shall be resolved by binding arbitration in Delaware.",
+    "Late payments accrue a penalty of two percent per month.",
+]
+FILLER = "The parties acknowledge the recitals and the general background of the arrangement.\n" * 12
+
+
+def build_document():
+    return "".join(f"{FILLER}{clause}\n" for clause in CLAUSES) + FILLER
+
+
+def test_tokenize_drops_stopwords_and_plurals():
+    assert tokenize("The fees of the Parties") == ["fee", "partie"]
+    assert tokenize("access") == ["access"]
+
+
+def test_chunks_cover_the_text_within_the_size_limit():
+    text = build_document() + "x" * 2500 + " tail"
+    chunks = chunk_text(text, chunk_chars=500)
+    assert all(len(chunk.text) <= 500 for chunk in chunks)
+    assert all(text[chunk.start:chunk.start + len(chunk.text)] == chunk.text for chunk in chunks)
+    assert chunks[-1].text.endswith("tail")
+
+
+def test_bm25_ranks_the_chunk_with_the_query_terms_first():
+    index = BM25Index(chunk_text(build_document(), chunk_chars=300))
+    best, score = index.search("binding arbitration dispute", k=3)[0]
+    assert "arbitration" in best.text and score > 0
+    assert index.search("unrelated zebra", k=3) == []
+
+
+def clause_chunks():
+    return [Chunk(index * 100, clause) for index, clause in enumerate(CLAUSES)]
+
+
+@pytest.mark.skipif(not retrieval.NUMPY_AVAILABLE, reason="NumPy is not installed")
+@pytest.mark.parametrize("question, expected", [
+    ("can I quit or fire them", "terminate"),
+    ("who do I sue", "arbitration"),
+    ("is it secret", "confidential"),
+])
+def test_dense_index_matches_paraphrased_questions(question, expected):
+    chunks = clause_chunks()
+    # No query word appears in the clauses, so only the embedding can find them
+    assert BM25Index(chunks).search(question, k=1) == []
+    best, score = DenseIndex(chunks, HashedNgramEmbedding()).search(question, k=1)[0]
+    assert expected in best.text and score > 0
+
+
+@pytest.mark.skipif(not retrieval.NUMPY_AVAILABLE, reason="NumPy is not installed")
+def test_large_dense_matrices_are_memory_mapped(monkeypatch):
+    monkeypatch.setattr(retrieval, "DENSE_MMAP_BYTES", 0)
+    index = DenseIndex(clause_chunks(), HashedNgramEmbedding())
+    assert index.memory_mapped
+    assert "confidential" in index.search("is it secret", k=1)[0][0].text
+
+
+def test_context_is_in_document_order():
+    retriever = DocumentRetriever(build_document())
+    context = retriever.context("penalty for late invoice payment", k=3)
+    assert context.index("invoice") < context.index("penalty")
+
+
+def test_context_falls_back_to_the_opening_chunks(monkeypatch):
+    monkeypatch.setattr(retrieval, "NUMPY_AVAILABLE", False)
+    retriever = DocumentRetriever(build_document())
+    assert retriever.context("zebra", k=1) == retriever.chunks[0].text
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+import nego
+from samples import SAMPLE_CLAUSES, legacy_rule_hits, make_contract
+
+CONTRACT_TYPES = ['general'] + list(nego.CONTRACT_TYPE_PATTERNS)
+
+RISKY_CLAUSES = [
+    "The Company may terminate this agreement at any time without cause.",
+    "The Client accepts unlimited liability for all losses arising under this agreement.",
+    "This subscription will automatically renew for successive terms.",
+    "Any dispute shall be settled by binding arbitration in Delaware.",
+    "Upon breach the Client shall pay liquidated damages of $50,000.",
+    "The setup deposit is non-refundable.",
+]
+
+
+@pytest.mark.parametrize("contract_type", CONTRACT_TYPES)
+@pytest.mark.parametrize("size", [5_000, 50_000])
+def test_scanner_finds_the_same_risk_types_as_the_per_pattern_loop(contract_type, size):
+    text = make_contract(size)
+    scanner = nego.get_risk_scanner(contract_type)
+    hits = scanner.scan(text, time_budget=None)
+    assert set(hits) == set(legacy_rule_hits(text, "", scanner.risk_patterns))
+
+
+def test_each_risk_type_is_found_in_its_clause():
+    text = " ".join(RISKY_CLAUSES)
+    hits = nego.get_risk_scanner("general").scan(text, time_budget=None)
+    assert set(hits) == set(nego.COMPREHENSIVE_RISK_PATTERNS)
+    for risk_type, (start, end) in hits.items():
+        assert 0 <= start < end <= len(text)
+
+
+def test_benign_text_has_no_hits():
+    assert nego.get_risk_scanner("general").scan(make_contract(20_000, risky=False), time_budget=None) == {}
+
+
+def test_matches_stay_inside_one_clause():
+    # Termination and 'without cause' sit in different sentences, so the greedy pattern must not join them
+    text = "Either party may terminate this agreement. The work is done without delay and for good cause."
+    assert "termination_without_cause" not in nego.get_risk_scanner("general").scan(text, time_budget=None)
+
+
+def test_clause_windows_are_bounded_and_cover_the_text():
+    text = ("word " * 2_000) + "End. " + "short clause; " * 10
+    windows = list(nego.iter_clause_windows(text))
+    assert all(end - start <= nego.MAX_CLAUSE_CHARS for start, end in windows)
+    assert windows[0][0] == 0 and windows[-1][1] == len(text)
+    assert all(next_start <= end for (_, end), (next_start, _) in zip(windows, windows[1:]))
+
+
+def test_single_line_input_scans_in_linear_time():
+    unit = "the provider may terminate the agreement without delay and shall continue "
+    text = unit * (200_000 // len(unit))
+    start = time.perf_counter()
+    hits = nego.get_risk_scanner("general").scan(text, time_budget=None)
+    assert time.perf_counter() - start < 5
+    assert "termination_without_cause" not in hits
+
+
+def test_prefilter_does_not_change_results():
+    scanner = nego.get_risk_scanner("general")
+    for text in [make_contract(30_000), make_contract(30_000, risky=False) + " " + SAMPLE_CLAUSES[5]]:
+        assert scanner.scan(text, time_budget=None) == scanner.scan(text, time_budget=None, use_prefilter=False)
+
+
+def test_prefilter_skips_types_without_anchors_in_the_text():
+    scanner = nego.get_risk_scanner("general")
+    candidates = scanner.anchor_index.candidate_types(nego.fold_case("All disputes go to binding arbitration."))
+    assert "binding_arbitration" in candidates
+    assert "non_refundable_trap" not in candidates
+
+
+def test_fold_case_keeps_offsets_for_non_ascii_text():
+    text = "İstanbul Office may TERMINATE without cause"
+    folded = nego.fold_case(text)
+    assert len(folded) == len(text)
+    assert folded.endswith("terminate without cause")
+
+
+def test_rules_engine_quotes_the_sentence_around_each_match():
+    text = make_contract(10_000)
+    clauses = nego.analyze_risks_with_enhanced_rules(text, "", "general")
+    assert clauses
+    for clause in clauses:
+        offset = clause["match_offset"]
+        assert text[offset:offset + 20] in clause["clause_text"]
+
+
+@pytest.mark.parametrize("pattern, anchored", [
+    (r"(?i)late.*fee", True),
+    (r"(?:late|overdue) fee", False),
+    (r"(?:late fee|late charge)", True),
+    (r"(?:late)? fee", False),
+    (r"late(?:ness)? fee", True),
+])
+def test_anchors_must_be_required_by_every_pattern(pattern, anchored):
+    index = nego.AnchorIndex({"late_fee": {"patterns": [pattern], "anchors": ["late"]}})
+    assert ("late_fee" not in index.always_candidates) == anchored
+    # An unanchored type stays a candidate for text its anchor never appears in
+    assert ("late_fee" in index.candidate_types("an overdue fee applies")) == (not anchored)
+
+
+def test_builtin_anchors_are_required_by_their_patterns():
+    for scanner in nego.RISK_SCANNERS.values():
+        assert scanner.anchor_index.always_candidates == set()
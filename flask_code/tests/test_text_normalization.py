@@ -0,0 +1,46 @@
+import pytest
+
+from text_normalization import normalize_text, sentence_starts, sentence_window
+
+RAW = ("--- Page 1 ---\n"
+       "The   Client shall pay\tthe fee.\n\n"
+       "The con-\n  tractor agrees to the terms.\n"
+       "--- Page 2 ---\n"
+       "Either party may terminate.  \n")
+
+
+def test_markers_hyphens_and_whitespace_are_normalized():
+    assert normalize_text(RAW).text == ("The Client shall pay the fee.\n"
+                                        "The contractor agrees to the terms.\n"
+                                        "Either party may terminate.")
+
+
+@pytest.mark.parametrize("word", ["Client", "fee", "tractor", "agrees", "terminate"])
+def test_offsets_map_back_to_the_original(word):
+    normalized = normalize_text(RAW)
+    offset = normalized.text.index(word)
+    original = normalized.to_original(offset)
+    assert RAW[original:original + len(word)] == word
+
+
+def test_result_is_reused_for_the_same_text():
+    assert normalize_text(RAW) is normalize_text(RAW)
+
+
+def test_hyphens_between_non_letters_are_kept():
+    assert normalize_text("pages 10-\n12 apply").text == "pages 10-\n12 apply"
+
+
+def test_sentence_window_takes_neighbouring_sentences():
+    text = "First one. Second one. Third one. Fourth one."
+    start = text.index("Third")
+    window = sentence_window(text, sentence_starts(text), start, start + 5)
+    assert text[window[0]:window[1]].strip() == "Second one. Third one. Fourth one."
+
+
+def test_sentence_window_is_limited_by_context():
+    text = "word " * 200 + "target " + "word " * 200
+    start = text.index("target")
+    window_start, window_end = sentence_window(text, sentence_starts(text), start, start + 6, context=50)
+    assert start - window_start <= 50 and window_end - (start + 6) <= 50
+    assert text[window_start - 1] == " " and text[window_end] == " "
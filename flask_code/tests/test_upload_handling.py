@@ -0,0 +1,89 @@
+import io
+import mmap
+import pickle
+import tempfile
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import nego
+from upload_handling import MappedUpload, MemoryReader, map_upload, open_buffer, read_head, spool_buffer, upload_size
+
+CONTENT = bytes(range(256)) * 64
+
+
+def spooled(content):
+    spool = tempfile.TemporaryFile('wb+')
+    spool.write(content)
+    spool.seek(0)
+    return FileStorage(stream=spool, filename='contract.pdf')
+
+
+def test_size_and_head_leave_the_stream_at_the_start():
+    file = spooled(CONTENT)
+    assert upload_size(file) == len(CONTENT)
+    assert read_head(file, 100) == CONTENT[:100]
+    assert file.stream.tell() == 0
+
+
+def test_spooled_upload_is_memory_mapped():
+    content = map_upload(spooled(CONTENT))
+    assert isinstance(content, mmap.mmap)
+    assert content[:] == CONTENT
+
+
+def test_mapped_upload_pickles_as_a_descriptor():
+    content = spool_buffer(CONTENT)
+    payload = pickle.dumps(content)
+    assert len(payload) < 1024
+    restored = pickle.loads(payload)
+    assert isinstance(restored, MappedUpload) and restored[:] == CONTENT
+
+
+def test_in_memory_upload_is_read():
+    assert map_upload(FileStorage(stream=BytesIO(CONTENT), filename='contract.pdf')) == CONTENT
+
+
+@pytest.mark.parametrize("buffer", [CONTENT, bytearray(CONTENT)])
+def test_memory_reader_reads_and_seeks_like_a_file(buffer):
+    reader = io.BufferedReader(MemoryReader(buffer))
+    assert reader.read(10) == CONTENT[:10]
+    reader.seek(-5, io.SEEK_END)
+    assert reader.read() == CONTENT[-5:]
+    reader.seek(100)
+    assert reader.read(3) == CONTENT[100:103]
+
+
+def test_open_buffer_reads_maps_in_place():
+    content = map_upload(spooled(CONTENT))
+    stream = open_buffer(content)
+    assert isinstance(stream.raw, MemoryReader)
+    assert stream.read() == CONTENT
+
+
+def post(client, content, filename):
+    return client.post('/analyze-document', data={'document': (BytesIO(content), filename)},
+                       content_type='multipart/form-data')
+
+
+def test_requests_spool_uploads_to_disk():
+    with nego.app.test_request_context('/analyze-document', method='POST',
+                                       data={'document': (BytesIO(b'%PDF-1.4 small'), 'contract.pdf')}):
+        assert isinstance(map_upload(nego.request.files['document']), mmap.mmap)
+
+
+def test_unsupported_type_is_rejected_before_extraction(client, monkeypatch):
+    def fail(*args):
+        raise AssertionError("extraction must not run")
+
+    monkeypatch.setattr(nego, 'extract_text_with_document_ai', fail)
+    response = post(client, b'MZ\x90\x00 not a document', 'tool.exe')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Unsupported file type'
+
+
+def test_empty_and_oversized_uploads_are_rejected(client, monkeypatch):
+    assert post(client, b'', 'contract.pdf').status_code == 400
+    monkeypatch.setattr(nego, 'MAX_FILE_SIZE', 10)
+    assert post(client, b'%PDF-1.4 ' + b'x' * 20, 'contract.pdf').status_code == 413
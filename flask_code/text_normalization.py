@@ -0,0 +1,98 @@
+import re
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Tuple
+
+# Section markers written by the extractors, on a line of their own
+MARKER_LINE = r'^--- (?:Pages? \d[^\n]*|Header|Footer) ---$'
+# Marker lines with the whitespace around them, words hyphenated across a line break,
+# and any other run of whitespace
+NORMALIZE_PATTERN = re.compile(
+    rf'(?P<marker>\s*{MARKER_LINE}\s*)'
+    r'|(?P<hyphen>(?<=[a-z])-[ \t]*\n\s*(?=[a-z]))'
+    r'|(?P<space>\s+)',
+    re.MULTILINE
+)
+SENTENCE_END_PATTERN = re.compile(r'[.!?]+')
+# Normalized documents kept for reuse by later analyzers and requests
+NORMALIZED_CACHE_SIZE = 32
+
+class NormalizedText:
+    """Extracted text prepared once for every analyzer, with a map back to the original.
+
+    Page and section markers are removed, words split by a line-break hyphen are
+    joined, and whitespace runs become one space, or one newline when they span
+    lines. The offset map stores one entry per copied run, so to_original is a
+    binary search.
+    """
+
+    __slots__ = ('text', '_starts', '_original_starts')
+
+    def __init__(self, text: str, starts: array, original_starts: array):
+        self.text = text
+        self._starts = starts
+        self._original_starts = original_starts
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def to_original(self, offset: int) -> int:
+        """Offset in the original text of a normalized offset"""
+        segment = bisect_right(self._starts, offset) - 1
+        if segment < 0:
+            return offset
+        return self._original_starts[segment] + offset - self._starts[segment]
+
+def _build_normalized(original: str) -> NormalizedText:
+    parts = []
+    starts = array('I')
+    original_starts = array('I')
+    length = 0
+    copied_until = 0
+
+    def emit(text: str, original_offset: int) -> None:
+        nonlocal length
+        if text:
+            parts.append(text)
+            starts.append(length)
+            original_starts.append(original_offset)
+            length += len(text)
+
+    for match in NORMALIZE_PATTERN.finditer(original):
+        emit(original[copied_until:match.start()], copied_until)
+        copied_until = match.end()
+        # Whitespace and markers at either end of the document are dropped entirely
+        if match.group('hyphen') is not None or match.start() == 0 or match.end() == len(original):
+            continue
+        emit('\n' if match.group('marker') is not None or '\n' in match.group() else ' ', match.start())
+    emit(original[copied_until:], copied_until)
+
+    return NormalizedText(''.join(parts), starts, original_starts)
+
+@lru_cache(maxsize=NORMALIZED_CACHE_SIZE)
+def normalize_text(original: str) -> NormalizedText:
+    """Normalize extracted text, reusing the result for a document seen recently"""
+    return _build_normalized(original)
+
+def sentence_starts(text: str) -> array:
+    """Start offset of every sentence in text, for repeated sentence_window lookups"""
+    starts = array('I', [0])
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        starts.append(match.end())
+    return starts
+
+def sentence_window(text: str, starts: array, start: int, end: int, context: int = 100) -> Tuple[int, int]:
+    """Span of the sentences around [start, end), one either side, within context characters"""
+    first = max(0, bisect_right(starts, start) - 2)
+    last = bisect_right(starts, end) + 1
+    sentences_end = starts[last] if last < len(starts) else len(text)
+    window_start, window_end = starts[first], sentences_end
+    # Windows cut short by the context limit end on a word boundary
+    if start - context > window_start:
+        boundary = text.find(' ', start - context, start)
+        window_start = boundary + 1 if boundary >= 0 else start - context
+    if end + context < window_end:
+        boundary = text.rfind(' ', end, end + context)
+        window_end = boundary if boundary >= 0 else end + context
+    return window_start, window_end
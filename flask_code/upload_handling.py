@@ -0,0 +1,140 @@
+import io
+import logging
+import mmap
+import os
+import tempfile
+import weakref
+from io import BytesIO
+from multiprocessing import reduction
+from typing import Any, BinaryIO, Optional, Union
+
+from flask import Request
+from werkzeug.datastructures import FileStorage
+
+logger = logging.getLogger(__name__)
+
+# Enough of the file for signature and python-magic based type detection
+SNIFF_BYTES = 8192
+
+Buffer = Union[bytes, mmap.mmap]
+
+class SpooledRequest(Request):
+    """Request that spools every uploaded file to an anonymous temp file.
+
+    Werkzeug keeps uploads under 500 KB in memory; spooling all of them to disk
+    lets the routes memory-map the upload instead of reading it into a bytes copy.
+    """
+
+    def _get_file_stream(self, total_content_length: Optional[int], content_type: Optional[str],
+                         filename: Optional[str] = None, content_length: Optional[int] = None) -> BinaryIO:
+        return tempfile.TemporaryFile('wb+')
+
+def _map_shared_fd(handle: Any) -> 'MappedUpload':
+    fileno = handle.detach()
+    try:
+        return MappedUpload(fileno)
+    finally:
+        os.close(fileno)
+
+class MappedUpload(mmap.mmap):
+    """Read-only map of a spooled upload that keeps a descriptor of the file.
+
+    Pickling sends the descriptor instead of the content, so a worker process
+    maps the same file rather than receiving a copy of it.
+    """
+
+    def __new__(cls, fileno: int) -> 'MappedUpload':
+        self = super().__new__(cls, fileno, 0, access=mmap.ACCESS_READ)
+        self.fd = os.dup(fileno)
+        weakref.finalize(self, os.close, self.fd)
+        return self
+
+    def __reduce__(self):
+        return _map_shared_fd, (reduction.DupFd(self.fd),)
+
+class MemoryReader(io.RawIOBase):
+    """Seekable read-only file over a buffer; reads slice it instead of copying it whole"""
+
+    def __init__(self, buffer: Buffer):
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = self._view[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        self._view.release()
+        super().close()
+
+def upload_size(file: FileStorage) -> int:
+    """Size of an uploaded file without reading it"""
+    stream = file.stream
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+def read_head(file: FileStorage, size: int = SNIFF_BYTES) -> bytes:
+    """First bytes of an upload, for type detection before the body is touched"""
+    stream = file.stream
+    stream.seek(0)
+    head = stream.read(size)
+    stream.seek(0)
+    return head
+
+def map_upload(file: FileStorage) -> Buffer:
+    """Memory-map a spooled upload read-only, or read it when it is not backed by a file.
+
+    The map stays valid after the request closes the spool file; it is released
+    when the last reference to it goes away.
+    """
+    stream = file.stream
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        stream.seek(0)
+        return stream.read()
+    stream.flush()
+    return MappedUpload(fileno)
+
+def spool_buffer(file_content: Buffer) -> MappedUpload:
+    """Write a buffer to an anonymous temp file and map it, so processes can share it"""
+    with tempfile.TemporaryFile('wb+') as spool:
+        spool.write(file_content)
+        spool.flush()
+        return MappedUpload(spool.fileno())
+
+def open_buffer(file_content: Buffer) -> BinaryIO:
+    """File object for parsers; bytes are shared by BytesIO, maps are read in place"""
+    if isinstance(file_content, bytes):
+        return BytesIO(file_content)
+    return io.BufferedReader(MemoryReader(file_content))